@@ -33,6 +33,7 @@ experimental in comparison.
 import collections
 from datetime import datetime
 import json
+from multiprocessing.pool import ThreadPool
 import time
 
 from gentle_da92de4118f6fa91_oldcore import *
@@ -185,6 +186,9 @@ class GentleNext(Gentle):
     # empty version document):
     PREV_VERSION_KEY = "prev_version:metadata:content"
 
+    # Number of threads copying content in export() and import_():
+    COPY_THREADS = 8
+
     def __init__(self, *a, **k):
         super(GentleNext, self).__init__(*a, **k)
         self.empty_content = self.put("")
@@ -355,8 +359,18 @@ class GentleNext(Gentle):
                 contents.extend(sublist)
             else:
                 raise Exception, "FATAL: findall() returned invalid data"
-        for c in contents:
-            to_gentle.put(from_gentle.get(c))
+        # Copy the content in several threads, which overlap reading, hashing
+        # (hashlib releases the GIL for large content) and writing.  Each piece
+        # of content is copied once, as two threads creating the same file
+        # would collide:
+        pool = ThreadPool(GentleNext.COPY_THREADS)
+        try:
+            for _ in pool.imap_unordered(lambda c: to_gentle.put(from_gentle.get(c)),
+                                         set(contents), 16):
+                pass
+        finally:
+            pool.close()
+            pool.join()
         for p in pointers:
             to_gentle.put(p, from_gentle.get(p))
 
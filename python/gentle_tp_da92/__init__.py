@@ -7,10 +7,18 @@ from    . import utilities
 # Data store interfaces and implementations:
 from    . import data_store_interfaces
 
+from    . import compact_memory_based
 from    . import fs_based
 from    . import memory_based
+from    . import pack_based
+from    . import shared_memory_based
+from    . import sqlite_based
 
+from    . import caching_wrapper
 from    . import debugging_wrapper
+from    . import metrics_wrapper
+from    . import tiered
+from    . import tracing_wrapper
 
 # Gentle TP-DA92 Python API module:
 from    . import easy
@@ -24,12 +24,18 @@ store.
 
 from __future__ import print_function
 
+import heapq
 import os.path
 import sys
 
 from   ._optparse import *
+from   . import bulk
 from   . import easy
+from   . import fs_based
 from   . import json
+from   . import tracing_wrapper
+from   .benchmarks import dataset
+from   .utilities import *
 
 
 _all_commands = {}
@@ -87,10 +93,7 @@ class Find(_Command):
         return "Find identifiers starting with the argument in the data store"
 
     def run(self):
-        lst = []
-        for arg in self.args:
-            lst += self.gentle.find(arg)
-        for i in sorted(lst):
+        for i in heapq.merge(*[self.gentle.iterfind(arg) for arg in self.args]):
             print(i)
 
 
@@ -101,10 +104,7 @@ class FindC(_Command):
         return "Find identifiers starting with the argument in the content database"
 
     def run(self):
-        lst = []
-        for arg in self.args:
-            lst += self.gentle.c.find(arg)
-        for i in sorted(lst):
+        for i in heapq.merge(*[self.gentle.c.iterfind(arg) for arg in self.args]):
             print(i)
 
 
@@ -115,13 +115,71 @@ class FindP(_Command):
         return "Find identifiers starting with the argument in the pointer database"
 
     def run(self):
-        lst = []
-        for arg in self.args:
-            lst += self.gentle.p.find(arg)
-        for i in sorted(lst):
+        for i in heapq.merge(*[self.gentle.p.iterfind(arg) for arg in self.args]):
             print(i)
 
 
+class Generate(_Command):
+
+    @staticmethod
+    def get_description():
+        return "Populate the data store with a synthetic dataset for load testing"
+
+    @classmethod
+    def get_option_parser(cls, parent_optparser):
+        option_parser = super(Generate, cls).get_option_parser(parent_optparser)
+        option_parser.add_option(
+            "-n", "--contents", type="int", default=dataset.DEFAULT_CONTENTS,
+            help="""Number of content blobs; default: %default"""
+            )
+        option_parser.add_option(
+            "--pointers", type="int", default=dataset.DEFAULT_POINTERS,
+            help="""Number of pointers, each to a version chain;
+                    default: %default"""
+            )
+        option_parser.add_option(
+            "--documents", type="int", default=dataset.DEFAULT_DOCUMENTS,
+            help="""Number of JSON documents referencing blobs and pointers;
+                    default: %default"""
+            )
+        option_parser.add_option(
+            "--versions", type="int", default=dataset.DEFAULT_VERSIONS,
+            help="""Mean length of the version chains; default: %default"""
+            )
+        option_parser.add_option(
+            "--size", type="int", default=dataset.DEFAULT_CONTENT_SIZE,
+            help="""Mean size of the blobs in bytes; default: %default"""
+            )
+        option_parser.add_option(
+            "--distribution", default=dataset.DEFAULT_DISTRIBUTION,
+            choices=list(dataset.DISTRIBUTIONS),
+            help="""Distribution of the blob sizes, one of %s;
+                    default: %%default""" % ", ".join(dataset.DISTRIBUTIONS)
+            )
+        option_parser.add_option(
+            "--seed", type="int", default=dataset.DEFAULT_SEED,
+            help="""Seed of the random data; default: %default"""
+            )
+        option_parser.add_option(
+            "--threads", type="int", default=dataset.DEFAULT_THREADS,
+            help="""Number of batches written in parallel; default: %default"""
+            )
+        return option_parser
+
+    def run(self):
+        if self.args:
+            self.option_parser.error("no arguments expected")
+        o = self.options
+        def progress(done, total):
+            sys.stderr.write("\r%u/%u batches" % (done, total))
+        report = dataset.generate(self.gentle.ds, o.contents, o.pointers,
+                                  o.documents, o.versions, o.size,
+                                  o.distribution, o.seed, threads=o.threads,
+                                  progress=progress)
+        sys.stderr.write("\n")
+        json.pprint(report)
+
+
 class GetC(_Command):
 
     @staticmethod
@@ -134,7 +192,9 @@ class GetC(_Command):
         arg = self.args[0]
         result = self.gentle.c.find(arg)
         if len(result) == 1:
-            print(self.gentle.c[result[0]], end='')
+            with self.gentle.c.open(result[0]) as f:
+                for chunk in read_chunks(f):
+                    sys.stdout.write(chunk)
         else:
             self.option_parser.error("ambiguous identifier: %r" % arg)
 
@@ -166,6 +226,53 @@ class GetP(_Command):
             self.option_parser.error("ambiguous identifier: %r" % arg)
 
 
+class Import(_Command):
+
+    @staticmethod
+    def get_description():
+        return "Put the content of many files into the content database, in parallel"
+
+    @classmethod
+    def get_option_parser(cls, parent_optparser):
+        option_parser = super(Import, cls).get_option_parser(parent_optparser)
+        option_parser.add_option(
+            "-r", "--recursive", default=False, action="store_true",
+            help="""Import the files in directories and their subdirectories"""
+            )
+        option_parser.add_option(
+            "--threads", type="int", default=bulk.DEFAULT_HASH_THREADS,
+            help="""Number of threads reading and hashing files;
+                    default: %default"""
+            )
+        option_parser.add_option(
+            "--window", type="int", default=bulk.DEFAULT_WINDOW_BYTES // (1024 * 1024),
+            help="""Megabytes of content read into memory at once;
+                    default: %default"""
+            )
+        return option_parser
+
+    def _filenames(self):
+        for arg in self.args:
+            if not os.path.isdir(arg):
+                yield arg
+            elif not self.options.recursive:
+                self.option_parser.error("%r is a directory (use -r)" % arg)
+            else:
+                for dirpath, dirnames, filenames in os.walk(arg):
+                    dirnames.sort()
+                    for filename in sorted(filenames):
+                        yield os.path.join(dirpath, filename)
+
+    def run(self):
+        if not self.args:
+            self.option_parser.error("files or directories expected")
+        bulk.set_hash_threads(self.options.threads)
+        for filename, identifier in bulk.add_files(
+                self.gentle.content_db, self._filenames(),
+                self.options.window * 1024 * 1024, self.options.threads):
+            print("%s  %s" % (identifier, filename))
+
+
 class JSON(_Command):
 
     @staticmethod
@@ -254,6 +361,26 @@ class JSON(_Command):
             json.pprint(context)
 
 
+class Layout(_Command):
+
+    @staticmethod
+    def get_description():
+        return "Show or migrate the directory layout of an fs_based data store"
+
+    def run(self):
+        if len(self.args) > 1:
+            self.option_parser.error("at most one argument expected")
+        ds = self.gentle.ds
+        if not isinstance(ds, fs_based.GentleDataStore):
+            self.option_parser.error("not an fs_based data store")
+        if self.args:
+            ds.migrate_layout(self.args[0])
+        for db in (ds.content_db, ds.pointer_db):
+            if isinstance(db, fs_based._GentleDB):
+                print("%s: %s" % (os.path.basename(db.directory),
+                                  fs_based.format_layout(db.layout)))
+
+
 class Put(_Command):
 
     @staticmethod
@@ -264,6 +391,44 @@ class Put(_Command):
         self.option_parser.error("not implemented")
 
 
+class PutC(_Command):
+
+    @staticmethod
+    def get_description():
+        return "Put content from files or standard input into the content database"
+
+    def run(self):
+        if not self.args:
+            print(self.gentle.add_stream(sys.stdin))
+        for arg in self.args:
+            with open(arg, "rb") as f:
+                print(self.gentle.add_stream(f))
+
+
+class Replay(_Command):
+
+    @staticmethod
+    def get_description():
+        return "Replay a trace recorded by tracing_wrapper against the data store"
+
+    @classmethod
+    def get_option_parser(cls, parent_optparser):
+        option_parser = super(Replay, cls).get_option_parser(parent_optparser)
+        option_parser.add_option(
+            "--realtime", default=False, action="store_true",
+            help="""Start the operations at their recorded times, instead of
+                    as fast as possible"""
+            )
+        return option_parser
+
+    def run(self):
+        if len(self.args) != 1:
+            self.option_parser.error("one argument expected")
+        report = tracing_wrapper.replay(self.args[0], self.gentle.ds,
+                                        self.options.realtime)
+        json.pprint(report)
+
+
 class Type(_Command):
 
     @staticmethod
@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Benchmarks.
+
+Repeatable benchmarks of the data store implementations.  Every benchmark runs
+on a fresh data store in a fresh temporary directory: an untimed setup step
+fills the store, then the timed step runs the measured operations.  The
+random data is generated from a fixed seed, so that runs are comparable.
+
+Run the benchmarks and save the results as JSON:
+
+    $ python -m gentle_tp_da92.benchmarks run -o before.json
+    $ python -m gentle_tp_da92.benchmarks run -o after.json -i fs_based -b get
+
+Measure the memory footprint per object of the in-memory structures (see
+benchmarks.memory):
+
+    $ python -m gentle_tp_da92.benchmarks memory -o memory-before.json
+
+See how bulk content entry (see gentle_tp_da92.bulk) scales with the number of
+hashing threads:
+
+    $ python -m gentle_tp_da92.benchmarks run -i memory_based \
+          -b add_bulk_1_threads -b add_bulk_2_threads -b add_bulk_4_threads
+
+Compare two result files, flagging benchmarks that got slower or bigger:
+
+    $ python -m gentle_tp_da92.benchmarks compare before.json after.json
+
+Additional implementations can be benchmarked by registering them:
+
+>>> from gentle_tp_da92 import benchmarks
+>>> benchmarks.register_implementation("my_store", lambda d: my_store.GentleDataStore(d))
+
+or by passing a module name to 'run -i', which is opened using
+gentle_tp_da92.easy.Gentle(<module>, <directory>).
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from   collections import OrderedDict
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+
+from   .. import bulk
+from   .. import caching_wrapper
+from   .. import compact_memory_based
+from   .. import debugging_wrapper
+from   .. import easy
+from   .. import fs_based
+from   .. import memory_based
+from   .. import pack_based
+from   .. import shared_memory_based
+from   .. import sqlite_based
+from   .. import tiered
+from   . import dataset
+
+
+DEFAULT_SIZE = 1000
+DEFAULT_REPEAT = 3
+DEFAULT_SEED = 92
+DEFAULT_THRESHOLD = 0.10
+
+
+## IMPLEMENTATIONS ##
+
+class _NullWriter(object):
+
+    def write(self, data):
+        pass
+
+
+# name -> function(directory) returning a GentleDataStore:
+IMPLEMENTATIONS = OrderedDict()
+
+def register_implementation(name, factory):
+    """
+    Make an implementation available for benchmarking.  factory is called
+    with an empty directory and returns a GentleDataStore.
+    """
+    IMPLEMENTATIONS[name] = factory
+
+register_implementation("memory_based",
+                        lambda d: memory_based.GentleDataStore())
+register_implementation("compact_memory_based",
+                        lambda d: compact_memory_based.GentleDataStore())
+register_implementation("fs_based",
+                        lambda d: fs_based.GentleDataStore(d, mkdir=True))
+register_implementation("fs_based_2_2",
+                        lambda d: fs_based.GentleDataStore(d, mkdir=True, layout="2/2"))
+register_implementation("fs_based_index",
+                        lambda d: fs_based.GentleDataStore(d, mkdir=True, index=True))
+register_implementation("fs_based_bloom",
+                        lambda d: fs_based.GentleDataStore(d, mkdir=True, bloom=True))
+register_implementation("fs_based_batched",
+                        lambda d: fs_based.GentleDataStore(d, mkdir=True,
+                                                           durability="batched"))
+register_implementation("fs_based_per_op",
+                        lambda d: fs_based.GentleDataStore(d, mkdir=True,
+                                                           durability="per-op"))
+register_implementation("fs_based_zlib",
+                        lambda d: fs_based.GentleDataStore(d, mkdir=True,
+                                                           compression="zlib"))
+register_implementation("fs_based_chunked",
+                        lambda d: fs_based.GentleDataStore(d, mkdir=True,
+                                                           chunking=True))
+register_implementation("pack_based",
+                        lambda d: pack_based.GentleDataStore(d, mkdir=True))
+register_implementation("pack_based_zlib",
+                        lambda d: pack_based.GentleDataStore(d, mkdir=True,
+                                                             compression="zlib"))
+register_implementation("shared_memory_based",
+                        lambda d: shared_memory_based.GentleDataStore(
+                            os.path.join(d, "store"), content_slots=2 ** 16,
+                            pointer_slots=2 ** 16, arena_size=256 * 1024 * 1024))
+register_implementation("sqlite_based",
+                        lambda d: sqlite_based.GentleDataStore(d, mkdir=True))
+register_implementation("debugging_wrapper",
+                        lambda d: debugging_wrapper.GentleDataStore(
+                            memory_based.GentleDataStore(), _NullWriter()))
+register_implementation("caching_wrapper",
+                        lambda d: caching_wrapper.GentleDataStore(
+                            fs_based.GentleDataStore(d, mkdir=True)))
+register_implementation("tiered",
+                        lambda d: tiered.GentleDataStore(
+                            fs_based.GentleDataStore(d, mkdir=True)))
+
+def get_factory(name):
+    """
+    Return the factory of a registered implementation, or one that opens the
+    implementation module with the given name.
+    """
+    if name in IMPLEMENTATIONS:
+        return IMPLEMENTATIONS[name]
+    return lambda d: easy.Gentle(name, d).ds
+
+
+## BENCHMARKS ##
+
+# name -> function(data_store, size, rng) that sets up the data store and
+# returns a function doing the timed work, and the number of operations it does
+# (or None if the function returns that number):
+BENCHMARKS = OrderedDict()
+
+def benchmark(function):
+    """
+    Decorator registering a benchmark under the name of the function, without
+    the leading "bench_".
+    """
+    BENCHMARKS[function.__name__[len("bench_"):]] = function
+    return function
+
+def _contents(rng, count, size):
+    # Unique random heads, compressible tails:
+    return ["".join(chr(rng.randrange(256)) for i in xrange(16)) +
+            "x" * (size - 16) for i in xrange(count)]
+
+def _random_identifier(rng):
+    return "%064x" % rng.getrandbits(256)
+
+def _fill(data_store, rng, count, size=100):
+    """
+    Enter count pieces of content and a pointer to each, and return their
+    identifiers.
+    """
+    c_db = data_store.content_db
+    p_db = data_store.pointer_db
+    contents = [c_db + content for content in _contents(rng, count, size)]
+    pointers = [_random_identifier(rng) for c in contents]
+    for p, c in zip(pointers, contents):
+        p_db[p] = c
+    return contents, pointers
+
+@benchmark
+def bench_add_small(data_store, size, rng):
+    contents = _contents(rng, size, 100)
+    def run():
+        c_db = data_store.content_db
+        for content in contents:
+            c_db + content
+    return run, size
+
+@benchmark
+def bench_add_large(data_store, size, rng):
+    contents = _contents(rng, max(size // 10, 1), 64 * 1024)
+    def run():
+        c_db = data_store.content_db
+        for content in contents:
+            c_db + content
+    return run, len(contents)
+
+@benchmark
+def bench_add_versions(data_store, size, rng):
+    # Successive versions of a large file, each with a few bytes changed, as
+    # content-defined chunking (see gentle_tp_da92.chunking) stores them:
+    content = bytearray(rng.getrandbits(8) for i in xrange(1024 * 1024))
+    versions = []
+    for i in xrange(max(size // 100, 2)):
+        content[rng.randrange(len(content))] = rng.getrandbits(8)
+        versions.append(str(content))
+    def run():
+        c_db = data_store.content_db
+        for version in versions:
+            c_db + version
+    return run, len(versions)
+
+def _bench_add_bulk(threads):
+    def bench(data_store, size, rng):
+        # Content large enough for hashlib to release the GIL, entered using
+        # add_many() with bulk.sha256_many() hashing in threads threads:
+        contents = _contents(rng, max(size // 10, 2), 64 * 1024)
+        previous = bulk.get_hash_threads()
+        bulk.set_hash_threads(threads)
+        bulk.sha256_many(contents[:2 * threads])  # start the threads
+        bulk.set_hash_threads(previous)
+        def run():
+            bulk.set_hash_threads(threads)
+            try:
+                data_store.content_db.add_many(contents)
+            finally:
+                bulk.set_hash_threads(previous)
+        return run, len(contents)
+    return bench
+
+for _threads in (1, 2, 4, 8):
+    BENCHMARKS["add_bulk_%u_threads" % _threads] = _bench_add_bulk(_threads)
+
+@benchmark
+def bench_get(data_store, size, rng):
+    contents, pointers = _fill(data_store, rng, size, 1024)
+    rng.shuffle(contents)
+    def run():
+        c_db = data_store.content_db
+        for c in contents:
+            c_db[c]
+    return run, size
+
+@benchmark
+def bench_get_cold(data_store, size, rng):
+    # The first reads after the content has been entered through another
+    # instance (caches of wrappers are cold, the OS page cache is not):
+    contents, pointers = _fill(data_store.data_store
+                               if hasattr(data_store, "data_store") else data_store,
+                               rng, size, 1024)
+    def run():
+        c_db = data_store.content_db
+        for c in contents:
+            c_db[c]
+    return run, size
+
+@benchmark
+def bench_get_warm(data_store, size, rng):
+    contents, pointers = _fill(data_store, rng, size, 1024)
+    c_db = data_store.content_db
+    for c in contents:
+        c_db[c]
+    def run():
+        for c in contents:
+            c_db[c]
+    return run, size
+
+@benchmark
+def bench_set(data_store, size, rng):
+    contents, pointers = _fill(data_store, rng, 10)
+    items = [(_random_identifier(rng), rng.choice(contents)) for i in xrange(size)]
+    def run():
+        p_db = data_store.pointer_db
+        for p, c in items:
+            p_db[p] = c
+    return run, size
+
+@benchmark
+def bench_get_pointer(data_store, size, rng):
+    contents, pointers = _fill(data_store, rng, size)
+    def run():
+        p_db = data_store.pointer_db
+        for p in pointers:
+            p_db[p]
+    return run, size
+
+def _bench_find(prefix_length):
+    def bench(data_store, size, rng):
+        contents, pointers = _fill(data_store, rng, size)
+        count = max(size // 10, 1)
+        prefixes = [rng.choice(contents)[:prefix_length] for i in xrange(count)]
+        def run():
+            c_db = data_store.content_db
+            for prefix in prefixes:
+                c_db.find(prefix)
+        return run, count
+    return bench
+
+for _prefix_length in (1, 2, 4, 8):
+    BENCHMARKS["find_prefix_%u" % _prefix_length] = _bench_find(_prefix_length)
+
+@benchmark
+def bench_contains_hit(data_store, size, rng):
+    contents, pointers = _fill(data_store, rng, size)
+    def run():
+        c_db = data_store.content_db
+        for c in contents:
+            c in c_db
+    return run, size
+
+@benchmark
+def bench_contains_miss(data_store, size, rng):
+    _fill(data_store, rng, size)
+    missing = [_random_identifier(rng) for i in xrange(size)]
+    def run():
+        c_db = data_store.content_db
+        for c in missing:
+            c in c_db
+    return run, size
+
+@benchmark
+def bench_mixed(data_store, size, rng):
+    # 70% content reads, 10% pointer reads, 10% content added, 5% pointers
+    # set, 5% searches:
+    contents, pointers = _fill(data_store, rng, size, 1024)
+    new_contents = _contents(rng, size, 1024)
+    operations = []
+    for i in xrange(size):
+        x = rng.random()
+        if x < 0.70:
+            operations.append(("get", rng.choice(contents)))
+        elif x < 0.80:
+            operations.append(("get_pointer", rng.choice(pointers)))
+        elif x < 0.90:
+            operations.append(("add", new_contents[i]))
+        elif x < 0.95:
+            operations.append(("set", rng.choice(pointers)))
+        else:
+            operations.append(("find", rng.choice(contents)[:3]))
+    def run():
+        c_db = data_store.content_db
+        p_db = data_store.pointer_db
+        for operation, argument in operations:
+            if operation == "get":
+                c_db[argument]
+            elif operation == "get_pointer":
+                p_db[argument]
+            elif operation == "add":
+                c_db + argument
+            elif operation == "set":
+                p_db[argument] = contents[0]
+            else:
+                c_db.find(argument)
+    return run, size
+
+@benchmark
+def bench_load_dataset(data_store, size, rng):
+    # Bulk loading of a dataset (see benchmarks.dataset), without threads:
+    seed = rng.getrandbits(32)
+    def run():
+        return dataset.generate(data_store, size, size // 10, size // 10, 3,
+                                1024, seed=seed, threads=1)["objects"]
+    return run, None
+
+@benchmark
+def bench_walk_versions(data_store, size, rng):
+    dataset.generate(data_store, size // 10, size // 10, size // 10, 5, 1024,
+                     seed=rng.getrandbits(32), threads=1)
+    pointers = data_store.pointer_db.find()
+    def run():
+        for p in pointers:
+            for version in dataset.iter_versions(data_store, p):
+                pass
+    return run, sum(1 for p in pointers
+                    for version in dataset.iter_versions(data_store, p))
+
+
+## RUNNING AND COMPARING ##
+
+def run_benchmark(factory, benchmark_function, size=DEFAULT_SIZE,
+                  repeat=DEFAULT_REPEAT, seed=DEFAULT_SEED):
+    """
+    Run a benchmark repeat times, each time on a fresh data store, and return
+    the result as a dictionary.
+    """
+    timings = []
+    for i in xrange(repeat):
+        directory = tempfile.mkdtemp(prefix="gentle-benchmark-")
+        try:
+            data_store = factory(os.path.join(directory, "data_store"))
+            run, operations = benchmark_function(data_store, size, random.Random(seed))
+            start = time.time()
+            done = run()
+            timings.append(time.time() - start)
+            if operations is None:
+                operations = done
+            if hasattr(data_store, "close"):
+                data_store.close()
+        finally:
+            shutil.rmtree(directory)
+    best = min(timings)
+    return dict(
+        operations=operations,
+        best_seconds=best,
+        mean_seconds=sum(timings) / len(timings),
+        operations_per_second=operations / best if best else float("inf"),
+        )
+
+def run(implementations=None, benchmarks=None, size=DEFAULT_SIZE,
+        repeat=DEFAULT_REPEAT, seed=DEFAULT_SEED, progress=None):
+    """
+    Run benchmarks (default: all) against implementations (default: all
+    registered ones), and return the results as a JSON-compatible dictionary.
+    progress(implementation, benchmark) is called before each benchmark.
+    """
+    implementations = implementations or list(IMPLEMENTATIONS)
+    benchmarks = benchmarks or list(BENCHMARKS)
+    results = {}
+    for implementation in implementations:
+        factory = get_factory(implementation)
+        results[implementation] = {}
+        for name in benchmarks:
+            if progress is not None:
+                progress(implementation, name)
+            results[implementation][name] = run_benchmark(
+                factory, BENCHMARKS[name], size, repeat, seed)
+    return dict(
+        meta=dict(time=time.time(), python=platform.python_version(),
+                  platform=platform.platform(), size=size, repeat=repeat,
+                  seed=seed),
+        results=results,
+        )
+
+# Result values compared by compare(), and whether larger values are better:
+COMPARED_VALUES = (
+    ("operations_per_second", True),
+    ("bytes_per_object", False),  # memory footprint, see benchmarks.memory
+    )
+
+def compare(old, new, threshold=DEFAULT_THRESHOLD):
+    """
+    Compare two result dictionaries returned by run() or memory.run().
+    Return a list of (implementation, benchmark, old value, new value,
+    relative change) tuples, sorted by implementation and benchmark, for all
+    benchmarks in both; and the list of those that got worse by more than
+    threshold (0.10 = 10%).  The values compared are those named in
+    COMPARED_VALUES.
+    """
+    changes = []
+    regressions = []
+    for implementation, benchmarks in sorted(new["results"].iteritems()):
+        old_benchmarks = old["results"].get(implementation, {})
+        for name, result in sorted(benchmarks.iteritems()):
+            if name not in old_benchmarks: continue
+            for key, larger_is_better in COMPARED_VALUES:
+                if key not in result or key not in old_benchmarks[name]:
+                    continue
+                old_value = old_benchmarks[name][key]
+                new_value = result[key]
+                change = (new_value - old_value) / old_value if old_value else 0.0
+                changes.append((implementation, name, old_value, new_value, change))
+                if (-change if larger_is_better else change) > threshold:
+                    regressions.append(changes[-1])
+    return changes, regressions
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Benchmarks Command Line Interface.
+
+Usage:
+    python -m gentle_tp_da92.benchmarks run [options]
+    python -m gentle_tp_da92.benchmarks memory [options]
+    python -m gentle_tp_da92.benchmarks compare [options] <old.json> <new.json>
+    python -m gentle_tp_da92.benchmarks list
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import print_function, absolute_import
+
+import sys
+
+from   .._optparse import *
+from   .. import json
+from   .. import benchmarks
+from   . import memory
+
+
+def _run(args):
+    option_parser = OptionParser(
+        prog="python -m gentle_tp_da92.benchmarks",
+        usage="Usage: %prog run [options]",
+        description="Run benchmarks and print or save the results as JSON."
+        )
+    option_parser.add_option(
+        "-i", "--implementation", action="append", default=[],
+        help="""Benchmark this implementation, by registered name or module
+                name; may be repeated; default: all registered ones"""
+        )
+    option_parser.add_option(
+        "-b", "--benchmark", action="append", default=[],
+        help="""Run this benchmark; may be repeated; default: all"""
+        )
+    option_parser.add_option(
+        "-n", "--size", type="int", default=benchmarks.DEFAULT_SIZE,
+        help="""Number of items per benchmark; default: %default"""
+        )
+    option_parser.add_option(
+        "-r", "--repeat", type="int", default=benchmarks.DEFAULT_REPEAT,
+        help="""Number of runs per benchmark, the best one counts;
+                default: %default"""
+        )
+    option_parser.add_option(
+        "-s", "--seed", type="int", default=benchmarks.DEFAULT_SEED,
+        help="""Seed of the random data; default: %default"""
+        )
+    option_parser.add_option(
+        "-o", "--output", default=None,
+        help="""Save the results to this file instead of printing them"""
+        )
+    options, args = option_parser.parse_args(args)
+    if args:
+        option_parser.error("no arguments expected")
+    for name in options.benchmark:
+        if name not in benchmarks.BENCHMARKS:
+            option_parser.error("unknown benchmark: %r" % name)
+    def progress(implementation, benchmark):
+        print("%s: %s" % (implementation, benchmark), file=sys.stderr)
+    results = benchmarks.run(options.implementation, options.benchmark,
+                             options.size, options.repeat, options.seed,
+                             progress)
+    _output(results, options.output)
+
+
+def _output(results, filename):
+    if filename is None:
+        json.pprint(results)
+    else:
+        with open(filename, "w") as f:
+            f.write(json.pretty(results) + "\n")
+
+
+def _memory(args):
+    option_parser = OptionParser(
+        prog="python -m gentle_tp_da92.benchmarks",
+        usage="Usage: %prog memory [options]",
+        description="""Measure the memory footprint per object of the in-memory
+                       structures and print or save the results as JSON."""
+        )
+    option_parser.add_option(
+        "-t", "--structure", action="append", default=[],
+        help="""Measure this structure; may be repeated; default: all"""
+        )
+    option_parser.add_option(
+        "-n", "--count", type="int", default=memory.DEFAULT_COUNT,
+        help="""Number of objects loaded; default: %default"""
+        )
+    option_parser.add_option(
+        "--size", type="int", default=memory.DEFAULT_CONTENT_SIZE,
+        help="""Mean size of the content in bytes; default: %default"""
+        )
+    option_parser.add_option(
+        "-d", "--distribution", default=memory.DEFAULT_DISTRIBUTION,
+        choices=list(memory.DISTRIBUTIONS),
+        help="""Distribution of the content sizes, one of %s;
+                default: %%default""" % ", ".join(memory.DISTRIBUTIONS)
+        )
+    option_parser.add_option(
+        "-s", "--seed", type="int", default=memory.DEFAULT_SEED,
+        help="""Seed of the random data; default: %default"""
+        )
+    option_parser.add_option(
+        "-o", "--output", default=None,
+        help="""Save the results to this file instead of printing them"""
+        )
+    options, args = option_parser.parse_args(args)
+    if args:
+        option_parser.error("no arguments expected")
+    if options.count < 1:
+        option_parser.error("at least one object expected")
+    for name in options.structure:
+        if name not in memory.STRUCTURES:
+            option_parser.error("unknown structure: %r" % name)
+    def progress(structure, benchmark):
+        print(structure, file=sys.stderr)
+    results = memory.run(options.structure, options.count, options.size,
+                         options.distribution, options.seed, progress)
+    _output(results, options.output)
+
+
+def _compare(args):
+    option_parser = OptionParser(
+        prog="python -m gentle_tp_da92.benchmarks",
+        usage="Usage: %prog compare [options] <old.json> <new.json>",
+        description="""Compare two result files.  Exits with status 1 if any
+                       benchmark got slower by more than the threshold."""
+        )
+    option_parser.add_option(
+        "-t", "--threshold", type="float", default=benchmarks.DEFAULT_THRESHOLD,
+        help="""Relative drop in operations per second, or growth in bytes
+                per object, flagged as a regression; default: %default"""
+        )
+    options, args = option_parser.parse_args(args)
+    if len(args) != 2:
+        option_parser.error("two arguments expected")
+    old, new = [json.load(open(arg)) for arg in args]
+    changes, regressions = benchmarks.compare(old, new, options.threshold)
+    for change in changes:
+        implementation, name, old_value, new_value, relative = change
+        print("%-20s %-16s %12.0f %12.0f %+7.1f%%%s" % (
+            implementation, name, old_value, new_value, relative * 100,
+            "  REGRESSION" if change in regressions else ""))
+    if regressions:
+        sys.exit(1)
+
+
+def _list(args):
+    print("Implementations:")
+    for name in benchmarks.IMPLEMENTATIONS:
+        print("    %s" % name)
+    print("Benchmarks:")
+    for name in benchmarks.BENCHMARKS:
+        print("    %s" % name)
+    print("Structures (memory):")
+    for name in memory.STRUCTURES:
+        print("    %s" % name)
+
+
+def main():
+    commands = dict(run=_run, memory=_memory, compare=_compare,
+                    list=_list)
+    if len(sys.argv) < 2 or sys.argv[1] not in commands:
+        print(__doc__.strip().split("\n\n", 1)[1], file=sys.stderr)
+        sys.exit(2)
+    commands[sys.argv[1]](sys.argv[2:])
+
+
+if __name__ == "__main__":
+    main()
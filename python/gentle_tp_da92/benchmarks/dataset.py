@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Synthetic Dataset Generator.
+
+Populates a data store with a synthetic dataset for load testing:
+
+  - Content blobs of random bytes, with sizes following one of the
+    distributions of benchmarks.memory (lognormal by default).
+  - JSON documents with "<name>:content" and "<name>:pointer" references to
+    blobs and pointers, stored like GentleNext stores them (compact, with
+    sorted keys).
+  - Pointers, each to the latest version of a GentleNext-style version chain:
+    JSON documents with "content:content" (or "content:json:content"),
+    "prev_version:metadata:content" and "timestamp" entries, starting from
+    the empty version {"content:content": <identifier of "">}.
+
+The dataset is generated in batches.  Each batch only references items of its
+own batch and draws from its own random generator, seeded from the seed and
+the batch number, so that batches can be generated and written in parallel
+(using add_many() and set_many()) while the resulting data store is always the
+same for the same parameters.
+
+Usage example:
+>>> from gentle_tp_da92.benchmarks import dataset
+>>> report = dataset.generate(data_store, contents=1000, pointers=100,
+...                           documents=100, versions=3)
+>>> report["pointers"]
+100
+
+or from the command line:
+
+    $ python -m gentle_tp_da92 generate -n 10000000 --pointers 1000000
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from   hashlib import sha256
+from   multiprocessing.pool import ThreadPool
+import random
+import time
+
+from   .. import json
+from   .memory import DISTRIBUTIONS
+
+
+DEFAULT_CONTENTS = 10000
+DEFAULT_POINTERS = 1000
+DEFAULT_DOCUMENTS = 1000
+DEFAULT_VERSIONS = 5
+DEFAULT_CONTENT_SIZE = 4096
+DEFAULT_DISTRIBUTION = "lognormal"
+DEFAULT_SEED = 92
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_THREADS = 8
+
+# Timestamps of the version chains start here (2011-01-01 00:00:00 UTC):
+START_TIME = 1293840000
+
+PREV_VERSION_KEY = "prev_version:metadata:content"
+
+# Blobs are cut from a pool of random bytes, which is much faster than
+# generating random bytes for each blob:
+_POOL_SIZE = 4 * 1024 * 1024
+_pool = None
+
+_WORDS = ("gentle data store content pointer version document note image "
+          "draft report archive list entry index table record").split()
+
+
+def _share(total, parts, i):
+    """
+    Return the size of the i-th of parts nearly equal parts of total.
+    """
+    return total * (i + 1) // parts - total * i // parts
+
+def _random_pool():
+    global _pool
+    if _pool is None:
+        _pool = "".join(sha256("pool:%u" % i).digest()
+                        for i in xrange(_POOL_SIZE // 32))
+    return _pool
+
+def _random_identifier(rng):
+    return "%064x" % rng.getrandbits(256)
+
+def format_timestamp(t):
+    """
+    Format a timestamp like GentleNext.timestamp() does, but in UTC so that
+    the dataset does not depend on the local time zone.
+    """
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(t)) + " +0000"
+
+
+class _Generator(object):
+
+    def __init__(self, contents, pointers, documents, versions, size,
+                 distribution, seed, batch_size):
+        super(_Generator, self).__init__()
+        self.contents = contents
+        self.pointers = pointers
+        self.documents = documents
+        self.versions = versions
+        self.size = size
+        self.sizes = DISTRIBUTIONS[distribution]
+        self.seed = seed
+        self.batches = max((contents + batch_size - 1) // batch_size, 1)
+        self.pool = _random_pool()
+        self.empty_content = sha256("").hexdigest()
+        self.empty_version = json.dumps({"content:content": self.empty_content})
+
+    def _rng(self, name):
+        digest = sha256("%s:%s" % (self.seed, name)).digest()
+        return random.Random(int(digest[:8].encode("hex"), 16))
+
+    def _blob(self, rng, number):
+        # A unique head keeps the blobs distinct even if they are short:
+        head = "%u:" % number
+        size = min(max(self.sizes(rng, self.size) - len(head), 0), _POOL_SIZE)
+        offset = rng.randrange(_POOL_SIZE - size + 1)
+        return head + self.pool[offset:offset + size]
+
+    def _document(self, rng, number, blobs, pointers):
+        document = {
+            "title": " ".join(rng.choice(_WORDS) for i in xrange(rng.randint(1, 6))),
+            "number": number,
+            "tags": [rng.choice(_WORDS) for i in xrange(rng.randint(0, 4))],
+            }
+        for i in xrange(rng.randint(1, 4)):
+            document["%s:content" % rng.choice(_WORDS)] = rng.choice(blobs)
+        if pointers:
+            document["related:pointer"] = rng.choice(pointers)
+        return json.dumps(document)
+
+    def _versions(self, rng, targets, document_ids):
+        """
+        Return the documents of a version chain, oldest first.
+        """
+        chain = []
+        previous = sha256(self.empty_version).hexdigest()
+        t = START_TIME + rng.randrange(365 * 86400)
+        for i in xrange(rng.randint(1, 2 * self.versions - 1)):
+            target = rng.choice(targets)
+            t += rng.randrange(1, 30 * 86400)
+            version = json.dumps({
+                "content:json:content" if target in document_ids
+                else "content:content": target,
+                PREV_VERSION_KEY: previous,
+                "timestamp": format_timestamp(t),
+                })
+            chain.append(version)
+            previous = sha256(version).hexdigest()
+        return chain
+
+    def batch(self, i):
+        """
+        Generate batch i, and return its content as a list of byte strings and
+        its pointers as a list of (pointer, content identifier) pairs.
+        """
+        rng = self._rng("batch:%u" % i)
+        first = self.contents * i // self.batches
+        blobs = [self._blob(rng, first + j)
+                 for j in xrange(_share(self.contents, self.batches, i))]
+        contents = list(blobs)
+        if i == 0:
+            contents += ["", self.empty_version]
+        blob_ids = [sha256(b).hexdigest() for b in blobs] or [self.empty_content]
+        pointer_ids = [_random_identifier(rng)
+                       for j in xrange(_share(self.pointers, self.batches, i))]
+        first = self.documents * i // self.batches
+        documents = [self._document(rng, first + j, blob_ids, pointer_ids)
+                     for j in xrange(_share(self.documents, self.batches, i))]
+        contents += documents
+        document_ids = [sha256(d).hexdigest() for d in documents]
+        targets = blob_ids + document_ids
+        items = []
+        for pointer_id in pointer_ids:
+            chain = self._versions(rng, targets, set(document_ids))
+            contents += chain
+            items.append((pointer_id, sha256(chain[-1]).hexdigest()))
+        return contents, items
+
+
+def generate(data_store, contents=DEFAULT_CONTENTS, pointers=DEFAULT_POINTERS,
+             documents=DEFAULT_DOCUMENTS, versions=DEFAULT_VERSIONS,
+             size=DEFAULT_CONTENT_SIZE, distribution=DEFAULT_DISTRIBUTION,
+             seed=DEFAULT_SEED, batch_size=DEFAULT_BATCH_SIZE,
+             threads=DEFAULT_THREADS, progress=None):
+    """
+    Populate data_store with a synthetic dataset of contents blobs, documents
+    JSON documents and pointers pointing to version chains of on average
+    versions versions, and return a report as a dictionary.  Blob sizes follow
+    distribution (see benchmarks.memory.DISTRIBUTIONS) with a mean of size
+    bytes.  progress(done, total), if given, is called after each batch.
+    """
+    generator = _Generator(contents, pointers, documents, versions, size,
+                           distribution, seed, batch_size)
+    c_db = data_store.content_db
+    p_db = data_store.pointer_db
+
+    def write_batch(i):
+        batch_contents, items = generator.batch(i)
+        c_db.add_many(batch_contents)
+        p_db.set_many(items)
+        return len(batch_contents), sum(len(c) for c in batch_contents), len(items)
+
+    report = dict(contents=0, bytes=0, pointers=0)
+    start = time.time()
+    pool = ThreadPool(threads) if threads > 1 else None
+    try:
+        batches = xrange(generator.batches)
+        results = (pool.imap_unordered(write_batch, batches) if pool
+                   else (write_batch(i) for i in batches))
+        for done, (n_contents, n_bytes, n_pointers) in enumerate(results):
+            report["contents"] += n_contents
+            report["bytes"] += n_bytes
+            report["pointers"] += n_pointers
+            if progress is not None:
+                progress(done + 1, generator.batches)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    seconds = time.time() - start
+    objects = report["contents"] + report["pointers"]
+    report.update(
+        objects=objects,
+        seconds=seconds,
+        objects_per_second=objects / seconds if seconds else float("inf"),
+        empty_version=sha256(generator.empty_version).hexdigest(),
+        )
+    return report
+
+
+def iter_versions(data_store, pointer_identifier):
+    """
+    Yield the version documents of the chain a pointer points to, newest
+    first, as dictionaries.
+    """
+    c_db = data_store.content_db
+    identifier = data_store.pointer_db[pointer_identifier]
+    while True:
+        version = json.loads(c_db[identifier])
+        if PREV_VERSION_KEY not in version: return
+        yield version
+        identifier = version[PREV_VERSION_KEY]
@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Memory Footprint Benchmarks.
+
+Loads synthetic objects into the in-memory structures (the memory_based and
+compact_memory_based data stores, the caches of caching_wrapper and the
+pending changes of a prefix index) and reports the bytes used per object, as the total size of all Python
+objects reachable from the structure (see deep_sizeof()) and as the growth of
+the resident set size of the process.  Both are measured at several fill
+levels, which gives a growth curve.
+
+    $ python -m gentle_tp_da92.benchmarks memory -n 100000 -o memory.json
+
+The results have the same form as those of benchmarks.run(), so they can be
+compared with benchmarks.compare() to catch memory regressions.
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from   collections import OrderedDict
+import gc
+import math
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+from   .. import caching_wrapper
+from   .. import compact_memory_based
+from   .. import memory_based
+from   .. import prefix_index
+
+
+DEFAULT_COUNT = 10000
+DEFAULT_CONTENT_SIZE = 100
+DEFAULT_DISTRIBUTION = "fixed"
+DEFAULT_SEED = 92
+
+# Fractions of the number of objects at which the footprint is measured:
+GROWTH_STEPS = (0.125, 0.25, 0.5, 1.0)
+
+
+## MEASURING ##
+
+# Objects that are shared or not owned by the structures measured:
+_SKIPPED_TYPES = (types.ModuleType, types.FunctionType, types.MethodType,
+                  types.BuiltinFunctionType, type, types.ClassType)
+
+def deep_sizeof(obj, seen=None):
+    """
+    Return the total size in bytes of obj and all objects reachable from it
+    through containers and instance attributes, counting each object once.
+    Pass the same seen set to successive calls to exclude objects counted
+    before.  Memory outside of Python objects (mmap, files) is not counted.
+    """
+    if seen is None:
+        seen = set()
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SKIPPED_TYPES): continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            stack.extend(obj.iterkeys())
+            stack.extend(obj.itervalues())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        if hasattr(obj, "__dict__"):
+            stack.append(obj.__dict__)
+        for name in getattr(type(obj), "__slots__", ()):
+            if hasattr(obj, name):
+                stack.append(getattr(obj, name))
+    return size
+
+def rss_bytes():
+    """
+    Return the resident set size of this process in bytes, or None where it
+    cannot be determined.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError, ValueError):
+        return None
+
+
+## SYNTHETIC OBJECTS ##
+
+# name -> function(rng, mean size) returning the size of the next object:
+DISTRIBUTIONS = OrderedDict([
+    ("fixed", lambda rng, size: size),
+    ("uniform", lambda rng, size: rng.randint(0, 2 * size)),
+    ("exponential", lambda rng, size: int(rng.expovariate(1.0 / size)) if size else 0),
+    # Many small and a few large objects, like files on a typical disk:
+    ("lognormal", lambda rng, size: int(rng.lognormvariate(math.log(size) - 0.5, 1.0))
+                                    if size else 0),
+    ])
+
+def generate_contents(rng, count, size=DEFAULT_CONTENT_SIZE,
+                      distribution=DEFAULT_DISTRIBUTION):
+    """
+    Yield count distinct byte strings with sizes following distribution.
+    """
+    sizes = DISTRIBUTIONS[distribution]
+    for i in xrange(count):
+        # A unique head keeps the contents distinct even if they are short:
+        head = "%x:" % i
+        yield head + os.urandom(max(sizes(rng, size) - len(head), 0))
+
+def _random_identifier(rng):
+    return "%064x" % rng.getrandbits(256)
+
+
+## STRUCTURES ##
+
+# name -> class with a constructor taking a temporary directory, add(content,
+# rng) to enter one object, and measured() to return the root of the objects
+# to count, plus any objects to leave out:
+STRUCTURES = OrderedDict()
+
+def structure(cls):
+    """
+    Class decorator registering a structure under the class name, without the
+    leading "_".
+    """
+    STRUCTURES[cls.__name__.lstrip("_")] = cls
+    return cls
+
+@structure
+class _memory_based(object):
+    """
+    The memory_based data store, with a pointer to each piece of content.
+    """
+
+    def __init__(self, directory):
+        self.data_store = memory_based.GentleDataStore()
+
+    def add(self, content, rng):
+        self.data_store.pointer_db[_random_identifier(rng)] = \
+            self.data_store.content_db + content
+
+    def measured(self):
+        return self.data_store, ()
+
+@structure
+class _compact_memory_based(_memory_based):
+    """
+    The compact_memory_based data store, with a pointer to each piece of
+    content.
+    """
+
+    def __init__(self, directory):
+        self.data_store = compact_memory_based.GentleDataStore()
+
+@structure
+class _caching_wrapper(object):
+    """
+    The content and pointer caches of caching_wrapper, without the wrapped
+    data store.
+    """
+
+    def __init__(self, directory):
+        self.wrapped = memory_based.GentleDataStore()
+        self.data_store = caching_wrapper.GentleDataStore(
+            self.wrapped, max_content_bytes=sys.maxint, pointer_ttl=None,
+            max_entries=sys.maxint)
+
+    def add(self, content, rng):
+        self.data_store.pointer_db[_random_identifier(rng)] = \
+            self.data_store.content_db + content
+        # A miss, which is remembered by the negative cache:
+        _random_identifier(rng) in self.data_store.content_db
+
+    def measured(self):
+        return self.data_store, (self.wrapped,)
+
+@structure
+class _prefix_index(object):
+    """
+    The changes to a prefix index not yet merged into its keys file.
+    """
+
+    def __init__(self, directory):
+        self.index = prefix_index.PrefixIndex(
+            directory, lambda: [], lambda: 0, merge_threshold=sys.maxint)
+        self.index.wait()
+
+    def add(self, content, rng):
+        self.index.add(_random_identifier(rng))
+
+    def measured(self):
+        return self.index._delta, ()
+
+
+## RUNNING ##
+
+def measure_structure(name, count=DEFAULT_COUNT, size=DEFAULT_CONTENT_SIZE,
+                      distribution=DEFAULT_DISTRIBUTION, seed=DEFAULT_SEED):
+    """
+    Fill a structure with count objects and return its footprint as a
+    dictionary.
+    """
+    rng = random.Random(seed)
+    contents = generate_contents(rng, count, size, distribution)
+    directory = tempfile.mkdtemp(prefix="gentle-benchmark-")
+    try:
+        gc.collect()
+        rss_start = rss_bytes()
+        measured_structure = STRUCTURES[name](directory)
+        root, excluded = measured_structure.measured()
+        seen = set(id(o) for o in (contents, rng, measured_structure))
+        empty_bytes = deep_sizeof(root, set(seen))
+        growth = []
+        loaded = 0
+        content_bytes = 0
+        for step in GROWTH_STEPS:
+            for content in contents:
+                measured_structure.add(content, rng)
+                content_bytes += len(content)
+                loaded += 1
+                if loaded >= int(count * step): break
+            gc.collect()
+            rss = rss_bytes()
+            excluded_ids = set(seen)
+            for o in excluded:
+                deep_sizeof(o, excluded_ids)
+            total = deep_sizeof(root, excluded_ids) - empty_bytes
+            growth.append(dict(
+                objects=loaded,
+                bytes_per_object=float(total) / loaded if loaded else 0.0,
+                rss_bytes_per_object=(float(rss - rss_start) / loaded
+                                      if rss is not None and loaded else None),
+                ))
+    finally:
+        shutil.rmtree(directory)
+    result = dict(growth[-1])
+    result.update(
+        content_bytes_per_object=float(content_bytes) / loaded if loaded else 0.0,
+        growth=growth,
+        )
+    return result
+
+def run(structures=None, count=DEFAULT_COUNT, size=DEFAULT_CONTENT_SIZE,
+        distribution=DEFAULT_DISTRIBUTION, seed=DEFAULT_SEED, progress=None):
+    """
+    Measure structures (default: all), and return the results as a
+    JSON-compatible dictionary in the form returned by benchmarks.run().
+    progress(structure, "memory") is called before each structure.
+    """
+    structures = structures or list(STRUCTURES)
+    results = {}
+    for name in structures:
+        if progress is not None:
+            progress(name, "memory")
+        results[name] = {"memory": measure_structure(name, count, size,
+                                                     distribution, seed)}
+    return dict(
+        meta=dict(time=time.time(), python=platform.python_version(),
+                  platform=platform.platform(), count=count, size=size,
+                  distribution=distribution, seed=seed),
+        results=results,
+        )
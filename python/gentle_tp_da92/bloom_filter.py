@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Bloom Filter Module.
+
+Provides a Bloom filter of identifiers, which answers "definitely not stored"
+for most identifiers that are not stored, without touching the data store.
+Data stores use it to skip lookups for content that is new or missing.
+
+Identifiers are SHA-256 hashes or random, so their digits serve as the hash
+values of the filter; nothing is hashed again.
+
+IdentifierFilter keeps a BloomFilter in its own directory:
+
+    .../<filter directory>/
+        filter    (header, followed by the bits)
+
+The file is removed while the filter is in use and written back by close(),
+so a filter that has missed changes because its process crashed is rebuilt
+from scratch the next time.  It is also rebuilt if the stored identifiers
+have changed since it was written, as reported by stamp() (see
+gentle_tp_da92.prefix_index.PrefixIndex).
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+import math
+import os
+import struct
+import tempfile
+import threading
+
+from   .utilities import *
+
+
+FILTER_FILENAME = "filter"
+
+DEFAULT_CAPACITY = 1000000
+DEFAULT_ERROR_RATE = 0.01
+
+_MAGIC = "GTPBLM1\n"
+_HEADER = struct.Struct("<8sQQQQ")  # magic, capacity, bits, hashes, count
+
+
+class BloomFilter(object):
+    """
+    Bloom filter of identifiers, sized for capacity identifiers at a rate of
+    false positives of error_rate.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, error_rate=DEFAULT_ERROR_RATE):
+        super(BloomFilter, self).__init__()
+        self.capacity = max(capacity, 1)
+        self.bits = max(int(-self.capacity * math.log(error_rate) /
+                            math.log(2) ** 2), 8)
+        self.hashes = max(int(round(float(self.bits) / self.capacity * math.log(2))), 1)
+        self.count = 0
+        self._bytes = bytearray((self.bits + 7) // 8)
+
+    def __len__(self):
+        """
+        Return the number of identifiers added (counting repeated ones).
+        """
+        return self.count
+
+    def _positions(self, identifier):
+        # Double hashing with two 64-bit numbers taken from the identifier:
+        h1 = int(identifier[:16], 16)
+        h2 = int(identifier[16:32], 16) | 1
+        bits = self.bits
+        return [(h1 + i * h2) % bits for i in xrange(self.hashes)]
+
+    def add(self, identifier):
+        b = self._bytes
+        for position in self._positions(identifier):
+            b[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, identifier):
+        """
+        Return False if identifier has definitely not been added.
+        """
+        b = self._bytes
+        for position in self._positions(identifier):
+            if not b[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def save(self, filename):
+        """
+        Write the filter to filename, atomically.
+        """
+        directory = os.path.dirname(filename)
+        fd, tmp_filename = tempfile.mkstemp(dir=directory, prefix=".filter-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(_HEADER.pack(_MAGIC, self.capacity, self.bits,
+                                     self.hashes, self.count))
+                f.write(self._bytes)
+            os.rename(tmp_filename, filename)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Read a filter written by save().
+        """
+        with open(filename, "rb") as f:
+            data = f.read()
+        if len(data) < _HEADER.size:
+            raise GentleException("truncated Bloom filter file: %r" % filename)
+        magic, capacity, bits, hashes, count = _HEADER.unpack_from(data)
+        if magic != _MAGIC or len(data) != _HEADER.size + (bits + 7) // 8:
+            raise GentleException("invalid Bloom filter file: %r" % filename)
+        bloom_filter = cls.__new__(cls)
+        bloom_filter.capacity = capacity
+        bloom_filter.bits = bits
+        bloom_filter.hashes = hashes
+        bloom_filter.count = count
+        bloom_filter._bytes = bytearray(data[_HEADER.size:])
+        return bloom_filter
+
+
+class IdentifierFilter(object):
+    """
+    Persistent Bloom filter of the identifiers in a database.
+
+    scan() must return an iterable of all identifiers currently stored.  stamp()
+    must return the latest modification time of the stored identifiers.  The
+    filter doubles its capacity when it gets full, by rebuilding it using
+    scan().
+
+    The filter only knows about identifiers added through add() or found by
+    scan(), so nobody else may add identifiers while it is open.
+    """
+
+    def __init__(self, directory, scan, stamp, capacity=DEFAULT_CAPACITY,
+                 error_rate=DEFAULT_ERROR_RATE):
+        super(IdentifierFilter, self).__init__()
+        self.directory = directory
+        self.filename = os.path.join(directory, FILTER_FILENAME)
+        self.error_rate = error_rate
+        self._scan = scan
+        self._stamp = stamp
+        self._lock = threading.Lock()
+        if not os.path.exists(directory):
+            os.mkdir(directory, 0700)
+        self.filter = None
+        try:
+            if stamp() <= os.stat(self.filename).st_mtime:
+                self.filter = BloomFilter.load(self.filename)
+        except (IOError, OSError, GentleException):
+            pass
+        if self.filter is None:
+            self._rebuild(capacity)
+        else:
+            os.remove(self.filename)  # until close()
+
+    def _rebuild(self, capacity):
+        identifiers = [i for i in self._scan() if is_identifier_format_valid(i)]
+        self.filter = BloomFilter(max(capacity, 2 * len(identifiers)), self.error_rate)
+        for identifier in identifiers:
+            self.filter.add(identifier)
+
+    def add(self, identifier):
+        with self._lock:
+            self.filter.add(identifier)
+            if self.filter.count > self.filter.capacity:
+                self._rebuild(2 * self.filter.capacity)
+
+    def __contains__(self, identifier):
+        """
+        Return False if identifier is definitely not stored.
+        """
+        # No locking: a lookup racing with add() may miss it either way.
+        return identifier in self.filter
+
+    def close(self):
+        """
+        Write the filter to its file, for the next time.
+        """
+        with self._lock:
+            self.filter.save(self.filename)
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Bulk Content Entry Module.
+
+Provides the building blocks for entering large amounts of content quickly:
+
+  - sha256_many() hashes many byte strings in a shared pool of threads.
+    hashlib releases the GIL while hashing more than 2047 bytes, so this scales
+    with the number of cores.  The add_many() methods of the data stores use
+    it.
+  - add_iter() enters content from an iterable in windows of bounded size, so
+    that memory use stays bounded however much content there is.
+  - add_files() enters files, reading them in parallel.
+
+Usage example:
+>>> from gentle_tp_da92 import bulk
+>>> for filename, identifier in bulk.add_files(data_store.content_db, filenames):
+...     print identifier, filename
+
+or from the command line:
+
+    $ python -m gentle_tp_da92 import -r ~/Pictures
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from   hashlib import sha256
+import multiprocessing
+from   multiprocessing.pool import ThreadPool
+import os
+import threading
+
+from   .utilities import *
+
+
+try:
+    DEFAULT_HASH_THREADS = multiprocessing.cpu_count()
+except NotImplementedError:
+    DEFAULT_HASH_THREADS = 4
+
+# Byte strings up to this size are hashed without releasing the GIL, so there
+# is nothing to gain from hashing them in other threads:
+GIL_RELEASE_SIZE = 2047
+
+# Hashing in the pool only pays off for at least this many bytes:
+MIN_PARALLEL_BYTES = 256 * 1024
+
+DEFAULT_WINDOW_BYTES = 64 * 1024 * 1024
+DEFAULT_WINDOW_ITEMS = 10000
+
+_pools = {}  # number of threads -> pool, kept for switching back and forth
+_pool_threads = DEFAULT_HASH_THREADS
+_pool_lock = threading.Lock()
+
+
+def set_hash_threads(threads):
+    """
+    Set the number of threads sha256_many() uses (at least 1).
+    """
+    global _pool_threads
+    _pool_threads = max(int(threads), 1)
+
+def get_hash_threads():
+    return _pool_threads
+
+def _hexdigest(byte_string):
+    return sha256(byte_string).hexdigest()
+
+def sha256_many(byte_strings):
+    """
+    Return the list of the hexadecimal SHA-256 hashes of byte_strings, which
+    are hashed in parallel if they are large enough.
+    """
+    threads = _pool_threads
+    byte_strings = list(byte_strings)
+    large = [i for i, b in enumerate(byte_strings) if len(b) > GIL_RELEASE_SIZE]
+    if (threads < 2 or len(large) < 2 or
+            sum(len(byte_strings[i]) for i in large) < MIN_PARALLEL_BYTES):
+        return map(_hexdigest, byte_strings)
+    with _pool_lock:
+        pool = _pools.get(threads)
+        if pool is None:
+            pool = _pools[threads] = ThreadPool(threads)
+    # Hash the small byte strings here while the pool hashes the large ones:
+    large_digests = pool.map_async(_hexdigest, [byte_strings[i] for i in large],
+                                   chunksize=1)
+    digests = [None if len(b) > GIL_RELEASE_SIZE else _hexdigest(b)
+               for b in byte_strings]
+    for i, digest in zip(large, large_digests.get()):
+        digests[i] = digest
+    return digests
+
+def _windows(byte_strings, window_bytes, window_items):
+    window, size = [], 0
+    for byte_string in byte_strings:
+        window.append(byte_string)
+        size += len(byte_string)
+        if size >= window_bytes or len(window) >= window_items:
+            yield window
+            window, size = [], 0
+    if window:
+        yield window
+
+def add_iter(content_db, byte_strings, window_bytes=DEFAULT_WINDOW_BYTES,
+             window_items=DEFAULT_WINDOW_ITEMS):
+    """
+    Enter the content from the iterable byte_strings using add_many(), at most
+    window_bytes bytes or window_items items at a time, and yield the content
+    identifiers in order.
+    """
+    for window in _windows(byte_strings, window_bytes, window_items):
+        for content_identifier in content_db.add_many(window):
+            yield content_identifier
+
+def _read_file(filename):
+    with open(filename, "rb") as f:
+        return f.read()
+
+def add_files(content_db, filenames, window_bytes=DEFAULT_WINDOW_BYTES,
+              threads=None):
+    """
+    Enter the content of files, and yield (filename, content identifier) pairs
+    in order.  Files are read by threads threads (default: the number of hash
+    threads) and entered in windows of about window_bytes bytes.  Files larger
+    than a window are entered one by one using add_stream().
+    """
+    threads = threads or _pool_threads
+    pool = ThreadPool(threads) if threads > 1 else None
+    read = pool.imap if pool else map
+    def add_window(window):
+        return zip(window, content_db.add_many(read(_read_file, window)))
+    try:
+        window = []
+        size = 0
+        for filename in filenames:
+            file_size = os.path.getsize(filename)
+            if file_size >= window_bytes:
+                for item in add_window(window):
+                    yield item
+                window, size = [], 0
+                with open(filename, "rb") as f:
+                    yield filename, content_db.add_stream(f)
+                continue
+            window.append(filename)
+            size += file_size
+            if size >= window_bytes or len(window) >= DEFAULT_WINDOW_ITEMS:
+                for item in add_window(window):
+                    yield item
+                window, size = [], 0
+        for item in add_window(window):
+            yield item
+    finally:
+        if pool is not None:
+            pool.close()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Caching Wrapper Data Store Module.
+
+Wraps another data store and keeps recently used items in memory:
+
+  - Content is immutable, so it is cached until it is evicted by newer content
+    (least recently used first, up to max_content_bytes).
+  - Pointers are cached for pointer_ttl seconds, and updated when they are
+    changed through the wrapper.  With pointer_ttl=None, they are cached until
+    evicted, which is only safe if nobody else changes the wrapped data store.
+  - Identifiers found missing by __contains__ are remembered for negative_ttl
+    seconds.
+
+Usage example:
+>>> from gentle_tp_da92 import caching_wrapper, fs_based
+>>> data_store = caching_wrapper.GentleDataStore(fs_based.GentleDataStore(d))
+>>> data_store.stats()["content"]["hits"]
+0
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from   collections import OrderedDict
+from   io import BytesIO
+import threading
+import time
+
+from   . import data_store_interfaces
+from   .utilities import *
+
+
+DEFAULT_MAX_CONTENT_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_POINTER_TTL = 1.0
+DEFAULT_NEGATIVE_TTL = 1.0
+
+
+class _LRUCache(object):
+    """
+    Least-recently-used cache, bounded by the total size of its values as
+    computed by sizeof().
+    """
+
+    def __init__(self, max_size, sizeof=len):
+        super(_LRUCache, self).__init__()
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.size = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        """
+        Return the value for key, or None.
+        """
+        value = self._items.pop(key, None)
+        if value is not None:
+            self._items[key] = value  # most recently used now
+        return value
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_size: return
+        self.discard(key)
+        self._items[key] = value
+        self.size += size
+        while self.size > self.max_size:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= self.sizeof(evicted)
+
+    def discard(self, key):
+        value = self._items.pop(key, None)
+        if value is not None:
+            self.size -= self.sizeof(value)
+
+
+def _one(value):
+    return 1
+
+
+class _GentleDB(data_store_interfaces._GentleDB):
+
+    def __init__(self, db, negative_ttl, max_entries):
+        super(_GentleDB, self).__init__()
+        self.db = db
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        self._absent = _LRUCache(max_entries, _one)  # identifier -> expiry time
+        self.stats = dict(hits=0, misses=0, negative_hits=0)
+
+    ## CACHE ACCESS, TO BE OVERRIDDEN ##
+
+    def _cached(self, identifier):
+        """
+        Return the cached value for identifier, or None.
+        """
+        return None
+
+    def _remember(self, identifier, value):
+        pass
+
+    def _forget(self, identifier):
+        with self._lock:
+            self._absent.discard(identifier)
+
+    ## LOOKUP ##
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def __getitem__(self, identifier):
+        validate_identifier_format(identifier)
+        value = self._cached(identifier)
+        if value is not None:
+            self._count("hits")
+            return value
+        self._count("misses")
+        value = self.db[identifier]
+        self._remember(identifier, value)
+        return value
+
+    def get_many(self, identifiers):
+        identifiers = list(identifiers)
+        for identifier in identifiers:
+            validate_identifier_format(identifier)
+        values = [self._cached(identifier) for identifier in identifiers]
+        missing = [i for i, value in zip(identifiers, values) if value is None]
+        self._count("hits", len(identifiers) - len(missing))
+        self._count("misses", len(missing))
+        if missing:
+            fetched = dict(zip(missing, self.db.get_many(missing)))
+            for identifier, value in fetched.iteritems():
+                self._remember(identifier, value)
+            values = [fetched[i] if value is None else value
+                      for i, value in zip(identifiers, values)]
+        return values
+
+    def find(self, partial_identifier=""):
+        return self.db.find(partial_identifier)
+
+    def iterfind(self, partial_identifier="", limit=None, after=None):
+        return self.db.iterfind(partial_identifier, limit, after)
+
+    def __contains__(self, identifier):
+        validate_identifier_format(identifier)
+        if self._cached(identifier) is not None:
+            self._count("hits")
+            return True
+        with self._lock:
+            expiry = self._absent.get(identifier)
+            if expiry is not None and expiry > time.time():
+                self.stats["negative_hits"] += 1
+                return False
+            self.stats["misses"] += 1
+        result = identifier in self.db
+        if not result:
+            with self._lock:
+                self._absent.put(identifier, time.time() + self.negative_ttl)
+        return result
+
+
+class _GentleContentDB(data_store_interfaces._GentleContentDB, _GentleDB):
+
+    def __init__(self, db, max_content_bytes, negative_ttl, max_entries):
+        super(_GentleContentDB, self).__init__(db, negative_ttl, max_entries)
+        self._cache = _LRUCache(max_content_bytes)
+
+    def _cached(self, identifier):
+        with self._lock:
+            return self._cache.get(identifier)
+
+    def _remember(self, identifier, content):
+        with self._lock:
+            self._cache.put(identifier, content)
+            self._absent.discard(identifier)
+
+    def __add__(self, byte_string):
+        content_identifier = self.db + byte_string
+        self._remember(content_identifier, byte_string)
+        return content_identifier
+
+    def add_many(self, byte_strings):
+        byte_strings = list(byte_strings)
+        content_identifiers = self.db.add_many(byte_strings)
+        for content_identifier, byte_string in zip(content_identifiers, byte_strings):
+            self._remember(content_identifier, byte_string)
+        return content_identifiers
+
+    def add_stream(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        # The content is not cached, as it may be large:
+        content_identifier = self.db.add_stream(fileobj, chunk_size)
+        self._forget(content_identifier)
+        return content_identifier
+
+    def open(self, identifier):
+        validate_identifier_format(identifier)
+        content = self._cached(identifier)
+        if content is None:
+            return self.db.open(identifier)
+        return BytesIO(content)
+
+    def read_range(self, identifier, offset, length):
+        validate_identifier_format(identifier)
+        content = self._cached(identifier)
+        if content is None:
+            return self.db.read_range(identifier, offset, length)
+        return buffer(content, offset, length)
+
+    def __delitem__(self, identifier):
+        with self._lock:
+            self._cache.discard(identifier)
+        del self.db[identifier]
+
+
+class _GentlePointerDB(data_store_interfaces._GentlePointerDB, _GentleDB):
+
+    def __init__(self, db, pointer_ttl, negative_ttl, max_entries):
+        super(_GentlePointerDB, self).__init__(db, negative_ttl, max_entries)
+        self.pointer_ttl = pointer_ttl
+        self._cache = _LRUCache(max_entries, _one)  # -> (content id, expiry)
+
+    def _cached(self, identifier):
+        with self._lock:
+            entry = self._cache.get(identifier)
+            if entry is None: return None
+            content_identifier, expiry = entry
+            if expiry is not None and expiry <= time.time():
+                self._cache.discard(identifier)
+                return None
+            return content_identifier
+
+    def _remember(self, identifier, content_identifier):
+        expiry = None
+        if self.pointer_ttl is not None:
+            expiry = time.time() + self.pointer_ttl
+        with self._lock:
+            self._cache.put(identifier, (content_identifier, expiry))
+            self._absent.discard(identifier)
+
+    def __setitem__(self, pointer_identifier, content_identifier):
+        self.db[pointer_identifier] = content_identifier
+        self._remember(pointer_identifier, content_identifier)
+        return pointer_identifier
+
+    def set_many(self, items):
+        items = list(items)
+        pointer_identifiers = self.db.set_many(items)
+        for pointer_identifier, content_identifier in items:
+            self._remember(pointer_identifier, content_identifier)
+        return pointer_identifiers
+
+    def __delitem__(self, identifier):
+        with self._lock:
+            self._cache.discard(identifier)
+        del self.db[identifier]
+
+
+class GentleDataStore(data_store_interfaces.GentleDataStore):
+
+    def __init__(self, data_store, max_content_bytes=DEFAULT_MAX_CONTENT_BYTES,
+                 pointer_ttl=DEFAULT_POINTER_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL,
+                 max_entries=DEFAULT_MAX_ENTRIES):
+        """
+        max_entries limits the number of cached pointers, and separately the
+        number of identifiers remembered as missing.
+        """
+        super(GentleDataStore, self).__init__()
+        self.data_store = data_store
+        self.content_db = _GentleContentDB(data_store.content_db,
+                                           max_content_bytes, negative_ttl,
+                                           max_entries)
+        self.pointer_db = _GentlePointerDB(data_store.pointer_db, pointer_ttl,
+                                           negative_ttl, max_entries)
+
+    def stats(self):
+        """
+        Return the hit and miss counters of both databases, and the number and
+        size of the cached items.
+        """
+        stats = {}
+        for name, db in (("content", self.content_db), ("pointer", self.pointer_db)):
+            with db._lock:
+                stats[name] = dict(db.stats, cached=len(db._cache),
+                                   cached_size=db._cache.size,
+                                   cached_absent=len(db._absent))
+        return stats
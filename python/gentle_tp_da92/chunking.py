@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Content-Defined Chunking Module.
+
+Provides chunked storage of large content for the data stores that keep
+content in files (fs_based, pack_based).  Content larger than a threshold is
+split into chunks, and stored as a manifest listing the chunks.  The content
+identifier remains the SHA-256 hash of the whole content, and reading it
+reassembles the chunks transparently.
+
+The chunks are content-addressed like any other content, but kept in a
+database of their own (in the hidden CHUNKS_DIRNAME directory of the content
+database), so find() does not list them and they cannot be deleted.  Chunks
+are never removed, not even when all content using them has been deleted.
+
+The chunk boundaries are found using a rolling "gear" hash over the content,
+so they depend on the content around them rather than on their offsets.  A few
+changed, inserted or deleted bytes thus only change the chunks around them,
+and near-identical content (like successive versions of a large file) shares
+most of its chunks.
+
+The gear hash is computed in pure Python, one byte at a time, so chunking is
+slow:  it runs at about 7 MB/s, some 20 times slower than entering the same
+content unchunked.  Chunking thus pays off when storage matters more than the
+time to enter content.  The add_versions benchmark (see
+gentle_tp_da92.benchmarks) measures it, using the fs_based_chunked
+implementation:
+
+    $ python -m gentle_tp_da92.benchmarks run -b add_versions \
+          -i fs_based -i fs_based_chunked
+
+A manifest is stored with the header of gentle_tp_da92.compression, with the
+codec number compression.MANIFEST and the length of the whole content,
+followed by the binary identifier and the length of each chunk:
+
+    <header> (<32-byte chunk identifier> <8-byte chunk length>)*
+
+Usage example:
+>>> from gentle_tp_da92 import chunking, fs_based
+>>> data_store = fs_based.GentleDataStore(d, chunking=chunking.Chunker())
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from   hashlib import sha256
+import itertools
+import math
+import struct
+
+from   . import compression
+from   .utilities import *
+
+
+DEFAULT_MIN_SIZE = 16 * 1024
+DEFAULT_AVG_SIZE = 64 * 1024
+DEFAULT_MAX_SIZE = 256 * 1024
+
+CHUNKS_DIRNAME = ".chunks"
+
+_ENTRY = struct.Struct("<32sQ")  # binary chunk identifier, chunk length
+
+# The gear hash adds one of these pseudo-random 32-bit numbers per byte.  They
+# must never change, or new chunks would not match the stored ones:
+GEAR = [int(sha256("gentle_tp_da92 gear %u" % i).hexdigest()[:8], 16)
+        for i in xrange(256)]
+
+
+class Chunker(object):
+    """
+    Splits content into chunks of min_size to max_size bytes, about avg_size
+    bytes on average.  Content of more than threshold bytes (default:
+    max_size, and never less) is stored chunked.
+    """
+
+    def __init__(self, min_size=DEFAULT_MIN_SIZE, avg_size=DEFAULT_AVG_SIZE,
+                 max_size=DEFAULT_MAX_SIZE, threshold=None):
+        super(Chunker, self).__init__()
+        if not 0 < min_size < avg_size <= max_size:
+            raise GentleException("invalid chunk sizes: %r, %r, %r" %
+                                  (min_size, avg_size, max_size))
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        # Chunks must not be chunked again:
+        self.threshold = max(threshold or max_size, max_size)
+        # Cut where the top bits of the hash are zero; the low bits only
+        # depend on the last few bytes.  After min_size bytes, that happens
+        # every 2 ** bits bytes on average:
+        bits = max(int(round(math.log(avg_size - min_size, 2))), 1)
+        self.mask = ((1 << bits) - 1) << (32 - bits)
+
+    def wants(self, length):
+        """
+        Return whether content of length bytes is to be stored chunked.
+        """
+        return length > self.threshold
+
+    def _cut(self, data, start, stop):
+        """
+        Return the end of the chunk starting at data[start], where data (a
+        bytearray) ends at stop.
+        """
+        end = min(start + self.max_size, stop)
+        gear, mask = GEAR, self.mask
+        h = 0
+        for i in xrange(start + self.min_size, end):
+            h = ((h << 1) + gear[data[i]]) & 0xFFFFFFFF
+            if not h & mask:
+                return i + 1
+        return end
+
+    def iter_chunks(self, pieces):
+        """
+        Split the content made up of the byte strings pieces into chunks, and
+        generate them.  Only about max_size bytes are kept in memory.
+        """
+        data = bytearray()
+        for piece in pieces:
+            data += piece
+            start = 0
+            # A chunk can be cut once max_size bytes are known:
+            while len(data) - start >= self.max_size:
+                end = self._cut(data, start, len(data))
+                yield str(data[start:end])
+                start = end
+            del data[:start]
+        start = 0
+        while start < len(data):
+            end = self._cut(data, start, len(data))
+            yield str(data[start:end])
+            start = end
+
+    def split(self, byte_string):
+        """
+        Return the list of chunks of byte_string.
+        """
+        return list(self.iter_chunks([byte_string]))
+
+
+def get_chunker(chunking):
+    """
+    Return the Chunker for the chunking argument of the data stores:  None or
+    False (no chunking), True (default chunk sizes), or a Chunker.
+    """
+    if chunking is None or chunking is False:
+        return None
+    if chunking is True:
+        return Chunker()
+    return chunking
+
+def make_manifest(entries, length):
+    """
+    Return the manifest for content of length bytes, made up of chunks given
+    as (identifier, chunk length) pairs.
+    """
+    return (compression.pack_header(compression.MANIFEST, length) +
+            "".join(_ENTRY.pack(identifier.decode("hex"), chunk_length)
+                    for identifier, chunk_length in entries))
+
+def is_manifest(stored):
+    header = compression.parse_header(stored)
+    return header is not None and header[0] == compression.MANIFEST
+
+def parse_manifest(manifest):
+    """
+    Return the (identifier, chunk length) pairs and the content length of a
+    manifest.
+    """
+    _, length = compression.parse_header(manifest)
+    size = len(manifest) - compression.HEADER_SIZE
+    if size % _ENTRY.size:
+        raise GentleException("truncated chunk manifest")
+    entries = []
+    for offset in xrange(compression.HEADER_SIZE, len(manifest), _ENTRY.size):
+        key, chunk_length = _ENTRY.unpack_from(manifest, offset)
+        entries.append((key.encode("hex"), chunk_length))
+    if sum(chunk_length for _, chunk_length in entries) != length:
+        raise GentleException("invalid chunk manifest")
+    return entries, length
+
+def encode(chunker, byte_string, add):
+    """
+    Enter the chunks of byte_string using add(), which enters a single chunk
+    and returns its identifier, and return the manifest.
+    """
+    chunks = chunker.split(byte_string)
+    return make_manifest([(add(chunk), len(chunk)) for chunk in chunks],
+                         len(byte_string))
+
+def encode_stream(chunker, pieces, add):
+    """
+    Like encode(), for the content made up of the byte strings pieces.  Return
+    the content identifier and the manifest, or None and the content itself if
+    it is not to be chunked.
+    """
+    pieces = iter(pieces)
+    head, size = [], 0
+    for piece in pieces:
+        head.append(piece)
+        size += len(piece)
+        if chunker.wants(size): break
+    else:
+        return None, "".join(head)
+    hash_object = sha256()
+    entries, length = [], 0
+    for chunk in chunker.iter_chunks(itertools.chain(head, pieces)):
+        hash_object.update(chunk)
+        entries.append((add(chunk), len(chunk)))
+        length += len(chunk)
+    return hash_object.hexdigest(), make_manifest(entries, length)
+
+def decode(manifest, get):
+    """
+    Return the content of a manifest, reading the chunks using get().
+    """
+    entries, length = parse_manifest(manifest)
+    # One by one, as get() may already run in the data store's thread pool:
+    return "".join([get(identifier) for identifier, _ in entries])
+
+def read_range(manifest, get, offset, length):
+    """
+    Return up to length bytes of the content of a manifest, starting at
+    offset, reading only the chunks needed using get().
+    """
+    entries, _ = parse_manifest(manifest)
+    parts = []
+    start = 0  # of the current chunk
+    for identifier, chunk_length in entries:
+        end = start + chunk_length
+        if end > offset and start < offset + length:
+            chunk = get(identifier)
+            parts.append(chunk[max(offset - start, 0):offset + length - start])
+        start = end
+    return "".join(parts)
@@ -0,0 +1,367 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Compact Memory-Based Data Store Module.
+
+A memory-based data store that needs much less memory per item than
+memory_based, for large numbers of small items:
+
+  - Identifiers are kept as 32-byte binary keys, back to back in one
+    bytearray, and looked up through an open-addressing hash table of entry
+    numbers (an array of C ints).  They are converted from and to hexadecimal
+    only at the API boundary.
+  - Small content is packed into large bytearray arenas, located by an offset
+    table; only content of LARGE_VALUE_SIZE bytes or more is kept as separate
+    Python strings.  Space of deleted content in the arenas is not reused.
+  - Pointer targets are kept as 32-byte binary keys in another bytearray.
+
+Usage example:
+>>> from gentle_tp_da92 import compact_memory_based
+>>> data_store = compact_memory_based.GentleDataStore()
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from   array import array
+from   binascii import hexlify
+from   hashlib import sha256
+import struct
+import threading
+
+from   . import bulk
+from   . import data_store_interfaces
+from   .utilities import *
+
+
+KEY_SIZE = IDENTIFIER_LENGTH / 2
+
+ARENA_SIZE = 4 * 1024 * 1024
+LARGE_VALUE_SIZE = 64 * 1024
+
+_EMPTY, _DELETED = -1, -2
+_LARGE = 2 ** 32 - 1  # arena number of content not stored in an arena
+
+_HASH = struct.Struct("<Q")
+
+
+class _KeyTable(object):
+    """
+    Open-addressing hash table of binary keys, assigning each key an entry
+    number.  Identifiers are SHA-256 hashes or random, so the first bytes of a
+    key serve as its hash.
+    """
+
+    def __init__(self, capacity=16):
+        super(_KeyTable, self).__init__()
+        self.keys = bytearray()  # key of entry e at e * KEY_SIZE
+        self.count = 0
+        self._free = array("i")  # entries of removed keys, for reuse
+        self._slots = array("i", [_EMPTY]) * capacity
+        self._filled = 0  # slots not _EMPTY
+
+    def __len__(self):
+        return self.count
+
+    def _probe(self, key):
+        """
+        Return the slot of key and its entry, or the slot for inserting key and
+        _EMPTY.
+        """
+        slots = self._slots
+        mask = len(slots) - 1
+        keys = self.keys
+        i = _HASH.unpack_from(key)[0] & mask
+        insert_at = None
+        while True:
+            entry = slots[i]
+            if entry == _EMPTY:
+                return (i if insert_at is None else insert_at), _EMPTY
+            if entry == _DELETED:
+                if insert_at is None:
+                    insert_at = i
+            elif keys[entry * KEY_SIZE:(entry + 1) * KEY_SIZE] == key:
+                return i, entry
+            i = (i + 1) & mask
+
+    def get(self, key):
+        """
+        Return the entry of key, or None.
+        """
+        entry = self._probe(key)[1]
+        return None if entry == _EMPTY else entry
+
+    def insert(self, key):
+        """
+        Return the entry of key, adding key if necessary, and whether it was
+        added.
+        """
+        slot, entry = self._probe(key)
+        if entry != _EMPTY:
+            return entry, False
+        if self._free:
+            entry = self._free.pop()
+            self.keys[entry * KEY_SIZE:(entry + 1) * KEY_SIZE] = key
+        else:
+            entry = len(self.keys) // KEY_SIZE
+            self.keys += key
+        if self._slots[slot] == _EMPTY:
+            self._filled += 1
+        self._slots[slot] = entry
+        self.count += 1
+        if self._filled * 3 >= len(self._slots) * 2:
+            # Grow, unless there are mostly deleted slots to clean up:
+            self._resize(len(self._slots) * (2 if self.count * 2 >= len(self._slots) else 1))
+        return entry, True
+
+    def remove(self, key):
+        """
+        Remove key and return its former entry, or None.
+        """
+        slot, entry = self._probe(key)
+        if entry == _EMPTY: return None
+        self._slots[slot] = _DELETED
+        self._free.append(entry)
+        self.count -= 1
+        return entry
+
+    def _resize(self, capacity):
+        slots = array("i", [_EMPTY]) * capacity
+        mask = capacity - 1
+        keys = self.keys
+        for entry in self._slots:
+            if entry < 0: continue
+            i = _HASH.unpack_from(keys, entry * KEY_SIZE)[0] & mask
+            while slots[i] != _EMPTY:
+                i = (i + 1) & mask
+            slots[i] = entry
+        self._slots = slots
+        self._filled = self.count
+
+    def find(self, partial_identifier):
+        """
+        Return a list of the hexadecimal identifiers starting with
+        partial_identifier, in entry order.
+        """
+        free = set(self._free)
+        found = []
+        chunk_entries = 65536  # converted to hexadecimal at once
+        for first in xrange(0, len(self.keys) // KEY_SIZE, chunk_entries):
+            chunk = hexlify(self.keys[first * KEY_SIZE:(first + chunk_entries) * KEY_SIZE])
+            for i in xrange(0, len(chunk), IDENTIFIER_LENGTH):
+                if (chunk.startswith(partial_identifier, i) and
+                        first + i // IDENTIFIER_LENGTH not in free):
+                    found.append(chunk[i:i + IDENTIFIER_LENGTH])
+        return found
+
+
+class _GentleDB(data_store_interfaces._GentleDB):
+    """
+    Base class for Gentle TP-DA92 compact memory-based databases.
+    """
+
+    def __init__(self):
+        super(_GentleDB, self).__init__()
+        self._table = _KeyTable()
+        self._lock = threading.Lock()
+
+    def _value(self, entry):
+        """
+        Return the value (content or content identifier) of an entry.
+        """
+        raise NotImplementedError()
+
+    def _entry(self, identifier):
+        validate_identifier_format(identifier)
+        entry = self._table.get(identifier.decode("hex"))
+        if entry is None:
+            raise KeyError(identifier)
+        return entry
+
+    def __getitem__(self, identifier):
+        with self._lock:
+            return self._value(self._entry(identifier))
+
+    def get_many(self, identifiers):
+        identifiers = list(identifiers)
+        for identifier in identifiers:
+            validate_identifier_format(identifier)
+        with self._lock:
+            return [self._value(self._entry(identifier)) for identifier in identifiers]
+
+    def find(self, partial_identifier=""):
+        validate_identifier_format(partial_identifier, partial=True)
+        with self._lock:
+            return self._table.find(partial_identifier)
+
+    def __contains__(self, identifier):
+        validate_identifier_format(identifier)
+        with self._lock:
+            return self._table.get(identifier.decode("hex")) is not None
+
+    def contains_many(self, identifiers):
+        identifiers = list(identifiers)
+        for identifier in identifiers:
+            validate_identifier_format(identifier)
+        with self._lock:
+            return [self._table.get(identifier.decode("hex")) is not None
+                    for identifier in identifiers]
+
+
+class _GentleContentDB(data_store_interfaces._GentleContentDB, _GentleDB):
+
+    def __init__(self):
+        super(_GentleContentDB, self).__init__()
+        self._arenas = []
+        self._arena_used = 0
+        # Location of the content of each entry:
+        self._arena_numbers = array("I")
+        self._offsets = array("I")
+        self._lengths = array("I")
+        self._large = {}  # entry -> content of LARGE_VALUE_SIZE bytes or more
+
+    def _store(self, entry, byte_string):
+        length = len(byte_string)
+        if length >= LARGE_VALUE_SIZE:
+            self._large[entry] = byte_string
+            arena_number, offset = _LARGE, 0
+        else:
+            if not self._arenas or self._arena_used + length > ARENA_SIZE:
+                self._arenas.append(bytearray(ARENA_SIZE))
+                self._arena_used = 0
+            arena_number, offset = len(self._arenas) - 1, self._arena_used
+            self._arenas[-1][offset:offset + length] = byte_string
+            self._arena_used += length
+        if entry == len(self._lengths):
+            self._arena_numbers.append(arena_number)
+            self._offsets.append(offset)
+            self._lengths.append(length)
+        else:
+            self._arena_numbers[entry] = arena_number
+            self._offsets[entry] = offset
+            self._lengths[entry] = length
+
+    def _buffer(self, entry, offset=0, length=None):
+        """
+        Return a buffer of (a range of) the content of an entry.
+        """
+        size = self._lengths[entry]
+        offset = min(offset, size)
+        if length is None or offset + length > size:
+            length = size - offset
+        arena_number = self._arena_numbers[entry]
+        if arena_number == _LARGE:
+            return buffer(self._large[entry], offset, length)
+        return buffer(self._arenas[arena_number], self._offsets[entry] + offset,
+                      length)
+
+    def _value(self, entry):
+        return str(self._buffer(entry))
+
+    def _add(self, key, byte_string):
+        entry, added = self._table.insert(key)
+        if added:
+            self._store(entry, byte_string)
+
+    def __add__(self, byte_string):
+        key = sha256(byte_string).digest()
+        with self._lock:
+            self._add(key, byte_string)
+        return hexlify(key)
+
+    def add_stream(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        hash_object = sha256()
+        chunks = []
+        for chunk in read_chunks(fileobj, chunk_size):
+            hash_object.update(chunk)
+            chunks.append(chunk)
+        key = hash_object.digest()
+        with self._lock:
+            if self._table.get(key) is None:
+                self._add(key, "".join(chunks))
+        return hexlify(key)
+
+    def add_many(self, byte_strings):
+        byte_strings = list(byte_strings)
+        keyed = [(content_identifier.decode("hex"), byte_string)
+                 for content_identifier, byte_string
+                 in zip(bulk.sha256_many(byte_strings), byte_strings)]
+        with self._lock:
+            for key, byte_string in keyed:
+                self._add(key, byte_string)
+        return [hexlify(key) for key, _ in keyed]
+
+    def read_range(self, identifier, offset, length):
+        with self._lock:
+            return self._buffer(self._entry(identifier), offset, length)
+
+    def __delitem__(self, identifier):
+        validate_identifier_format(identifier)
+        with self._lock:
+            entry = self._table.remove(identifier.decode("hex"))
+            if entry is None:
+                raise KeyError(identifier)
+            self._large.pop(entry, None)
+
+
+class _GentlePointerDB(data_store_interfaces._GentlePointerDB, _GentleDB):
+
+    def __init__(self):
+        super(_GentlePointerDB, self).__init__()
+        self._values = bytearray()  # content key of entry e at e * KEY_SIZE
+
+    def _value(self, entry):
+        return hexlify(self._values[entry * KEY_SIZE:(entry + 1) * KEY_SIZE])
+
+    def _set(self, pointer_identifier, content_identifier):
+        entry, added = self._table.insert(pointer_identifier.decode("hex"))
+        value = content_identifier.decode("hex")
+        if entry * KEY_SIZE == len(self._values):
+            self._values += value
+        else:
+            self._values[entry * KEY_SIZE:(entry + 1) * KEY_SIZE] = value
+
+    def __setitem__(self, pointer_identifier, content_identifier):
+        validate_identifier_format(pointer_identifier)
+        validate_identifier_format(content_identifier)
+        with self._lock:
+            self._set(pointer_identifier, content_identifier)
+        return pointer_identifier
+
+    def set_many(self, items):
+        items = list(items)
+        for pointer_identifier, content_identifier in items:
+            validate_identifier_format(pointer_identifier)
+            validate_identifier_format(content_identifier)
+        with self._lock:
+            for pointer_identifier, content_identifier in items:
+                self._set(pointer_identifier, content_identifier)
+        return [pointer_identifier for pointer_identifier, _ in items]
+
+    def __delitem__(self, identifier):
+        validate_identifier_format(identifier)
+        with self._lock:
+            if self._table.remove(identifier.decode("hex")) is None:
+                raise KeyError(identifier)
+
+
+class GentleDataStore(data_store_interfaces.GentleDataStore):
+
+    def __init__(self):
+        super(GentleDataStore, self).__init__()
+        self.content_db = _GentleContentDB()
+        self.pointer_db = _GentlePointerDB()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Content Compression Module.
+
+Provides transparent per-object compression for the data stores that keep
+content in files (fs_based, pack_based).  A CompressionPolicy decides for each
+byte string whether to compress it, and with which codec:
+
+  - Byte strings shorter than min_size are stored as they are.
+  - Otherwise, a sample of up to sample_size bytes is compressed cheaply
+    (zlib level 1).  If it does not shrink to max_ratio of its size, the byte
+    string is stored as it is.
+  - Otherwise, it is compressed with the codec, and stored compressed unless
+    the result is not smaller than max_ratio of its size after all.
+
+Compressed content is stored with a small header:
+
+    <8-byte magic> <1-byte codec> <8-byte uncompressed length> <data>
+
+Content that is stored as it is has no header, unless it happens to start with
+the magic itself; then it gets a header with the codec "none".  decode()
+therefore returns anything without a header unchanged, and content
+identifiers remain the SHA-256 hashes of the uncompressed content.  Content
+with a header that does not decode (an unknown codec, corrupt data or a wrong
+length) raises GentleException rather than being returned as it is stored.
+
+Available codecs are "zlib" and "bz2", and "lzma" if the lzma module can be
+imported.
+
+Usage example:
+>>> from gentle_tp_da92 import compression, fs_based
+>>> data_store = fs_based.GentleDataStore(d, compression="zlib")
+>>> data_store.compression_stats()["saved_bytes"]
+0
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+import bz2
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+from   .utilities import *
+
+
+MAGIC = "\x89GTPZ1\r\n"
+_HEADER = struct.Struct("<8sBQ")  # magic, codec, uncompressed length
+HEADER_SIZE = _HEADER.size
+
+DEFAULT_CODEC = "zlib"
+DEFAULT_MIN_SIZE = 512
+DEFAULT_SAMPLE_SIZE = 4096
+DEFAULT_MAX_RATIO = 0.9
+
+# name -> (number stored in the header, compress, decompress):
+_CODECS = {
+    "none": (0, None, None),
+    "zlib": (1, zlib.compress, zlib.decompress),
+    "bz2": (2, bz2.compress, bz2.decompress),
+    }
+if lzma is not None:
+    _CODECS["lzma"] = (3, lzma.compress, lzma.decompress)
+
+# Headers with this codec number start the chunk manifests of
+# gentle_tp_da92.chunking, which decode() leaves alone:
+MANIFEST = 15
+
+_CODECS_BY_NUMBER = dict((number, (name, decompress))
+                         for name, (number, _, decompress) in _CODECS.iteritems())
+
+CODECS = tuple(sorted(name for name in _CODECS if name != "none"))
+
+
+class CompressionStats(object):
+    """
+    Thread-safe counters of the space saved by compression, and of the time
+    spent on it.
+    """
+
+    def __init__(self):
+        super(CompressionStats, self).__init__()
+        self._lock = threading.Lock()
+        self.counters = dict(
+            objects=0,             # byte strings encoded
+            compressed_objects=0,  # ... of which stored compressed
+            original_bytes=0,      # their size
+            stored_bytes=0,        # the size stored, headers included
+            compress_seconds=0.0,  # spent sampling and compressing
+            decoded_objects=0,     # compressed byte strings decoded
+            decompress_seconds=0.0,
+            )
+
+    def count(self, **increments):
+        with self._lock:
+            for name, increment in increments.iteritems():
+                self.counters[name] += increment
+
+    def as_dict(self):
+        """
+        Return the counters, and the bytes saved and the compression ratio
+        derived from them.
+        """
+        with self._lock:
+            stats = dict(self.counters)
+        stats["saved_bytes"] = stats["original_bytes"] - stats["stored_bytes"]
+        stats["ratio"] = (float(stats["stored_bytes"]) / stats["original_bytes"]
+                          if stats["original_bytes"] else 1.0)
+        return stats
+
+
+class CompressionPolicy(object):
+    """
+    Decides which content to compress, and with which codec (see above).
+    """
+
+    def __init__(self, codec=DEFAULT_CODEC, min_size=DEFAULT_MIN_SIZE,
+                 sample_size=DEFAULT_SAMPLE_SIZE, max_ratio=DEFAULT_MAX_RATIO):
+        super(CompressionPolicy, self).__init__()
+        if codec not in CODECS:
+            raise GentleException("unavailable compression codec: %r (available: %s)"
+                                  % (codec, ", ".join(CODECS)))
+        self.codec = codec
+        self.min_size = min_size
+        self.sample_size = sample_size
+        self.max_ratio = max_ratio
+
+    def worth_compressing(self, byte_string):
+        if len(byte_string) < self.min_size: return False
+        sample = byte_string[:self.sample_size]
+        return len(zlib.compress(sample, 1)) <= self.max_ratio * len(sample)
+
+    def encode(self, byte_string, stats=None):
+        """
+        Return byte_string as it is to be stored.
+        """
+        start = time.time()
+        stored = None
+        if self.worth_compressing(byte_string):
+            number, compress, _ = _CODECS[self.codec]
+            data = compress(byte_string)
+            if HEADER_SIZE + len(data) < self.max_ratio * len(byte_string):
+                stored = pack_header(number, len(byte_string)) + data
+        compressed = stored is not None
+        if not compressed:
+            stored = escape(byte_string)
+        if stats is not None:
+            stats.count(objects=1, compressed_objects=int(compressed),
+                        original_bytes=len(byte_string), stored_bytes=len(stored),
+                        compress_seconds=time.time() - start)
+        return stored
+
+
+def get_policy(compression):
+    """
+    Return the CompressionPolicy for the compression argument of the data
+    stores:  None (no compression), a codec name, or a CompressionPolicy.
+    """
+    if compression is None or isinstance(compression, CompressionPolicy):
+        return compression
+    return CompressionPolicy(compression)
+
+def is_encoded(prefix):
+    """
+    Return whether stored content starting with prefix (at least HEADER_SIZE
+    bytes, or all of the content) has a header, i.e. must be decoded.
+    """
+    return prefix[:len(MAGIC)] == MAGIC and len(prefix) >= HEADER_SIZE
+
+def pack_header(number, length):
+    return _HEADER.pack(MAGIC, number, length)
+
+def parse_header(stored):
+    """
+    Return the codec number and uncompressed length from the header of stored
+    content, or None if it has none.
+    """
+    if not is_encoded(stored): return None
+    return _HEADER.unpack_from(stored)[1:]
+
+def escape(byte_string):
+    """
+    Return byte_string as it is to be stored uncompressed.
+    """
+    if not is_encoded(byte_string): return byte_string
+    return pack_header(_CODECS["none"][0], len(byte_string)) + byte_string
+
+def decode(stored, stats=None):
+    """
+    Inverse of CompressionPolicy.encode() and escape().  Anything without a
+    header (e.g. written before compression was used) is returned as it is.
+    """
+    header = parse_header(stored)
+    if header is None: return stored
+    start = time.time()
+    number, length = header
+    if number not in _CODECS_BY_NUMBER:
+        raise GentleException("unknown compression codec number: %u" % number)
+    name, decompress = _CODECS_BY_NUMBER[number]
+    data = buffer(stored, HEADER_SIZE)
+    try:
+        content = str(data) if decompress is None else decompress(data)
+    except Exception as e:
+        raise GentleException("corrupt %s compressed content: %s" % (name, e))
+    if len(content) != length:
+        raise GentleException("corrupt %s compressed content: %u bytes instead of %u"
+                              % (name, len(content), length))
+    if stats is not None and decompress is not None:
+        stats.count(decoded_objects=1, decompress_seconds=time.time() - start)
+    return content
@@ -21,6 +21,10 @@ Defines the interfaces used by the data store implementation module classes.
 # You should have received a copy of the GNU Lesser General Public
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from   io import BytesIO
+
+from   .utilities import *
+
 
 class _GentleDB(object):
     """
@@ -60,6 +64,23 @@ class _GentleDB(object):
         """
         return []
 
+    def iterfind(self, partial_identifier="", limit=None, after=None):
+        """
+        Like find(), but return an iterator over the identifiers in sorted
+        order.  Stop after limit identifiers if limit is not None.  If after is
+        not None, start with the first identifier greater than after, so that
+        the last identifier of one page is the cursor for the next one.
+
+        Implementations may produce the identifiers lazily.  This default
+        implementation sorts the list returned by find().
+
+        Example:
+        >>> page = list(gentle_db.iterfind("", limit=1000))
+        >>> next_page = list(gentle_db.iterfind("", limit=1000, after=page[-1]))
+        """
+        identifiers = sorted(self.find(partial_identifier))
+        return page_identifiers(identifiers, limit, after)
+
     def findone(self, partial_identifier=""):
         """
         Find one identifier registered in this database that starts with
@@ -86,6 +107,23 @@ class _GentleDB(object):
         """
         return False
 
+    def get_many(self, identifiers):
+        """
+        Get several items from the database.  Return a list of the items, in
+        the order of the given identifiers.
+
+        Implementations may fetch the items in parallel, or in a single
+        request.  This default implementation gets them one by one.
+        """
+        return [self[identifier] for identifier in identifiers]
+
+    def contains_many(self, identifiers):
+        """
+        Return a list of bools telling whether the database contains content
+        for each of the given identifiers.
+        """
+        return [identifier in self for identifier in identifiers]
+
 
 class _GentleContentDB(_GentleDB):
     """
@@ -117,6 +155,60 @@ class _GentleContentDB(_GentleDB):
         """
         return None
 
+    def add_stream(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Enter the content read from the file-like object fileobj into the
+        content database and return its content identifier, like __add__().
+
+        fileobj is read in chunks of chunk_size bytes.  Implementations hash
+        the chunks as they arrive, so that they need not keep all of the
+        content in memory.  This default implementation does, though.
+
+        Example:
+        >>> with open("some file", "rb") as f:
+        ...     identifier = content_db.add_stream(f)
+        """
+        return self + "".join(read_chunks(fileobj, chunk_size))
+
+    def open(self, identifier):
+        """
+        Return a read-only file-like object for the content with the given
+        identifier.
+
+        Implementations may read the content piecewise as the returned object
+        is read from.  This default implementation does not.
+
+        Example:
+        >>> f = content_db.open(identifier)
+        >>> f.read(4)
+        'some'
+        """
+        return BytesIO(self[identifier])
+
+    def read_range(self, identifier, offset, length):
+        """
+        Return at most length bytes of the content with the given identifier,
+        starting at offset, as a read-only buffer object.
+
+        Implementations may return a buffer over a memory-mapped file, which
+        avoids copying the content; use str() to get a string.
+
+        Example:
+        >>> str(content_db.read_range(identifier, 5, 3))
+        'con'
+        """
+        return buffer(self[identifier], offset, length)
+
+    def add_many(self, byte_strings):
+        """
+        Enter several pieces of content into the content database.  Return a
+        list of their content identifiers, in the order of byte_strings.
+
+        Example:
+        >>> identifiers = content_db.add_many(["some content", "more content"])
+        """
+        return [self + byte_string for byte_string in byte_strings]
+
 
 class _GentlePointerDB(_GentleDB):
     """
@@ -140,6 +232,16 @@ class _GentlePointerDB(_GentleDB):
         # self.__setitem__(x,y) instead.
         return None
 
+    def set_many(self, items):
+        """
+        Create or change several pointers in the pointer database.  items is
+        an iterable of (pointer_identifier, content_identifier) pairs; if a
+        pointer occurs several times, the last pair wins.  Return a list of the
+        pointer identifiers.
+        """
+        return [self.__setitem__(pointer_identifier, content_identifier)
+                for pointer_identifier, content_identifier in items]
+
     def __delitem__(self, pointer_identifier):
         """
         Delete a pointer from the database.
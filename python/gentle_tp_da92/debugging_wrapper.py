@@ -60,6 +60,13 @@ class _GentleDB(data_store_interfaces._GentleDB):
         self.log("FIND >> ok: (len) %u" % len(identifiers))
         return identifiers
 
+    def iterfind(self, partial_identifier="", limit=None, after=None):
+        self.log("ITERFIND << %r %r %r" % (partial_identifier, limit, after))
+        validate_identifier_format(partial_identifier, partial=True)
+        identifiers = self.db.iterfind(partial_identifier, limit, after)
+        self.log("ITERFIND >> ok")
+        return identifiers
+
     def __contains__(self, identifier):
         self.log("CONTAINS << %r" % identifier)
         validate_identifier_format(identifier)
@@ -67,6 +74,24 @@ class _GentleDB(data_store_interfaces._GentleDB):
         self.log("CONTAINS >> ok: %r" % result)
         return result
 
+    def get_many(self, identifiers):
+        identifiers = list(identifiers)
+        self.log("GET_MANY << (len) %u" % len(identifiers))
+        contents = self.db.get_many(identifiers)
+        if self.show_content:
+            cdisp = "%r" % contents
+        else:
+            cdisp = "(total len) %u" % sum(len(content) for content in contents)
+        self.log("GET_MANY >> ok: %s" % cdisp)
+        return contents
+
+    def contains_many(self, identifiers):
+        identifiers = list(identifiers)
+        self.log("CONTAINS_MANY << (len) %u" % len(identifiers))
+        result = self.db.contains_many(identifiers)
+        self.log("CONTAINS_MANY >> ok: (found) %u" % sum(result))
+        return result
+
 
 class _GentleContentDB(data_store_interfaces._GentleContentDB, _GentleDB):
 
@@ -85,6 +110,39 @@ class _GentleContentDB(data_store_interfaces._GentleContentDB, _GentleDB):
         self.log("ADD >> ok: %r" % content_identifier)
         return content_identifier
 
+    def add_many(self, byte_strings):
+        byte_strings = list(byte_strings)
+        if self.show_content:
+            cdisp = "%r" % byte_strings
+        else:
+            cdisp = "(len) %u" % len(byte_strings)
+        self.log("ADD_MANY << %s" % cdisp)
+        content_identifiers = self.db.add_many(byte_strings)
+        self.log("ADD_MANY >> ok: %r" % content_identifiers)
+        return content_identifiers
+
+    def add_stream(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.log("ADD_STREAM << (chunk_size) %u" % chunk_size)
+        content_identifier = self.db.add_stream(fileobj, chunk_size)
+        self.log("ADD_STREAM >> ok: %r" % content_identifier)
+        return content_identifier
+
+    def open(self, identifier):
+        self.log("OPEN << %r" % identifier)
+        f = self.db.open(identifier)
+        self.log("OPEN >> ok")
+        return f
+
+    def read_range(self, identifier, offset, length):
+        self.log("READ_RANGE << %r %u %u" % (identifier, offset, length))
+        content = self.db.read_range(identifier, offset, length)
+        if self.show_content:
+            cdisp = "%r" % str(content)
+        else:
+            cdisp = "(len) %u" % len(content)
+        self.log("READ_RANGE >> ok: %s" % cdisp)
+        return content
+
 
 class _GentlePointerDB(data_store_interfaces._GentlePointerDB, _GentleDB):
 
@@ -101,6 +159,13 @@ class _GentlePointerDB(data_store_interfaces._GentlePointerDB, _GentleDB):
         self.log("SET >> ok")
         return pointer_identifier
 
+    def set_many(self, items):
+        items = list(items)
+        self.log("SET_MANY << %r" % items)
+        pointer_identifiers = self.db.set_many(items)
+        self.log("SET_MANY >> ok")
+        return pointer_identifiers
+
     def __delitem__(self, identifier):
         self.log("DEL << %r" % identifier)
         validate_identifier_format(identifier)
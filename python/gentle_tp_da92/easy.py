@@ -33,6 +33,7 @@ the data store implementation modules.
 from __future__ import print_function
 
 from   functools import partial
+import heapq
 import os
 import sys
 
@@ -73,32 +74,74 @@ class _InitSimplifiers(object):
     def _passthrough(*a, **k):
         return (a, k)
 
-    ## SIMPLIFICATION FOR gentle_tp_da92.fs_based ##
-
     USER_HOME = os.path.expanduser("~")
-    FS_DEFAULT_DIRECTORY = os.path.join(USER_HOME, ".gentle_tp_da92_default_datastore")
-    FS_DEFAULT_ENVIRON_KEY = "GENTLE_TP_DA92_DIR"
 
-    @classmethod
-    def simplify__gentle_tp_da92__fs_based(cls, fs_based, directory=True,
-                                           environ_key=True, *a, **k):
+    @staticmethod
+    def _simplify_directory(default_directory, default_environ_key,
+                            directory, environ_key, a, k):
         """
-        Convert arguments to be passed to fs_based.GentleDataStore().
+        Convert arguments to be passed to the GentleDataStore() of a data store
+        implementation module whose first argument is a directory.
         """
         # 'directory' is 'None' only if 'None' has been specified explicitly:
         if directory is None:  # bypass environment variables and just use default dir
-            directory = cls.FS_DEFAULT_DIRECTORY
+            directory = default_directory
         if directory is True:  # i.e. not specified, use environment variable if set
-            directory = cls.FS_DEFAULT_DIRECTORY
+            directory = default_directory
             # 'environ_key' is 'None' only if 'None' has been specified explicitly:
             if environ_key is not None:
                 if environ_key is True:  # i.e. not specified
-                    environ_key = cls.FS_DEFAULT_ENVIRON_KEY
+                    environ_key = default_environ_key
                 directory = os.environ.get(environ_key, directory)
         directory = os.path.abspath(directory)
         k["mkdir"] = k.get("mkdir", True)  # default to True instead of to False
         return ((directory,) + a, k)
 
+    ## SIMPLIFICATION FOR gentle_tp_da92.fs_based ##
+
+    FS_DEFAULT_DIRECTORY = os.path.join(USER_HOME, ".gentle_tp_da92_default_datastore")
+    FS_DEFAULT_ENVIRON_KEY = "GENTLE_TP_DA92_DIR"
+
+    @classmethod
+    def simplify__gentle_tp_da92__fs_based(cls, fs_based, directory=True,
+                                           environ_key=True, *a, **k):
+        """
+        Convert arguments to be passed to fs_based.GentleDataStore().
+        """
+        return cls._simplify_directory(
+            cls.FS_DEFAULT_DIRECTORY, cls.FS_DEFAULT_ENVIRON_KEY,
+            directory, environ_key, a, k)
+
+    ## SIMPLIFICATION FOR gentle_tp_da92.pack_based ##
+
+    PACK_DEFAULT_DIRECTORY = os.path.join(USER_HOME, ".gentle_tp_da92_default_pack_datastore")
+    PACK_DEFAULT_ENVIRON_KEY = "GENTLE_TP_DA92_PACK_DIR"
+
+    @classmethod
+    def simplify__gentle_tp_da92__pack_based(cls, pack_based, directory=True,
+                                             environ_key=True, *a, **k):
+        """
+        Convert arguments to be passed to pack_based.GentleDataStore().
+        """
+        return cls._simplify_directory(
+            cls.PACK_DEFAULT_DIRECTORY, cls.PACK_DEFAULT_ENVIRON_KEY,
+            directory, environ_key, a, k)
+
+    ## SIMPLIFICATION FOR gentle_tp_da92.sqlite_based ##
+
+    SQLITE_DEFAULT_DIRECTORY = os.path.join(USER_HOME, ".gentle_tp_da92_default_sqlite_datastore")
+    SQLITE_DEFAULT_ENVIRON_KEY = "GENTLE_TP_DA92_SQLITE_DIR"
+
+    @classmethod
+    def simplify__gentle_tp_da92__sqlite_based(cls, sqlite_based, directory=True,
+                                               environ_key=True, *a, **k):
+        """
+        Convert arguments to be passed to sqlite_based.GentleDataStore().
+        """
+        return cls._simplify_directory(
+            cls.SQLITE_DEFAULT_DIRECTORY, cls.SQLITE_DEFAULT_ENVIRON_KEY,
+            directory, environ_key, a, k)
+
 
 _init_simplifiers = _InitSimplifiers()
 
@@ -129,6 +172,16 @@ class _GentleEasyDataStoreWrapper(object):
         all_identifiers = content_identifiers + pointer_identifiers
         return all_identifiers
 
+    def iterfind(self, partial_identifier="", limit=None, after=None):
+        """
+        Iterate over the identifiers in both databases starting with
+        partial_identifier, in sorted order.  See
+        data_store_interfaces._GentleDB.iterfind() for limit and after.
+        """
+        identifiers = heapq.merge(self.c.iterfind(partial_identifier, limit, after),
+                                  self.p.iterfind(partial_identifier, limit, after))
+        return page_identifiers(identifiers, limit)
+
     def __getitem__(self, identifier):
         """
         Get an item from either database.
@@ -139,8 +192,7 @@ class _GentleEasyDataStoreWrapper(object):
         found whose identifier starts with the given identifier, otherwise
         return a list of the identifiers that start with the given identifier.
         """
-        content_identifiers = self.c.find(identifier)
-        pointer_identifiers = self.p.find(identifier)
+        content_identifiers, pointer_identifiers = self.__find_both(identifier)
         all_identifiers = content_identifiers + pointer_identifiers
         if len(all_identifiers) != 1:
             return all_identifiers  # a list
@@ -149,6 +201,18 @@ class _GentleEasyDataStoreWrapper(object):
         else:
             return self.p[pointer_identifiers[0]]  # a string
 
+    def __find_both(self, identifier):
+        """
+        Return the lists of content and of pointer identifiers starting with
+        identifier.  A complete identifier is looked up using __contains__(),
+        which is much cheaper than find() for most data stores, and can answer
+        from a Bloom filter.
+        """
+        if is_identifier_format_valid(identifier):
+            return ([identifier] if identifier in self.c else [],
+                    [identifier] if identifier in self.p else [])
+        return self.c.find(identifier), self.p.find(identifier)
+
     @staticmethod
     def __find_one(gentle_db, identifier):
         if is_identifier_format_valid(identifier):
@@ -166,6 +230,13 @@ class _GentleEasyDataStoreWrapper(object):
     def __add__(self, content):
         return self.c + content
 
+    def add_stream(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Enter the content read from the file-like object fileobj into the
+        content database, without keeping all of it in memory.
+        """
+        return self.c.add_stream(fileobj, chunk_size)
+
     def __delitem__(self, identifier):
         """
         Remove an item from either database.
@@ -174,8 +245,7 @@ class _GentleEasyDataStoreWrapper(object):
         must be exactly one identifier in both databases combined that starts
         with the given identifier.
         """
-        content_identifiers = self.c.find(identifier)
-        pointer_identifiers = self.p.find(identifier)
+        content_identifiers, pointer_identifiers = self.__find_both(identifier)
         all_identifiers = content_identifiers + pointer_identifiers
         if len(all_identifiers) != 1:
             raise InvalidIdentifierException(identifier)
@@ -197,6 +267,8 @@ class _GentleEasyDataStoreWrapper(object):
         # database is:
         #   1. smaller, and:
         #   2. more likely to be the target of the enquiry.
+        if is_identifier_format_valid(identifier):
+            return identifier in self.p or identifier in self.c
         pointer_identifiers = self.p.find(identifier)
         if pointer_identifiers: return True
         content_identifiers = self.c.find(identifier)
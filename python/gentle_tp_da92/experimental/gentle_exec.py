@@ -54,7 +54,7 @@ def _freeze_trans(g, trans, trans_p, input_key):
     return _freeze_doc(g, trans, trans_p), trans
 
 
-def _execute(input, script):
+def _execute(g, input, script):
     tmp = tempfile.NamedTemporaryFile(delete=False)
     tmp.write(script)
     tmp.close()
@@ -65,8 +65,10 @@ def _execute(input, script):
     t_start = time.time.time()
     ts_start = time.format_time_with_offset(t_start)
 
-    proc = subprocess.Popen(tmp.name, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    output = proc.communicate(input)[0]
+    # Spool the output to a file, to enter it without keeping it in memory:
+    output = tempfile.TemporaryFile()
+    proc = subprocess.Popen(tmp.name, stdin=subprocess.PIPE, stdout=output)
+    proc.communicate(input)
     os.unlink(tmp.name)
     if proc.returncode != 0:
         print("ERROR: Execution failed with status code %u" % proc.returncode, file=sys.stderr)
@@ -75,7 +77,11 @@ def _execute(input, script):
     t_end = time.time.time()
     ts_end = time.format_time_with_offset(t_end)
 
-    return output, ts_start, ts_end
+    output.seek(0)
+    with output:
+        output_c = g.c.add_stream(output)
+
+    return output_c, ts_start, ts_end
 
 
 def command_copy(trans_pid):
@@ -157,12 +163,12 @@ def command_exec(trans_p):
     script_c = g.p[script_p]
     script = g.c[script_c]
 
-    output, ts_start, ts_end = _execute(input, script)
+    output_c, ts_start, ts_end = _execute(g, input, script)
 
     outdoc = {
         "Transformation:json:content": trans_f,
         "Start:timestamp": ts_start,
-        "Output:content": g.c + output,
+        "Output:content": output_c,
         "End:timestamp": ts_end
     }
     g.p[output_p] = g.c + json.dumps(outdoc)
@@ -18,6 +18,38 @@ tree:
             5678fedc5678fedc5678fedc5678fedc5678fedc5678fedc5678fedc5678fedc
             ... (files containing names of content; name = random)
 
+Either database may instead use a fan-out layout, which spreads the files over
+subdirectories named after the leading digits of their names, e.g. for the
+layout "2/2":
+
+        content_db/
+            .layout   (contains "2/2")
+            12/
+                34/
+                    1234abcd1234abcd1234abcd1234abcd1234abcd1234abcd1234abcd1234abcd
+            ...
+
+This keeps directories small when storing millions of objects.  Existing
+databases can be converted in place using GentleDataStore.migrate_layout(), or
+'python -m gentle_tp_da92 layout <layout>'.
+
+Files are written under a hidden temporary name and renamed into place, so
+readers and crashes never leave a partially written file under its final name.
+The durability argument selects when the written files are fsync()ed:
+
+    "none"     Not at all; the operating system writes them eventually.
+    "batched"  Group commit: a background thread collects the writes of all
+               threads for group_commit_interval seconds, then fsync()s the
+               files, renames them and fsync()s their directories together.
+               Writers wait for the batch, so a write is durable on return.
+    "per-op"   Each write fsync()s its file and directory before returning.
+
+With the compression argument, content is compressed as decided by a policy
+(see gentle_tp_da92.compression).  Compressed content files start with a
+header, and are decompressed transparently when read.  With the chunking
+argument, large content is split into chunks stored as content of their own,
+and stored as a manifest of its chunks (see gentle_tp_da92.chunking).
+
 It is recommended to use the gentle_tp_da92.easy module in applications, instead
 of directly using the data store implementation modules.
 
@@ -39,51 +71,705 @@ the gentle_tp_da92.data_store_interfaces module.
 # You should have received a copy of the GNU Lesser General Public
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+from __future__ import absolute_import
+
+import errno
 import glob
 from   hashlib import sha256
+from   io import BytesIO
+import mmap
+from   multiprocessing.pool import ThreadPool
 import os
+import tempfile
+import threading
+import time
 
+from   . import bloom_filter
+from   . import chunking as _chunking
+from   . import compression as _compression
 from   . import data_store_interfaces
+from   . import log_based
+from   . import prefix_index
 from   .utilities import *
 
 
+# Names of the layout marker files kept in each database directory.  Their
+# names start with a dot, so glob() does not report them as identifiers:
+LAYOUT_FILENAME = ".layout"
+PREVIOUS_LAYOUT_FILENAME = ".layout-previous"
+INDEX_DIRNAME = ".index"
+BLOOM_DIRNAME = ".bloom"
+# add_stream() spools content here, so that the database directory only
+# changes (see _GentleDB._stamp()) when the content is new:
+SPOOL_DIRNAME = ".spool"
+
+# Number of threads doing file I/O for the batch methods (get_many() etc.):
+IO_THREADS = 8
+
+DURABILITY_LEVELS = ("none", "batched", "per-op")
+DEFAULT_DURABILITY = "none"
+DEFAULT_GROUP_COMMIT_INTERVAL = 0.005
+
+
+def parse_layout(layout):
+    """
+    Convert a layout specification into a tuple of fan-out directory name
+    lengths.
+
+    Accepts None or "flat" (no fan-out directories), a string like "2/2", or a
+    sequence of integers like (2, 2).  The layout (2, 2) stores the object with
+    identifier 'abcd...' as 'ab/cd/abcd...'.
+    """
+    if layout is None or layout == "flat":
+        return ()
+    try:
+        if isinstance(layout, basestring):
+            layout = [int(width) for width in layout.split("/")]
+        layout = tuple(int(width) for width in layout)
+    except (TypeError, ValueError):
+        raise GentleException("invalid layout: %r" % (layout,))
+    if not (all(width > 0 for width in layout) and
+            sum(layout) < IDENTIFIER_LENGTH):
+        raise GentleException("invalid layout: %r" % (layout,))
+    return layout
+
+def format_layout(layout):
+    """
+    Inverse of parse_layout(): return the string representation of a layout.
+    """
+    return "/".join(str(width) for width in layout) or "flat"
+
+def _read_layout_file(filename, default):
+    try:
+        return parse_layout(open(filename, "rb").read().strip())
+    except IOError as e:
+        if e.errno != errno.ENOENT: raise
+        return default
+
+def _write_layout_file(filename, layout):
+    # Write to a temporary file first, and rename it into place, so that
+    # readers always see a complete file and notice the change by the new inode:
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        f.write(format_layout(layout) + "\n")
+    os.rename(tmp_filename, filename)
+
+_io_pool = None
+_io_pool_lock = threading.Lock()
+
+def _map_io(function, items):
+    """
+    Call function for each of the items in a shared pool of threads, and return
+    the list of results.  The GIL is released during file I/O and hashing, so
+    the calls overlap.
+    """
+    global _io_pool
+    items = list(items)
+    if len(items) < 2:
+        return map(function, items)
+    with _io_pool_lock:
+        if _io_pool is None:
+            _io_pool = ThreadPool(IO_THREADS)
+    return _io_pool.map(function, items)
+
+def _fsync_path(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class _GroupCommitter(object):
+    """
+    Renames temporary files into place for the "batched" durability level.
+
+    The files given to commit() by all threads within interval seconds form a
+    batch, which a background thread makes durable with one fsync() per file
+    and one per directory, instead of each writer syncing the (same)
+    directories on its own.
+    """
+
+    def __init__(self, interval=DEFAULT_GROUP_COMMIT_INTERVAL):
+        super(_GroupCommitter, self).__init__()
+        self.interval = interval
+        self._condition = threading.Condition(threading.Lock())
+        self._pending = []  # [temporary filename, filename, directories, error]
+        self._collecting = 0  # number of the batch being collected
+        self._committed = 0  # number of batches committed
+        self._thread = None
+        self.batches = 0
+        self.files = 0
+
+    def commit(self, tmp_filename, filename, directories):
+        """
+        Rename tmp_filename to filename, and return once both, and the given
+        directories, have been synced.
+        """
+        entry = [tmp_filename, filename, directories, None]
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run,
+                                                name="fs_based group commit")
+                self._thread.daemon = True
+                self._thread.start()
+            self._pending.append(entry)
+            batch = self._collecting
+            self._condition.notify_all()
+            while self._committed <= batch:
+                self._condition.wait()
+        if entry[3] is not None:
+            raise entry[3]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+            time.sleep(self.interval)  # let concurrent writers join the batch
+            with self._condition:
+                pending, self._pending = self._pending, []
+                self._collecting += 1
+            try:
+                self._commit_batch(pending)
+            except Exception as e:
+                # Fail the batch rather than leave its writers waiting:
+                for entry in pending:
+                    entry[3] = entry[3] or e
+            with self._condition:
+                self._committed += 1
+                self.batches += 1
+                self.files += len(pending)
+                self._condition.notify_all()
+
+    @staticmethod
+    def _commit_batch(pending):
+        directories = {}  # directory -> entries depending on it
+        for entry in pending:
+            tmp_filename, filename, entry_directories, _ = entry
+            try:
+                _fsync_path(tmp_filename)
+                os.rename(tmp_filename, filename)
+            except EnvironmentError as e:
+                entry[3] = e
+                continue
+            for directory in entry_directories:
+                directories.setdefault(directory, []).append(entry)
+        for directory, entries in directories.iteritems():
+            try:
+                _fsync_path(directory)
+            except EnvironmentError as e:
+                for entry in entries:
+                    entry[3] = entry[3] or e
+
+
 class _GentleDB(data_store_interfaces._GentleDB):
     """
     Base class for Gentle TP-DA92 filesystem-based databases.
+
+    The files may be stored directly in the database directory (the "flat"
+    layout), or in a tree of fan-out directories named after the leading digits
+    of their identifiers (see parse_layout()).  The layout is recorded in a
+    marker file and detected automatically.
+
+    If index is True, a persistent prefix index (see
+    gentle_tp_da92.prefix_index) speeds up find().
+
+    durability is one of DURABILITY_LEVELS; "batched" needs a _GroupCommitter
+    as committer.
     """
 
-    def __init__(self, directory, mkdir=False):
+    def __init__(self, directory, mkdir=False, layout=None, index=False,
+                 durability=DEFAULT_DURABILITY, committer=None):
         super(_GentleDB, self).__init__()
         self.directory = directory
+        if durability not in DURABILITY_LEVELS:
+            raise GentleException("invalid durability: %r" % (durability,))
+        if durability == "batched" and committer is None:
+            committer = _GroupCommitter()
+        self.durability = durability
+        self.committer = committer
         if mkdir and not os.path.exists(self.directory):
             os.mkdir(self.directory, 0700)
+        self._layout_signature = False  # i.e. never loaded
+        self._load_layout()
+        if layout is not None:
+            layout = parse_layout(layout)
+            if layout != self.layout:
+                self._init_layout(layout)
+        self.index = None
+        if index:
+            self.index = prefix_index.PrefixIndex(
+                os.path.join(self.directory, INDEX_DIRNAME),
+                scan=self._glob_find, stamp=self._stamp)
+
+    def _init_layout(self, layout):
+        if self.previous_layout is not None or self._has_files():
+            raise GentleException(
+                "%r uses layout %r, not %r; use migrate_layout() to convert it" %
+                (self.directory, format_layout(self.layout), format_layout(layout)))
+        if os.path.exists(self.directory):
+            _write_layout_file(os.path.join(self.directory, LAYOUT_FILENAME), layout)
+            self._load_layout()
+        else:
+            self.layout = layout
+
+    def _has_files(self):
+        if not os.path.exists(self.directory): return False
+        return any(not n.startswith(".") for n in os.listdir(self.directory))
+
+    def _load_layout(self):
+        """
+        (Re-)read the layout marker files if they have changed.
+
+        Return True if the layout has changed since the last call.
+        """
+        filename = os.path.join(self.directory, LAYOUT_FILENAME)
+        try:
+            st = os.stat(filename)
+            signature = (st.st_ino, st.st_mtime)
+        except OSError:
+            signature = None
+        if signature == self._layout_signature: return False
+        self._layout_signature = signature
+        self.layout = _read_layout_file(filename, ())
+        self.previous_layout = _read_layout_file(
+            os.path.join(self.directory, PREVIOUS_LAYOUT_FILENAME), None)
+        return True
+
+    def _layouts(self):
+        if self.previous_layout is None:
+            return (self.layout,)
+        return (self.layout, self.previous_layout)
+
+    def _path(self, identifier, layout=None):
+        if layout is None: layout = self.layout
+        parts, offset = [self.directory], 0
+        for width in layout:
+            parts.append(identifier[offset:offset + width])
+            offset += width
+        parts.append(identifier)
+        return os.path.join(*parts)
+
+    def _glob_pattern(self, partial_identifier, layout):
+        parts, offset = [self.directory], 0
+        for width in layout:
+            part = partial_identifier[offset:offset + width]
+            parts.append(part + "?" * (width - len(part)))
+            offset += width
+        parts.append(partial_identifier + "*")
+        return os.path.join(*parts)
+
+    @staticmethod
+    def _makedirs(filename):
+        """
+        Create the missing directories above filename, and return whether
+        there were any.
+        """
+        dirname = os.path.dirname(filename)
+        try:
+            os.makedirs(dirname, 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST: raise
+            return False
+        return True
+
+    def _commit(self, tmp_filename, filename, mode, created=None):
+        """
+        Rename a completely written temporary file into place, as durably as
+        self.durability asks for.  created tells whether the directories above
+        filename have just been created; if None, they are created here.
+        """
+        os.chmod(tmp_filename, mode)
+        if created is None:
+            created = self._makedirs(filename)
+        dirname = os.path.dirname(filename)
+        directories = [dirname]
+        if created:
+            # The entries of new fan-out directories need syncing as well:
+            for width in self.layout:
+                dirname = os.path.dirname(dirname)
+                directories.append(dirname)
+        if self.durability == "batched":
+            self.committer.commit(tmp_filename, filename, directories)
+            return
+        if self.durability == "per-op":
+            _fsync_path(tmp_filename)
+        os.rename(tmp_filename, filename)
+        if self.durability == "per-op":
+            for directory in directories:
+                _fsync_path(directory)
+
+    def _write_file(self, filename, data, mode):
+        """
+        Write data to filename atomically, through a hidden temporary file in
+        the same directory.
+        """
+        created = self._makedirs(filename)
+        fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                            prefix=".write-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            self._commit(tmp_filename, filename, mode, created)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    def _find_path(self, identifier):
+        """
+        Return the name of the existing file for identifier, or None.
+
+        Copes with a layout migration running concurrently (in this or another
+        process):  The migration links each file into its new place before
+        unlinking the old one, so checking the new, the old, and then the new
+        place again never misses a file.
+        """
+        for attempt in (0, 1):
+            layouts = self._layouts()
+            if len(layouts) > 1:
+                layouts += layouts[:1]
+            for layout in layouts:
+                filename = self._path(identifier, layout)
+                if os.path.exists(filename): return filename
+            if not self._load_layout(): break
+        return None
+
+    def _open(self, identifier):
+        try:
+            return open(self._path(identifier), "rb")
+        except IOError as e:
+            if e.errno != errno.ENOENT: raise
+        filename = self._find_path(identifier)
+        if filename is None:
+            filename = self._path(identifier)  # raise the usual IOError
+        return open(filename, "rb")
 
     def __getitem__(self, identifier):
         validate_identifier_format(identifier)
-        filename = os.path.join(self.directory, identifier)
-        content = open(filename, "rb").read()
+        content = self._open(identifier).read()
         return content
 
+    def _stamp(self):
+        # Changes inside existing fan-out directories go unnoticed here; call
+        # self.index.rebuild() after modifying those behind the index's back.
+        return os.stat(self.directory).st_mtime
+
+    def _deep_stamp(self):
+        """
+        Like _stamp(), but also noticing changes inside fan-out directories,
+        at the cost of a stat() per fan-out directory.
+        """
+        self._load_layout()
+        stamps = [self._stamp()]
+        for layout in self._layouts():
+            pattern = self.directory
+            for width in layout:
+                pattern = os.path.join(pattern, "?" * width)
+                for dirname in glob.glob(pattern):
+                    try:
+                        stamps.append(os.stat(dirname).st_mtime)
+                    except OSError as e:
+                        if e.errno != errno.ENOENT: raise
+        return max(stamps)
+
     def find(self, partial_identifier=""):
         validate_identifier_format(partial_identifier, partial=True)
-        partial_filename = os.path.join(self.directory, partial_identifier)
-        matches = glob.glob(partial_filename + "*")
-        identifiers = [os.path.basename(m) for m in matches]
+        if self.index is not None:
+            identifiers = self.index.find(partial_identifier)
+            if identifiers is not None:
+                return identifiers
+        return self._glob_find(partial_identifier)
+
+    def _glob_find(self, partial_identifier=""):
+        self._load_layout()
+        layouts = self._layouts()
+        identifiers = []
+        for layout in layouts:
+            matches = glob.glob(self._glob_pattern(partial_identifier, layout))
+            identifiers.extend(os.path.basename(m) for m in matches)
+        if len(layouts) > 1:
+            # The patterns may also match fan-out directories of the other
+            # layout, and a file may be found in both places:
+            identifiers = list(set(i for i in identifiers
+                                   if len(i) == IDENTIFIER_LENGTH))
         return identifiers
 
+    def iterfind(self, partial_identifier="", limit=None, after=None):
+        validate_identifier_format(partial_identifier, partial=True)
+        if self.index is not None:
+            identifiers = self.index.iterfind(partial_identifier, after)
+            if identifiers is not None:
+                return page_identifiers(identifiers, limit, after)
+        self._load_layout()
+        if self.previous_layout is not None:  # a migration is in progress
+            identifiers = sorted(self._glob_find(partial_identifier))
+        else:
+            identifiers = self._iterdir(self.directory, self.layout,
+                                        partial_identifier, after)
+        return page_identifiers(identifiers, limit, after)
+
+    def _iterdir(self, directory, layout, partial_identifier, after, leading=""):
+        """
+        Generate the sorted identifiers starting with partial_identifier that
+        are stored below directory, whose fan-out directories follow layout.
+        leading holds the digits of the fan-out directories above directory.
+        Fan-out directories holding only identifiers up to after are skipped.
+        """
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError as e:
+            if e.errno != errno.ENOENT: raise
+            return
+        if not layout:
+            for name in names:
+                if (len(name) == IDENTIFIER_LENGTH and not name.startswith(".")
+                        and name.startswith(partial_identifier)):
+                    yield name
+            return
+        for name in names:
+            if len(name) != layout[0] or name.startswith("."): continue
+            digits = leading + name
+            n = min(len(digits), len(partial_identifier))
+            if digits[:n] != partial_identifier[:n]: continue
+            if after is not None and digits < after[:len(digits)]: continue
+            for identifier in self._iterdir(os.path.join(directory, name),
+                                            layout[1:], partial_identifier,
+                                            after, digits):
+                yield identifier
+
     def __contains__(self, identifier):
         validate_identifier_format(identifier)
-        filename = os.path.join(self.directory, identifier)
-        return os.path.exists(filename)
+        return self._find_path(identifier) is not None
+
+    def get_many(self, identifiers):
+        return _map_io(self.__getitem__, identifiers)
+
+    def contains_many(self, identifiers):
+        return _map_io(self.__contains__, identifiers)
+
+    def migrate_layout(self, layout):
+        """
+        Convert this database to another layout, in place.
+
+        Readers and writers may keep using the database (in this or other
+        processes) while the migration is running.  An interrupted migration is
+        resumed by calling this method again with the same layout.
+        """
+        layout = parse_layout(layout)
+        self._load_layout()
+        if self.previous_layout is not None and self.layout != layout:
+            raise GentleException(
+                "%r is being migrated to layout %r; finish that first" %
+                (self.directory, format_layout(self.layout)))
+        source = self.previous_layout
+        if source is None:
+            source = self.layout
+            if source == layout: return
+            _write_layout_file(
+                os.path.join(self.directory, PREVIOUS_LAYOUT_FILENAME), source)
+            _write_layout_file(os.path.join(self.directory, LAYOUT_FILENAME), layout)
+            self._load_layout()
+
+        # Move files until none are left in the old places, as writers that
+        # have not yet noticed the new layout might still create some:
+        moved = True
+        while moved:
+            moved = False
+            for old_filename in glob.glob(self._glob_pattern("", source)):
+                identifier = os.path.basename(old_filename)
+                if not is_identifier_format_valid(identifier): continue
+                if not os.path.isfile(old_filename): continue
+                self._move_file(old_filename, self._path(identifier, layout))
+                moved = True
+
+        # Remove the fan-out directories of the old layout, unless the new
+        # layout uses them too:
+        for depth in range(len(source), 0, -1):
+            if source[:depth] == layout[:depth]: continue
+            for dirname in glob.glob(self._glob_pattern("", source[:depth])[:-2]):
+                try:
+                    os.rmdir(dirname)
+                except OSError:
+                    pass
+
+        os.remove(os.path.join(self.directory, PREVIOUS_LAYOUT_FILENAME))
+        _write_layout_file(os.path.join(self.directory, LAYOUT_FILENAME), layout)
+        self._load_layout()
+
+    def _move_file(self, old_filename, new_filename):
+        self._makedirs(new_filename)
+        try:
+            os.link(old_filename, new_filename)
+        except OSError as e:
+            if e.errno != errno.EEXIST: raise
+            # Both files exist.  Keep the more recently written one:
+            if os.stat(old_filename).st_mtime > os.stat(new_filename).st_mtime:
+                os.rename(old_filename, new_filename)
+                return
+        os.remove(old_filename)
 
 
 class _GentleContentDB(data_store_interfaces._GentleContentDB, _GentleDB):
+    """
+    If bloom is True, a persistent Bloom filter of the content identifiers (see
+    gentle_tp_da92.bloom_filter) answers most lookups of missing content, and
+    spares new content the check for an existing file.  It must be closed to
+    be kept, and nobody else may add content while it is open.
+
+    compression is None, a codec name or a
+    gentle_tp_da92.compression.CompressionPolicy.
+
+    chunking is None, True or a gentle_tp_da92.chunking.Chunker.  Chunks are
+    stored in a chunk database (see _chunk_db()), and compressed like any
+    other content.  Without chunking, content entered using add_stream() is
+    not compressed, as it may be large.
+
+    Compressed and chunked content is read back whether or not compression and
+    chunking are given.
+    """
+
+    def __init__(self, directory, mkdir=False, layout=None, index=False,
+                 durability=DEFAULT_DURABILITY, committer=None, bloom=False,
+                 compression=None, chunking=None):
+        super(_GentleContentDB, self).__init__(directory, mkdir, layout, index,
+                                               durability, committer)
+        self.chunker = _chunking.get_chunker(chunking)
+        self.chunk_db = None
+        self._chunk_db_lock = threading.Lock()
+        self.compression = _compression.get_policy(compression)
+        self.compression_stats = _compression.CompressionStats()
+        self.bloom = None
+        if bloom:
+            self.bloom = bloom_filter.IdentifierFilter(
+                os.path.join(self.directory, BLOOM_DIRNAME),
+                scan=self._glob_find, stamp=self._deep_stamp)
+
+    def _missing(self, content_identifier):
+        if self.bloom is not None and content_identifier not in self.bloom:
+            return True
+        return self._find_path(content_identifier) is None
+
+    def _added(self, content_identifier):
+        if self.index is not None:
+            self.index.add(content_identifier)
+        if self.bloom is not None:
+            self.bloom.add(content_identifier)
+
+    def _chunk_db(self):
+        """
+        Return the database of the chunks of chunked content, which is
+        created on first use.  Its directory is hidden, so find() and
+        __delitem__() do not reach the chunks.
+        """
+        with self._chunk_db_lock:
+            if self.chunk_db is None:
+                self.chunk_db = _GentleContentDB(
+                    os.path.join(self.directory, _chunking.CHUNKS_DIRNAME),
+                    mkdir=True, layout="2", durability=self.durability,
+                    committer=self.committer, compression=self.compression)
+                self.chunk_db.compression_stats = self.compression_stats
+            return self.chunk_db
+
+    def _encode(self, byte_string):
+        if self.chunker is not None and self.chunker.wants(len(byte_string)):
+            # One chunk at a time, as this may already run in the thread pool:
+            return _chunking.encode(self.chunker, byte_string,
+                                    self._chunk_db().__add__)
+        if self.compression is None:
+            return _compression.escape(byte_string)
+        return self.compression.encode(byte_string, self.compression_stats)
+
+    def _decode(self, stored):
+        if _chunking.is_manifest(stored):
+            return _chunking.decode(stored, self._chunk_db().__getitem__)
+        return _compression.decode(stored, self.compression_stats)
+
+    def __getitem__(self, identifier):
+        return self._decode(_GentleDB.__getitem__(self, identifier))
 
     def __add__(self, byte_string):
         content_identifier = sha256(byte_string).hexdigest()
-        filename = os.path.join(self.directory, content_identifier)
-        if not os.path.exists(filename):
-            create_file_with_mode(filename, 0400).write(byte_string)
+        if self._missing(content_identifier):
+            self._write_file(self._path(content_identifier),
+                             self._encode(byte_string), 0400)
+            self._added(content_identifier)
+        return content_identifier
+
+    def __contains__(self, identifier):
+        validate_identifier_format(identifier)
+        return not self._missing(identifier)
+
+    def add_many(self, byte_strings):
+        # Enter equal content only once, as concurrent writes would collide:
+        byte_strings = list(byte_strings)
+        unique = list(set(byte_strings))
+        identifiers = dict(zip(unique, _map_io(self.__add__, unique)))
+        return [identifiers[byte_string] for byte_string in byte_strings]
+
+    def open(self, identifier):
+        validate_identifier_format(identifier)
+        f = self._open(identifier)
+        prefix = f.read(_compression.HEADER_SIZE)
+        if _compression.is_encoded(prefix):
+            with f:
+                return BytesIO(self._decode(prefix + f.read()))
+        f.seek(0)
+        return f
+
+    def read_range(self, identifier, offset, length):
+        validate_identifier_format(identifier)
+        with self._open(identifier) as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return buffer("")  # empty files cannot be mapped
+            # The buffer keeps the mapping alive, the file need not stay open:
+            content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if _compression.is_encoded(content[:_compression.HEADER_SIZE]):
+            stored = content[:]
+            if _chunking.is_manifest(stored):
+                return buffer(_chunking.read_range(
+                    stored, self._chunk_db().__getitem__, offset, length))
+            content = _compression.decode(stored, self.compression_stats)
+        return buffer(content, offset, length)
+
+    def add_stream(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        if self.chunker is not None:
+            content_identifier, data = _chunking.encode_stream(
+                self.chunker, read_chunks(fileobj, chunk_size),
+                self._chunk_db().__add__)
+            if content_identifier is None:  # small enough to do it in memory
+                return self + data
+            if self._missing(content_identifier):
+                self._write_file(self._path(content_identifier), data, 0400)
+                self._added(content_identifier)
+            return content_identifier
+        # Spool the content to a hidden file near its final location:
+        spool_directory = os.path.join(self.directory, SPOOL_DIRNAME)
+        try:
+            os.mkdir(spool_directory, 0700)
+        except OSError as e:
+            if e.errno != errno.EEXIST: raise
+        hash_object = sha256()
+        fd, tmp_filename = tempfile.mkstemp(dir=spool_directory, prefix=".add-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in read_chunks(fileobj, chunk_size):
+                    hash_object.update(chunk)
+                    f.write(chunk)
+            content_identifier = hash_object.hexdigest()
+            with open(tmp_filename, "rb") as f:
+                escape = _compression.is_encoded(f.read(_compression.HEADER_SIZE))
+            if escape:  # rare, so read it all
+                with open(tmp_filename, "rb") as f:
+                    data = _compression.escape(f.read())
+                with open(tmp_filename, "wb") as f:
+                    f.write(data)
+            if self._missing(content_identifier):
+                self._commit(tmp_filename, self._path(content_identifier), 0400)
+                self._added(content_identifier)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
         return content_identifier
 
 
@@ -92,26 +778,109 @@ class _GentlePointerDB(data_store_interfaces._GentlePointerDB, _GentleDB):
     def __setitem__(self, pointer_identifier, content_identifier):
         validate_identifier_format(pointer_identifier)
         validate_identifier_format(content_identifier)
-        filename = os.path.join(self.directory, pointer_identifier)
-        create_file_with_mode(filename, 0600).write(content_identifier)
+        self._load_layout()
+        self._write_file(self._path(pointer_identifier), content_identifier, 0600)
+        if self.index is not None:
+            self.index.add(pointer_identifier)
         return pointer_identifier
 
+    def set_many(self, items):
+        items = list(items)
+        # Write each pointer only once, with the last content identifier given:
+        last = dict(items)
+        _map_io(lambda item: self.__setitem__(*item), last.iteritems())
+        return [pointer_identifier for pointer_identifier, _ in items]
+
     def __delitem__(self, identifier):
         validate_identifier_format(identifier)
-        filename = os.path.join(self.directory, identifier)
+        self._load_layout()
+        filename = self._find_path(identifier)
+        if filename is None:
+            filename = self._path(identifier)  # raise the usual OSError
         os.remove(filename)
+        if self.previous_layout is not None:
+            # Also remove a stale copy that a migration may have left behind:
+            for layout in self._layouts():
+                try:
+                    os.remove(self._path(identifier, layout))
+                except OSError as e:
+                    if e.errno != errno.ENOENT: raise
+        if self.index is not None:
+            self.index.remove(identifier)
 
 
 class GentleDataStore(data_store_interfaces.GentleDataStore):
+    """
+    Filesystem-based data store.
+
+    The layout argument selects the fan-out directory layout for newly created
+    databases (see parse_layout()).  Existing databases keep their layout, which
+    is detected automatically; use migrate_layout() to convert them.
+
+    If index is True, both databases maintain a persistent prefix index.
+
+    If pointer_log is True, the pointer database is a log-structured one (see
+    gentle_tp_da92.log_based), stored in the 'pointer_log' directory.
+
+    durability is one of DURABILITY_LEVELS (see above).  With "batched", both
+    databases share one group committer, which waits group_commit_interval
+    seconds for writes to join a batch.  It does not apply to pointer_log.
+
+    If bloom is True, the content database keeps a Bloom filter of its
+    identifiers, which is saved by close().  Only one data store object may
+    add content to the directory while it is open.
 
-    def __init__(self, directory, mkdir=False):
+    compression selects how new content is compressed, and chunking how large
+    content is chunked (see _GentleContentDB); compression_stats() reports on
+    compression.
+    """
+
+    def __init__(self, directory, mkdir=False, layout=None, index=False,
+                 pointer_log=False, durability=DEFAULT_DURABILITY,
+                 group_commit_interval=DEFAULT_GROUP_COMMIT_INTERVAL,
+                 bloom=False, compression=None, chunking=None):
         super(GentleDataStore, self).__init__()
         self.directory = os.path.abspath(directory)
         if mkdir and not os.path.exists(self.directory):
             os.mkdir(self.directory, 0700)
 
+        self.committer = None
+        if durability == "batched":
+            self.committer = _GroupCommitter(group_commit_interval)
+
         self.content_db = _GentleContentDB(
-            os.path.join(self.directory, "content_db"), mkdir=mkdir)
+            os.path.join(self.directory, "content_db"), mkdir=mkdir,
+            layout=layout, index=index, durability=durability,
+            committer=self.committer, bloom=bloom, compression=compression,
+            chunking=chunking)
+
+        if pointer_log:
+            self.pointer_db = log_based._GentlePointerDB(
+                os.path.join(self.directory, "pointer_log"), mkdir=mkdir)
+        else:
+            self.pointer_db = _GentlePointerDB(
+                os.path.join(self.directory, "pointer_db"), mkdir=mkdir,
+                layout=layout, index=index, durability=durability,
+                committer=self.committer)
+
+    def migrate_layout(self, layout):
+        """
+        Convert both databases to another layout, in place, while they remain
+        usable.  See _GentleDB.migrate_layout().
+        """
+        for db in (self.content_db, self.pointer_db):
+            if isinstance(db, _GentleDB):
+                db.migrate_layout(layout)
+
+    def compression_stats(self):
+        """
+        Return the counters of gentle_tp_da92.compression.CompressionStats.
+        """
+        return self.content_db.compression_stats.as_dict()
 
-        self.pointer_db = _GentlePointerDB(
-            os.path.join(self.directory, "pointer_db"), mkdir=mkdir)
+    def close(self):
+        """
+        Save the Bloom filter, if any.
+        """
+        if self.content_db.bloom is not None:
+            self.content_db.bloom.close()
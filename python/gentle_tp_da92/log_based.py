@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Log-Structured Pointer Database Module.
+
+Provides a pointer database that appends every change to a log, instead of
+writing a file per pointer, in the manner of Bitcask.  All pointers are kept in
+memory (the "keydir"), so lookups never touch the disk.  Use it in
+gentle_tp_da92.fs_based.GentleDataStore by passing pointer_log=True.
+
+The database operates on the following directory tree:
+
+    .../pointer_log/
+        00000001.log    (sealed segment)
+        00000001.hint   (final state of the pointers changed in the segment)
+        00000002.log    (active segment, changes are appended here)
+        lock            (locked while a process uses the database)
+
+A segment starts with an 8-byte magic string and a kind byte, followed by
+fixed-size records:  <CRC-32> <'s' (set) or 'd' (delete)> <32-byte binary
+pointer identifier> <32-byte binary content identifier>.  When the active
+segment exceeds max_segment_size, it is sealed by writing its hint file, which
+makes loading the database at startup fast.  Once compact_threshold segments
+have been sealed, a background thread merges them into a single "base"
+segment, which contains the state of all pointers and supersedes all older
+segments.
+
+Only one process at a time may use a log-based pointer database.
+
+For documentation on the interfaces of the classes provided by this module, see
+the gentle_tp_da92.data_store_interfaces module.
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+import errno
+import fcntl
+import glob
+import os
+import struct
+import tempfile
+import threading
+import zlib
+
+from   . import data_store_interfaces
+from   .utilities import *
+
+
+LOG_SUFFIX = ".log"
+HINT_SUFFIX = ".hint"
+LOCK_FILENAME = "lock"
+
+DEFAULT_MAX_SEGMENT_SIZE = 4 * 1024 * 1024
+DEFAULT_COMPACT_THRESHOLD = 4
+
+_SEGMENT_MAGIC = "GTPPLOG1"
+_HINT_MAGIC = "GTPPHNT1"
+_NORMAL, _BASE = "n", "b"
+_SEGMENT_HEADER = struct.Struct("<8sc")  # magic, kind
+_RECORD = struct.Struct("<Ic32s32s")  # CRC-32, operation, pointer, content
+_HINT_ENTRY = struct.Struct("<c32s32s")  # operation, pointer, content
+_SET, _DEL = "s", "d"
+_NO_CONTENT = "\0" * 32
+
+
+def _segment_filename(directory, number):
+    return os.path.join(directory, "%08u%s" % (number, LOG_SUFFIX))
+
+def _hint_filename(segment_filename):
+    return segment_filename[:-len(LOG_SUFFIX)] + HINT_SUFFIX
+
+def _segment_number(segment_filename):
+    return int(os.path.basename(segment_filename)[:-len(LOG_SUFFIX)])
+
+def _crc(op, key, value):
+    return zlib.crc32(op + key + value) & 0xffffffff
+
+def _pack_record(op, key, value=_NO_CONTENT):
+    return _RECORD.pack(_crc(op, key, value), op, key, value)
+
+def _read_segment_kind(filename):
+    with open(filename, "rb") as f:
+        header = f.read(_SEGMENT_HEADER.size)
+    if len(header) < _SEGMENT_HEADER.size: return None
+    magic, kind = _SEGMENT_HEADER.unpack(header)
+    if magic != _SEGMENT_MAGIC: return None
+    return kind
+
+def _scan_segment(filename):
+    """
+    Return the final state of the pointers changed in a segment, as a
+    dictionary mapping binary pointer identifiers to (operation, binary content
+    identifier) tuples, and the size of the intact part of the segment.
+    """
+    state = {}
+    data = open(filename, "rb").read()
+    if data[:len(_SEGMENT_MAGIC)] != _SEGMENT_MAGIC:
+        return state, 0
+    offset = _SEGMENT_HEADER.size
+    while offset + _RECORD.size <= len(data):
+        crc, op, key, value = _RECORD.unpack_from(data, offset)
+        if crc != _crc(op, key, value): break  # torn write at the end
+        state[key] = (op, value)
+        offset += _RECORD.size
+    return state, offset
+
+def _load_hint(filename):
+    state = {}
+    data = open(filename, "rb").read()
+    if data[:len(_HINT_MAGIC)] != _HINT_MAGIC:
+        raise GentleException("invalid hint file: %r" % filename)
+    for offset in xrange(len(_HINT_MAGIC), len(data), _HINT_ENTRY.size):
+        op, key, value = _HINT_ENTRY.unpack_from(data, offset)
+        state[key] = (op, value)
+    return state
+
+def _write_file(filename, chunks):
+    """
+    Atomically (re-)write a file.
+    """
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                        prefix="." + os.path.basename(filename))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.rename(tmp_filename, filename)
+    except:
+        os.remove(tmp_filename)
+        raise
+
+def _hint_chunks(state):
+    yield _HINT_MAGIC
+    for key, (op, value) in state.iteritems():
+        yield _HINT_ENTRY.pack(op, key, value)
+
+
+class _GentlePointerDB(data_store_interfaces._GentlePointerDB):
+
+    def __init__(self, directory, mkdir=False,
+                 max_segment_size=DEFAULT_MAX_SEGMENT_SIZE,
+                 compact_threshold=DEFAULT_COMPACT_THRESHOLD):
+        super(_GentlePointerDB, self).__init__()
+        self.directory = directory
+        self.max_segment_size = max_segment_size
+        self.compact_threshold = compact_threshold
+        if mkdir and not os.path.exists(self.directory):
+            os.mkdir(self.directory, 0700)
+        self._lock = threading.RLock()
+        self._lock_file = create_file_with_mode(
+            os.path.join(self.directory, LOCK_FILENAME), 0600)
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES): raise
+            raise GentleException("%r is in use by another process" %
+                                  self.directory)
+        self._compaction = None
+        self._compact_lock = threading.Lock()
+        self._active_filename = None
+        self.keydir = {}  # pointer identifier -> content identifier
+        self._load()
+
+    ## LOADING ##
+
+    def _load(self):
+        filenames = sorted(glob.glob(os.path.join(self.directory, "*" + LOG_SUFFIX)))
+        # A base segment supersedes all older segments:
+        for i in range(len(filenames) - 1, -1, -1):
+            if _read_segment_kind(filenames[i]) == _BASE:
+                for filename in filenames[:i]:
+                    self._remove_segment(filename)
+                filenames = filenames[i:]
+                break
+
+        self.sealed = []  # segment filenames, oldest first
+        active_filename = None
+        for filename in filenames:
+            hint_filename = _hint_filename(filename)
+            if os.path.exists(hint_filename):
+                state = _load_hint(hint_filename)
+                self.sealed.append(filename)
+            else:
+                state, size = _scan_segment(filename)
+                if filename == filenames[-1]:
+                    active_filename = filename
+                    self._active_state = state
+                    self._active_size = size
+                else:  # a crash happened while sealing this segment
+                    _write_file(hint_filename, _hint_chunks(state))
+                    self.sealed.append(filename)
+            self._apply(state)
+
+        if active_filename is None:
+            self._open_segment(self._next_number())
+        else:
+            self._active = open(active_filename, "r+b")
+            self._active_filename = active_filename
+            if self._active_size == 0:
+                self._active.write(_SEGMENT_HEADER.pack(_SEGMENT_MAGIC, _NORMAL))
+                self._active_size = _SEGMENT_HEADER.size
+            self._active.truncate(self._active_size)
+            self._active.seek(self._active_size)
+
+    def _apply(self, state):
+        keydir = self.keydir
+        for key, (op, value) in state.iteritems():
+            pointer_identifier = key.encode("hex")
+            if op == _SET:
+                keydir[pointer_identifier] = value.encode("hex")
+            else:
+                keydir.pop(pointer_identifier, None)
+
+    def _next_number(self):
+        numbers = [_segment_number(f) for f in self.sealed]
+        if self._active_filename is not None:
+            numbers.append(_segment_number(self._active_filename))
+        return max(numbers or [0]) + 1
+
+    def _open_segment(self, number):
+        self._active_filename = _segment_filename(self.directory, number)
+        self._active = create_file_with_mode(self._active_filename, 0600)
+        self._active.write(_SEGMENT_HEADER.pack(_SEGMENT_MAGIC, _NORMAL))
+        self._active.flush()
+        self._active_size = _SEGMENT_HEADER.size
+        self._active_state = {}
+
+    @staticmethod
+    def _remove_segment(filename):
+        for f in (_hint_filename(filename), filename):
+            try:
+                os.remove(f)
+            except OSError as e:
+                if e.errno != errno.ENOENT: raise
+
+    ## DATABASE OPERATIONS ##
+
+    def __getitem__(self, identifier):
+        validate_identifier_format(identifier)
+        content = self.keydir[identifier]
+        return content
+
+    def find(self, partial_identifier=""):
+        validate_identifier_format(partial_identifier, partial=True)
+        identifiers = [i for i in self.keydir if i.startswith(partial_identifier)]
+        return identifiers
+
+    def __contains__(self, identifier):
+        validate_identifier_format(identifier)
+        return identifier in self.keydir
+
+    def __setitem__(self, pointer_identifier, content_identifier):
+        validate_identifier_format(pointer_identifier)
+        validate_identifier_format(content_identifier)
+        with self._lock:
+            self._append(_SET, pointer_identifier.decode("hex"),
+                         content_identifier.decode("hex"))
+            self.keydir[pointer_identifier] = content_identifier
+        return pointer_identifier
+
+    def __delitem__(self, identifier):
+        validate_identifier_format(identifier)
+        with self._lock:
+            if identifier not in self.keydir:
+                raise KeyError(identifier)
+            self._append(_DEL, identifier.decode("hex"))
+            del self.keydir[identifier]
+
+    def _append(self, op, key, value=_NO_CONTENT):
+        with self._lock:
+            self._active.write(_pack_record(op, key, value))
+            self._active.flush()
+            self._active_size += _RECORD.size
+            self._active_state[key] = (op, value)
+            if self._active_size >= self.max_segment_size:
+                self._seal()
+
+    ## SEALING AND COMPACTION ##
+
+    def _seal(self):
+        self._active.close()
+        _write_file(_hint_filename(self._active_filename),
+                    _hint_chunks(self._active_state))
+        self.sealed.append(self._active_filename)
+        self._open_segment(self._next_number())
+        if (len(self.sealed) >= self.compact_threshold and
+            self._compaction is None):
+            self._compaction = threading.Thread(target=self._compact_in_background)
+            self._compaction.daemon = True
+            self._compaction.start()
+
+    def compact(self):
+        """
+        Merge all sealed segments into a single base segment.
+
+        This is done automatically in a background thread once there are
+        compact_threshold sealed segments.
+        """
+        with self._compact_lock:
+            with self._lock:
+                sealed = list(self.sealed)
+            if len(sealed) < 2: return
+
+            # Compute the final state of the sealed segments.  Deleted pointers
+            # need no record, as the base segment supersedes older segments:
+            state = {}
+            for filename in sealed:
+                state.update(_load_hint(_hint_filename(filename)))
+            live = dict((k, v) for k, v in state.iteritems() if v[0] == _SET)
+
+            # Replace the newest sealed segment by the base segment.  Its hint
+            # file is removed first, as it must not describe the base segment:
+            target = sealed[-1]
+            def segment_chunks():
+                yield _SEGMENT_HEADER.pack(_SEGMENT_MAGIC, _BASE)
+                for key, (op, value) in live.iteritems():
+                    yield _pack_record(op, key, value)
+            hint_filename = _hint_filename(target)
+            os.remove(hint_filename)
+            _write_file(target, segment_chunks())
+            _write_file(hint_filename, _hint_chunks(live))
+            for filename in sealed[:-1]:
+                self._remove_segment(filename)
+
+            with self._lock:
+                self.sealed = [f for f in self.sealed if f not in sealed[:-1]]
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        finally:
+            self._compaction = None
+
+    def wait(self):
+        """
+        Wait for a running background compaction to finish.
+        """
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+
+    def close(self):
+        """
+        Close all files, and let other processes use the database.
+        """
+        self.wait()
+        with self._lock:
+            self._active.close()
+            self._lock_file.close()
@@ -27,56 +27,397 @@ the gentle_tp_da92.data_store_interfaces module.
 # You should have received a copy of the GNU Lesser General Public
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
 from   hashlib import sha256
+import heapq
+import itertools
+import mmap
+import os
+import struct
+import tempfile
+import threading
 
+from   . import bulk
 from   . import data_store_interfaces
+from   .prefix_index import KEY_SIZE, SortedKeys, identifier_range
 from   .utilities import *
 
 
+# Number of identifiers added or removed since the last merge, beyond which the
+# next search merges them into the sorted list of identifiers (see _GentleDB):
+MERGE_THRESHOLD = 4096
+
+
+## SNAPSHOTS ##
+
+# A snapshot file consists of the header, the sorted content keys, the offsets
+# of the content of each key (plus the end offset) in the content region, the
+# sorted pointer keys, the content keys they point to, and the content region:
+SNAPSHOT_MAGIC = "GTPMEM1\n"
+_SNAPSHOT_HEADER = struct.Struct("<8sQQ")  # magic, number of contents, pointers
+_OFFSET = struct.Struct("<Q")
+
+
+class _Snapshot(object):
+    """
+    Read-only, memory-mapped snapshot file.
+    """
+
+    def __init__(self, filename):
+        super(_Snapshot, self).__init__()
+        with open(filename, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < _SNAPSHOT_HEADER.size:
+                raise GentleException("truncated snapshot file: %r" % filename)
+            self.buf = buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_contents, n_pointers = _SNAPSHOT_HEADER.unpack_from(buf)
+        offset = _SNAPSHOT_HEADER.size
+        self.content_keys = SortedKeys(buf, offset, n_contents)
+        offset += n_contents * KEY_SIZE
+        self._offsets = offset
+        offset += (n_contents + 1) * _OFFSET.size
+        self.pointer_keys = SortedKeys(buf, offset, n_pointers)
+        offset += n_pointers * KEY_SIZE
+        self._targets = offset
+        offset += n_pointers * KEY_SIZE
+        self._contents = offset
+        if (magic != SNAPSHOT_MAGIC or size < offset or
+                size != offset + self._content_offset(n_contents)):
+            raise GentleException("invalid snapshot file: %r" % filename)
+
+    def _content_offset(self, i):
+        return _OFFSET.unpack_from(self.buf, self._offsets + i * _OFFSET.size)[0]
+
+    def content(self, i, offset=0, length=None):
+        """
+        Return a buffer of (a range of) the i-th content.
+        """
+        start = self._content_offset(i)
+        size = self._content_offset(i + 1) - start
+        offset = min(offset, size)
+        if length is None or offset + length > size:
+            length = size - offset
+        return buffer(self.buf, self._contents + start + offset, length)
+
+    def pointer(self, i):
+        """
+        Return the content identifier the i-th pointer points to.
+        """
+        start = self._targets + i * KEY_SIZE
+        return self.buf[start:start + KEY_SIZE].encode("hex")
+
+
+def _write_snapshot(filename, contents, pointers):
+    """
+    Atomically write a snapshot file.  contents is a sorted list of
+    (content identifier, byte string or buffer) pairs, pointers one of
+    (pointer identifier, content identifier) pairs.
+    """
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                                        prefix="." + os.path.basename(filename))
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(contents), len(pointers)))
+            f.write("".join(i.decode("hex") for i, _ in contents))
+            offset = 0
+            offsets = [_OFFSET.pack(0)]
+            for _, content in contents:
+                offset += len(content)
+                offsets.append(_OFFSET.pack(offset))
+            f.write("".join(offsets))
+            f.write("".join(p.decode("hex") for p, _ in pointers))
+            f.write("".join(c.decode("hex") for _, c in pointers))
+            for _, content in contents:
+                f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_filename, filename)
+    except:
+        os.remove(tmp_filename)
+        raise
+
+
+## DATABASES ##
+
 class _GentleDB(data_store_interfaces._GentleDB):
     """
     Base class for Gentle TP-DA92 memory-based databases.
+
+    Besides the dictionary db, a sorted list of all identifiers is maintained
+    for prefix searches.  Identifiers added since are collected in a small side
+    list, and identifiers removed since are remembered in a set of tombstones.
+    Searches sort the side list and search it as well, and skip the
+    tombstones.  Only when there are more than MERGE_THRESHOLD of them, a
+    search merges them into the sorted list.  Adding, removing and searching
+    thus cost O(log n) plus O(MERGE_THRESHOLD) at most, and a merge's O(n) is
+    shared by MERGE_THRESHOLD changes.
+
+    A database loaded from a snapshot serves the items of the snapshot from the
+    memory-mapped file, and only keeps changes made since in db.
     """
 
     def __init__(self):
         super(_GentleDB, self).__init__()
         self.db = {}
+        self._lock = threading.Lock()  # guards db changes and the index
+        self._sorted = []
+        self._recent = []  # identifiers added since the last merge
+        self._recent_sorted = True
+        self._removed = set()  # identifiers in _sorted removed since
+        self._snapshot = None
+        self._snapshot_keys = SortedKeys()
+        self._deleted = set()  # identifiers in the snapshot deleted since
+
+    def _attach(self, snapshot, snapshot_keys):
+        self._snapshot = snapshot
+        self._snapshot_keys = snapshot_keys
+
+    def _snapshot_value(self, i):
+        """
+        Return the value of the i-th item of the snapshot.
+        """
+        raise NotImplementedError()
+
+    def _snapshot_index(self, identifier):
+        """
+        Return the index of identifier in the snapshot, or None.
+        """
+        if not self._snapshot_keys or identifier in self._deleted: return None
+        key = identifier.decode("hex")
+        keys = self._snapshot_keys
+        i = bisect.bisect_left(keys, key)
+        if i < len(keys) and keys[i] == key:
+            return i
+        return None
+
+    def _index_add(self, identifier):
+        """
+        Add a new identifier to db's index.  Call with the lock held.
+        """
+        if identifier in self._removed:
+            self._removed.discard(identifier)  # still in _sorted
+            return
+        self._recent.append(identifier)
+        self._recent_sorted = False
+
+    def _index_remove(self, identifier):
+        """
+        Remove an identifier from db's index.  Call with the lock held.
+        """
+        self._sort_recent()
+        recent = self._recent
+        i = bisect.bisect_left(recent, identifier)
+        if i < len(recent) and recent[i] == identifier:
+            del recent[i]
+        else:
+            self._removed.add(identifier)
+
+    def _sort_recent(self):
+        if not self._recent_sorted:
+            self._recent.sort()
+            self._recent_sorted = True
+
+    def _merge(self):
+        """
+        Prepare the index for searching.  Call with the lock held.
+        """
+        if len(self._recent) + len(self._removed) <= MERGE_THRESHOLD:
+            self._sort_recent()
+            return
+        if self._removed:
+            removed = self._removed
+            self._sorted = [i for i in self._sorted if i not in removed]
+            self._removed = set()
+        if self._recent:
+            self._sorted.extend(self._recent)
+            self._sorted.sort()  # two sorted runs, merged in O(n)
+            self._recent = []
+        self._recent_sorted = True
+
+    def _index_range(self, partial_identifier, after, limit):
+        """
+        Return the sorted list of identifiers in the index starting with
+        partial_identifier (and after after, at least limit of them unless
+        there are fewer).  Call with the lock held, after _merge().
+        """
+        parts = []
+        for sorted_identifiers in (self._sorted, self._recent):
+            start = bisect.bisect_left(sorted_identifiers, partial_identifier)
+            # "g" sorts after all identifier digits:
+            stop = bisect.bisect_left(sorted_identifiers, partial_identifier + "g",
+                                      start)
+            if after is not None:
+                start = max(start, bisect.bisect_right(sorted_identifiers, after,
+                                                       0, stop))
+            if limit is not None:
+                # Some of them may be tombstones:
+                stop = max(min(stop, start + limit + len(self._removed)), start)
+            parts.append(sorted_identifiers[start:stop])
+        found, recent = parts
+        if self._removed:
+            removed = self._removed
+            found = [i for i in found if i not in removed]
+        if recent:
+            found += recent
+            found.sort()  # two sorted runs, merged in O(k)
+        return found
+
+    def _range(self, partial_identifier, after=None, limit=None):
+        """
+        Return the sorted list of identifiers starting with partial_identifier
+        (and after after, at most limit of them).
+        """
+        with self._lock:
+            self._merge()
+            indexed = self._index_range(partial_identifier, after, limit)
+            if not self._snapshot_keys:
+                if limit is not None:
+                    indexed = indexed[:max(limit, 0)]
+                return indexed
+            found = self._snapshot_range(partial_identifier, after)
+            found = heapq.merge(indexed,
+                                (i for i in found
+                                 if i not in self._deleted and i not in self.db))
+            return list(itertools.islice(found, limit))
+
+    def _snapshot_range(self, partial_identifier, after):
+        keys = self._snapshot_keys
+        start, stop = keys.range(partial_identifier)
+        if after is not None:
+            lo = identifier_range(after)[0]
+            if len(after) == IDENTIFIER_LENGTH:
+                start = max(start, bisect.bisect_right(keys, lo, 0, stop))
+            else:
+                start = max(start, bisect.bisect_left(keys, lo, 0, stop))
+        return (keys[i].encode("hex") for i in xrange(start, stop))
+
+    def _get(self, identifier):
+        try:
+            return self.db[identifier]
+        except KeyError:
+            i = self._snapshot_index(identifier)
+            if i is None:
+                raise
+            return self._snapshot_value(i)
+
+    def _contains(self, identifier):
+        return identifier in self.db or self._snapshot_index(identifier) is not None
 
     def __getitem__(self, identifier):
         validate_identifier_format(identifier)
-        content = self.db[identifier]
-        return content
+        return self._get(identifier)
 
     def find(self, partial_identifier=""):
         validate_identifier_format(partial_identifier, partial=True)
-        identifiers = [i for i in self.db if i.startswith(partial_identifier)]
-        return identifiers
+        return self._range(partial_identifier)
+
+    def iterfind(self, partial_identifier="", limit=None, after=None):
+        validate_identifier_format(partial_identifier, partial=True)
+        return iter(self._range(partial_identifier, after, limit))
 
     def __contains__(self, identifier):
         validate_identifier_format(identifier)
-        return identifier in self.db
+        return self._contains(identifier)
+
+    def get_many(self, identifiers):
+        identifiers = list(identifiers)
+        for identifier in identifiers:
+            validate_identifier_format(identifier)
+        return [self._get(identifier) for identifier in identifiers]
+
+    def contains_many(self, identifiers):
+        identifiers = list(identifiers)
+        for identifier in identifiers:
+            validate_identifier_format(identifier)
+        return [self._contains(identifier) for identifier in identifiers]
 
 
 class _GentleContentDB(data_store_interfaces._GentleContentDB, _GentleDB):
 
+    def _snapshot_value(self, i):
+        return str(self._snapshot.content(i))
+
+    def _add(self, content_identifier, byte_string):
+        with self._lock:
+            if not self._contains(content_identifier):
+                self.db[content_identifier] = byte_string
+                self._index_add(content_identifier)
+
     def __add__(self, byte_string):
         content_identifier = sha256(byte_string).hexdigest()
-        if not content_identifier in self.db:
-            self.db[content_identifier] = byte_string
+        self._add(content_identifier, byte_string)
         return content_identifier
 
+    def add_stream(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        hash_object = sha256()
+        chunks = []
+        for chunk in read_chunks(fileobj, chunk_size):
+            hash_object.update(chunk)
+            chunks.append(chunk)
+        content_identifier = hash_object.hexdigest()
+        self._add(content_identifier, "".join(chunks))
+        return content_identifier
+
+    def add_many(self, byte_strings):
+        byte_strings = list(byte_strings)
+        items = zip(bulk.sha256_many(byte_strings), byte_strings)
+        with self._lock:
+            for content_identifier, byte_string in items:
+                if not self._contains(content_identifier):
+                    self.db[content_identifier] = byte_string
+                    self._index_add(content_identifier)
+        return [content_identifier for content_identifier, _ in items]
+
+    def read_range(self, identifier, offset, length):
+        validate_identifier_format(identifier)
+        try:
+            return buffer(self.db[identifier], offset, length)
+        except KeyError:
+            i = self._snapshot_index(identifier)
+            if i is None:
+                raise
+            return self._snapshot.content(i, offset, length)
+
 
 class _GentlePointerDB(data_store_interfaces._GentlePointerDB, _GentleDB):
 
+    def _snapshot_value(self, i):
+        return self._snapshot.pointer(i)
+
+    def _set(self, pointer_identifier, content_identifier):
+        # Call with the lock held.
+        if not pointer_identifier in self.db:
+            self._index_add(pointer_identifier)
+        self.db[pointer_identifier] = content_identifier
+
     def __setitem__(self, pointer_identifier, content_identifier):
         validate_identifier_format(pointer_identifier)
         validate_identifier_format(content_identifier)
-        self.db[pointer_identifier] = content_identifier
+        with self._lock:
+            self._set(pointer_identifier, content_identifier)
         return pointer_identifier
 
+    def set_many(self, items):
+        items = list(items)
+        for pointer_identifier, content_identifier in items:
+            validate_identifier_format(pointer_identifier)
+            validate_identifier_format(content_identifier)
+        with self._lock:
+            for pointer_identifier, content_identifier in items:
+                self._set(pointer_identifier, content_identifier)
+        return [pointer_identifier for pointer_identifier, _ in items]
+
     def __delitem__(self, identifier):
         validate_identifier_format(identifier)
-        del self.db[identifier]
+        with self._lock:
+            in_snapshot = self._snapshot_index(identifier) is not None
+            if identifier in self.db:
+                del self.db[identifier]
+                self._index_remove(identifier)
+            elif not in_snapshot:
+                raise KeyError(identifier)
+            if in_snapshot:
+                self._deleted.add(identifier)
 
 
 class GentleDataStore(data_store_interfaces.GentleDataStore):
@@ -85,3 +426,32 @@ class GentleDataStore(data_store_interfaces.GentleDataStore):
         super(GentleDataStore, self).__init__()
         self.content_db = _GentleContentDB()
         self.pointer_db = _GentlePointerDB()
+
+    def save(self, filename):
+        """
+        Save the content of the data store to a snapshot file, which load()
+        can memory-map again.  The file is replaced atomically.
+        """
+        c_db = self.content_db
+        p_db = self.pointer_db
+        contents = []
+        for identifier in c_db.find():
+            i = c_db._snapshot_index(identifier)
+            contents.append((identifier, c_db.db[identifier] if i is None
+                             else c_db._snapshot.content(i)))
+        pointers = [(identifier, p_db[identifier]) for identifier in p_db.find()]
+        _write_snapshot(filename, contents, pointers)
+
+    @classmethod
+    def load(cls, filename):
+        """
+        Return a new data store serving the content of a snapshot file written
+        by save().  The file is memory-mapped, so loading takes about the same
+        time for any size, and content is only read from the file when it is
+        accessed.  Changes are kept in memory until the next save().
+        """
+        snapshot = _Snapshot(filename)
+        data_store = cls()
+        data_store.content_db._attach(snapshot, snapshot.content_keys)
+        data_store.pointer_db._attach(snapshot, snapshot.pointer_keys)
+        return data_store
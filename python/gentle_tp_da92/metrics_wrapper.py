@@ -0,0 +1,329 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Metrics Wrapper Data Store Module.
+
+Wraps another data store and records, for each operation on either database,
+the number of calls and errors, a latency histogram and the number of bytes
+entered and returned.
+
+Usage example:
+>>> from gentle_tp_da92 import metrics_wrapper, fs_based
+>>> data_store = metrics_wrapper.GentleDataStore(fs_based.GentleDataStore(d))
+>>> content_identifier = data_store.content_db + "Some content"
+>>> data_store.snapshot()["content"]["add"]["count"]
+1
+>>> print data_store.prometheus_text()
+# HELP gentle_operations_total Number of data store operations.
+...
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+import bisect
+import threading
+import time
+
+from   . import data_store_interfaces
+from   .utilities import *
+
+
+# Upper bounds of the latency histogram buckets, in seconds (1 us .. 67 s):
+LATENCY_BUCKETS = tuple(1e-6 * 2 ** i for i in range(27))
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class _Histogram(object):
+    """
+    Histogram of latencies with exponentially growing buckets.  Quantiles are
+    estimated as the upper bound of the bucket they fall into.
+    """
+
+    def __init__(self):
+        super(_Histogram, self).__init__()
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)  # last: above all bounds
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        if not self.count: return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+class _OperationMetrics(object):
+
+    def __init__(self):
+        super(_OperationMetrics, self).__init__()
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = _Histogram()
+
+    def snapshot(self):
+        snapshot = dict(count=self.latency.count, errors=self.errors,
+                        bytes_in=self.bytes_in, bytes_out=self.bytes_out,
+                        latency_sum=self.latency.sum,
+                        latency_max=self.latency.max)
+        for q in QUANTILES:
+            snapshot["p%u" % round(q * 100)] = self.latency.quantile(q)
+        return snapshot
+
+
+class _Metrics(object):
+    """
+    The metrics of all operations on a data store, keyed by database name
+    ("content" or "pointer") and operation name.
+    """
+
+    def __init__(self):
+        super(_Metrics, self).__init__()
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._operations = {}
+
+    def record(self, db_name, operation, seconds, error, bytes_in, bytes_out):
+        with self._lock:
+            metrics = self._operations.get((db_name, operation))
+            if metrics is None:
+                metrics = self._operations[db_name, operation] = _OperationMetrics()
+            metrics.latency.record(seconds)
+            metrics.errors += error
+            metrics.bytes_in += bytes_in
+            metrics.bytes_out += bytes_out
+
+    def snapshot(self):
+        snapshot = {"content": {}, "pointer": {}}
+        with self._lock:
+            for (db_name, operation), metrics in self._operations.iteritems():
+                snapshot[db_name][operation] = metrics.snapshot()
+        return snapshot
+
+    def prometheus_text(self, prefix="gentle"):
+        with self._lock:
+            operations = sorted(self._operations.items())
+            lines = []
+            def counter(name, help, attribute):
+                lines.append("# HELP %s_%s %s" % (prefix, name, help))
+                lines.append("# TYPE %s_%s counter" % (prefix, name))
+                for (db_name, operation), metrics in operations:
+                    value = attribute(metrics)
+                    lines.append('%s_%s{db="%s",operation="%s"} %s' %
+                                 (prefix, name, db_name, operation, value))
+            counter("operations_total", "Number of data store operations.",
+                    lambda m: m.latency.count)
+            counter("errors_total", "Number of data store operations that raised an exception.",
+                    lambda m: m.errors)
+            counter("bytes_in_total", "Bytes of content and identifiers passed to the data store.",
+                    lambda m: m.bytes_in)
+            counter("bytes_out_total", "Bytes of content and identifiers returned by the data store.",
+                    lambda m: m.bytes_out)
+            name = "%s_operation_duration_seconds" % prefix
+            lines.append("# HELP %s Duration of data store operations." % name)
+            lines.append("# TYPE %s histogram" % name)
+            for (db_name, operation), metrics in operations:
+                labels = 'db="%s",operation="%s"' % (db_name, operation)
+                histogram = metrics.latency
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append('%s_bucket{%s,le="%r"} %u' % (name, labels, bound, cumulative))
+                lines.append('%s_bucket{%s,le="+Inf"} %u' % (name, labels, histogram.count))
+                lines.append("%s_sum{%s} %r" % (name, labels, histogram.sum))
+                lines.append("%s_count{%s} %u" % (name, labels, histogram.count))
+        return "\n".join(lines) + "\n"
+
+
+class _CountingReader(object):
+    """
+    File-like object that counts the bytes read from another one.
+    """
+
+    def __init__(self, fileobj):
+        super(_CountingReader, self).__init__()
+        self.fileobj = fileobj
+        self.count = 0
+
+    def read(self, *a):
+        data = self.fileobj.read(*a)
+        self.count += len(data)
+        return data
+
+
+def _total_len(strings):
+    return sum(len(s) for s in strings)
+
+
+class _GentleDB(data_store_interfaces._GentleDB):
+
+    def __init__(self, db, metrics, name):
+        super(_GentleDB, self).__init__()
+        self.db = db
+        self.metrics = metrics
+        self.name = name
+
+    def _call(self, operation, function, args, bytes_in=0, bytes_out=None):
+        """
+        Call function(*args) and record the metrics of the call.  bytes_out
+        computes the number of bytes returned from the result.
+        """
+        start = time.time()
+        try:
+            result = function(*args)
+        except:
+            self.metrics.record(self.name, operation, time.time() - start,
+                                True, bytes_in, 0)
+            raise
+        self.metrics.record(self.name, operation, time.time() - start, False,
+                            bytes_in, 0 if bytes_out is None else bytes_out(result))
+        return result
+
+    def __getitem__(self, identifier):
+        return self._call("get", self.db.__getitem__, (identifier,),
+                          len(identifier), len)
+
+    def get_many(self, identifiers):
+        identifiers = list(identifiers)
+        return self._call("get_many", self.db.get_many, (identifiers,),
+                          _total_len(identifiers), _total_len)
+
+    def find(self, partial_identifier=""):
+        return self._call("find", self.db.find, (partial_identifier,),
+                          len(partial_identifier), _total_len)
+
+    def iterfind(self, partial_identifier="", limit=None, after=None):
+        # Only the time to start the iteration is recorded:
+        return self._call("iterfind", self.db.iterfind,
+                          (partial_identifier, limit, after),
+                          len(partial_identifier))
+
+    def __contains__(self, identifier):
+        return self._call("contains", self.db.__contains__, (identifier,),
+                          len(identifier))
+
+    def contains_many(self, identifiers):
+        identifiers = list(identifiers)
+        return self._call("contains_many", self.db.contains_many,
+                          (identifiers,), _total_len(identifiers))
+
+
+class _GentleContentDB(data_store_interfaces._GentleContentDB, _GentleDB):
+
+    def __init__(self, db, metrics):
+        super(_GentleContentDB, self).__init__(db, metrics, "content")
+
+    def __add__(self, byte_string):
+        return self._call("add", self.db.__add__, (byte_string,),
+                          len(byte_string), len)
+
+    def add_many(self, byte_strings):
+        byte_strings = list(byte_strings)
+        return self._call("add_many", self.db.add_many, (byte_strings,),
+                          _total_len(byte_strings), _total_len)
+
+    def add_stream(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        reader = _CountingReader(fileobj)
+        start = time.time()
+        try:
+            content_identifier = self.db.add_stream(reader, chunk_size)
+        except:
+            self.metrics.record(self.name, "add_stream", time.time() - start,
+                                True, reader.count, 0)
+            raise
+        self.metrics.record(self.name, "add_stream", time.time() - start,
+                            False, reader.count, len(content_identifier))
+        return content_identifier
+
+    def open(self, identifier):
+        return self._call("open", self.db.open, (identifier,), len(identifier))
+
+    def read_range(self, identifier, offset, length):
+        return self._call("read_range", self.db.read_range,
+                          (identifier, offset, length), len(identifier), len)
+
+    def __delitem__(self, identifier):
+        return self._call("del", self.db.__delitem__, (identifier,),
+                          len(identifier))
+
+
+class _GentlePointerDB(data_store_interfaces._GentlePointerDB, _GentleDB):
+
+    def __init__(self, db, metrics):
+        super(_GentlePointerDB, self).__init__(db, metrics, "pointer")
+
+    def __setitem__(self, pointer_identifier, content_identifier):
+        self._call("set", self.db.__setitem__,
+                   (pointer_identifier, content_identifier),
+                   len(pointer_identifier) + len(content_identifier))
+        return pointer_identifier
+
+    def set_many(self, items):
+        items = list(items)
+        return self._call("set_many", self.db.set_many, (items,),
+                          sum(len(p) + len(c) for p, c in items))
+
+    def __delitem__(self, identifier):
+        return self._call("del", self.db.__delitem__, (identifier,),
+                          len(identifier))
+
+
+class GentleDataStore(data_store_interfaces.GentleDataStore):
+
+    def __init__(self, data_store):
+        super(GentleDataStore, self).__init__()
+        self.data_store = data_store
+        self.metrics = _Metrics()
+        self.content_db = _GentleContentDB(data_store.content_db, self.metrics)
+        self.pointer_db = _GentlePointerDB(data_store.pointer_db, self.metrics)
+
+    def snapshot(self):
+        """
+        Return the metrics recorded so far, as a dictionary of the form
+        {"content": {"get": {"count": ..., "p99": ..., ...}, ...},
+         "pointer": {...}}.  Latencies are in seconds.
+        """
+        return self.metrics.snapshot()
+
+    def prometheus_text(self, prefix="gentle"):
+        """
+        Return the metrics recorded so far in the Prometheus text exposition
+        format.
+        """
+        return self.metrics.prometheus_text(prefix)
+
+    def reset(self):
+        """
+        Forget the metrics recorded so far.
+        """
+        self.metrics.reset()
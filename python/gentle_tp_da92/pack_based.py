@@ -0,0 +1,682 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Pack-File-Based Data Store Implementation Module.
+
+Provides a data store whose content database appends content to large pack
+files, instead of storing every content as a file of its own, which wastes an
+inode, a directory entry and a filesystem block per content.  The pointer
+database is the one from gentle_tp_da92.fs_based.
+gentle_tp_da92.pack_based.GentleDataStore operates on the following directory
+tree:
+
+    .../<data store top directory>/
+        content_packs/
+            00000001.pack   (sealed pack: content records)
+            00000001.idx    (index of the sealed pack)
+            00000002.pack   (active pack, content is appended here)
+            deleted         (log of deleted and undeleted content identifiers)
+            lock            (locked while a process uses the data store)
+        pointer_db/
+            ... (as in gentle_tp_da92.fs_based)
+
+A pack file starts with an 8-byte magic string, followed by records of the
+form <32-byte binary identifier> <8-byte length> <content>.  When the active
+pack exceeds max_pack_size, it is sealed by writing its index:  the sorted
+binary identifiers, preceded by a 256-entry fan-out table (the number of
+identifiers whose first byte is at most 0, 1, ..., 255) and followed by the
+offsets and lengths of the records.  Index and pack are memory-mapped for
+reading.
+
+With the compression argument, records hold content compressed as decided by a
+policy (see gentle_tp_da92.compression), which is decompressed transparently
+when read.  With the chunking argument, large content is split into chunks
+stored as content of their own, and stored as a manifest of its chunks (see
+gentle_tp_da92.chunking).
+
+Deleting content only records its identifier in the 'deleted' log.  Use
+_GentleContentDB.repack() to reclaim the space.
+
+Only one process at a time may use a pack-based data store.
+
+It is recommended to use the gentle_tp_da92.easy module in applications, instead
+of directly using the data store implementation modules.
+
+For documentation on the interfaces of the classes provided by this module, see
+the gentle_tp_da92.data_store_interfaces module.
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+import bisect
+import errno
+import fcntl
+import glob
+from   hashlib import sha256
+import heapq
+import itertools
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+from   . import bulk
+from   . import chunking as _chunking
+from   . import compression as _compression
+from   . import data_store_interfaces
+from   . import fs_based
+from   . import prefix_index
+from   .utilities import *
+
+
+PACKS_DIRNAME = "content_packs"
+PACK_SUFFIX = ".pack"
+INDEX_SUFFIX = ".idx"
+DELETED_FILENAME = "deleted"
+LOCK_FILENAME = "lock"
+
+DEFAULT_MAX_PACK_SIZE = 64 * 1024 * 1024
+
+KEY_SIZE = prefix_index.KEY_SIZE
+
+_PACK_MAGIC = "GTPPACK1"
+_RECORD_HEADER = struct.Struct("<%usQ" % KEY_SIZE)  # identifier, length
+_INDEX_MAGIC = "GTPPIDX1"
+_INDEX_HEADER = struct.Struct("<8sQ")  # magic, number of identifiers
+_FANOUT = struct.Struct("<256Q")
+_ENTRY = struct.Struct("<QQ")  # offset and length of the content
+
+# Identifier of a record that add_stream() has not finished yet:
+_BLANK_KEY = "\0" * KEY_SIZE
+
+_DELETED, _UNDELETED = "-", "+"
+_DELETED_RECORD_SIZE = 1 + KEY_SIZE
+
+
+def _pack_filename(directory, number):
+    return os.path.join(directory, "%08u%s" % (number, PACK_SUFFIX))
+
+def _index_filename(pack_filename):
+    return pack_filename[:-len(PACK_SUFFIX)] + INDEX_SUFFIX
+
+def _pack_number(pack_filename):
+    return int(os.path.basename(pack_filename)[:-len(PACK_SUFFIX)])
+
+def _mmap_file(filename):
+    with open(filename, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _write_index(pack_filename, entries):
+    """
+    Write the index file for a pack, given a dictionary mapping binary
+    identifiers to (offset, length) tuples.
+    """
+    keys = sorted(entries)
+    fanout = [0] * 256
+    for key in keys:
+        fanout[ord(key[0])] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+    filename = _index_filename(pack_filename)
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                        prefix=".idx")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, len(keys)))
+            f.write(_FANOUT.pack(*fanout))
+            f.write("".join(keys))
+            f.write("".join(_ENTRY.pack(*entries[key]) for key in keys))
+        os.rename(tmp_filename, filename)
+    except:
+        os.remove(tmp_filename)
+        raise
+
+def _scan_pack(f):
+    """
+    Read the records of an open pack file.  Return a dictionary mapping binary
+    identifiers to (offset, length) tuples, and the size of the complete
+    records (a crash may leave an incomplete record at the end).
+    """
+    entries = {}
+    f.seek(0)
+    if f.read(len(_PACK_MAGIC)) != _PACK_MAGIC:
+        return entries, 0
+    offset = len(_PACK_MAGIC)
+    size = os.fstat(f.fileno()).st_size
+    while offset + _RECORD_HEADER.size <= size:
+        f.seek(offset)
+        key, length = _RECORD_HEADER.unpack(f.read(_RECORD_HEADER.size))
+        if key == _BLANK_KEY: break
+        data_offset = offset + _RECORD_HEADER.size
+        if data_offset + length > size: break
+        entries[key] = (data_offset, length)
+        offset = data_offset + length
+    return entries, offset
+
+
+class _Pack(object):
+    """
+    A sealed pack file and its index.
+    """
+
+    def __init__(self, filename):
+        super(_Pack, self).__init__()
+        self.filename = filename
+        self.number = _pack_number(filename)
+        index = _mmap_file(_index_filename(filename))
+        magic, count = _INDEX_HEADER.unpack_from(index)
+        if magic != _INDEX_MAGIC:
+            raise GentleException("invalid pack index: %r" % filename)
+        self.fanout = _FANOUT.unpack_from(index, _INDEX_HEADER.size)
+        keys_offset = _INDEX_HEADER.size + _FANOUT.size
+        self.keys = prefix_index.SortedKeys(index, keys_offset, count)
+        self.index = index
+        self.entries_offset = keys_offset + count * KEY_SIZE
+        self.data = _mmap_file(filename)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def locate(self, key):
+        """
+        Return the (offset, length) of the content for key, or None.
+        """
+        byte = ord(key[0])
+        lo = self.fanout[byte - 1] if byte else 0
+        hi = self.fanout[byte]
+        i = bisect.bisect_left(self.keys, key, lo, hi)
+        if i < hi and self.keys[i] == key:
+            return _ENTRY.unpack_from(self.index, self.entries_offset + i * _ENTRY.size)
+        return None
+
+    def iterkeys(self, partial_identifier=""):
+        start, stop = self.keys.range(partial_identifier)
+        for i in xrange(start, stop):
+            yield self.keys[i]
+
+    def read(self, (offset, length)):
+        return self.data[offset:offset + length]
+
+    def read_range(self, (offset, length), start, size):
+        return buffer(self.data, offset + start, size)
+
+
+class _ActivePack(object):
+    """
+    The pack file that new content is appended to.
+    """
+
+    def __init__(self, filename):
+        super(_ActivePack, self).__init__()
+        self.filename = filename
+        self.number = _pack_number(filename)
+        if not os.path.exists(filename):
+            create_file_with_mode(filename, 0600).close()
+        self.file = open(filename, "r+b")
+        self.entries, self.size = _scan_pack(self.file)
+        if self.size == 0:
+            self.file.seek(0)
+            self.file.write(_PACK_MAGIC)
+            self.size = len(_PACK_MAGIC)
+        self.file.truncate(self.size)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def locate(self, key):
+        return self.entries.get(key)
+
+    def iterkeys(self, partial_identifier=""):
+        if not partial_identifier:
+            return iter(self.entries)
+        lo, hi = prefix_index.identifier_range(partial_identifier)
+        return (key for key in self.entries if lo <= key <= hi)
+
+    def read(self, (offset, length)):
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def read_range(self, (offset, length), start, size):
+        self.file.seek(offset + start)
+        return buffer(self.file.read(size))
+
+    def append(self, key, byte_string):
+        self.file.seek(self.size)
+        self.file.write(_RECORD_HEADER.pack(key, len(byte_string)))
+        self.file.write(byte_string)
+        self.file.flush()
+        self.entries[key] = (self.size + _RECORD_HEADER.size, len(byte_string))
+        self.size += _RECORD_HEADER.size + len(byte_string)
+
+    def append_stream(self, chunks, skip):
+        """
+        Append the content made up of chunks, hashing it on the way, and return
+        its binary identifier.  The record header is filled in last; if skip()
+        returns True for the identifier, the record is dropped again.
+        """
+        start = self.size
+        self.file.seek(start)
+        self.file.write(_RECORD_HEADER.pack(_BLANK_KEY, 0))
+        hash_object = sha256()
+        length = 0
+        try:
+            for chunk in chunks:
+                hash_object.update(chunk)
+                self.file.write(chunk)
+                length += len(chunk)
+            key = hash_object.digest()
+        except:
+            self.file.truncate(start)
+            raise
+        if skip(key):
+            self.file.truncate(start)
+            return key
+        self.file.seek(start)
+        self.file.write(_RECORD_HEADER.pack(key, length))
+        self.file.flush()
+        self.entries[key] = (start + _RECORD_HEADER.size, length)
+        self.size = start + _RECORD_HEADER.size + length
+        return key
+
+    def seal(self):
+        """
+        Write the index of this pack, and return it as a _Pack.
+        """
+        self.file.close()
+        _write_index(self.filename, self.entries)
+        return _Pack(self.filename)
+
+
+class _GentleContentDB(data_store_interfaces._GentleContentDB):
+    """
+    compression is None, a codec name or a
+    gentle_tp_da92.compression.CompressionPolicy.
+
+    chunking is None, True or a gentle_tp_da92.chunking.Chunker.  Chunks are
+    stored in a chunk database (see _chunk_db()), and compressed like any
+    other content.  Without chunking, content entered using add_stream() is
+    not compressed, as it may be large.
+    """
+
+    def __init__(self, directory, mkdir=False,
+                 max_pack_size=DEFAULT_MAX_PACK_SIZE, compression=None,
+                 chunking=None):
+        super(_GentleContentDB, self).__init__()
+        self.directory = directory
+        self.max_pack_size = max_pack_size
+        self.chunker = _chunking.get_chunker(chunking)
+        self.chunk_db = None
+        self.compression = _compression.get_policy(compression)
+        self.compression_stats = _compression.CompressionStats()
+        if mkdir and not os.path.exists(self.directory):
+            os.mkdir(self.directory, 0700)
+        self._lock = threading.RLock()
+        self._lock_file = create_file_with_mode(
+            os.path.join(self.directory, LOCK_FILENAME), 0600)
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError as e:
+            if e.errno not in (errno.EAGAIN, errno.EACCES): raise
+            raise GentleException("%r is in use by another process" %
+                                  self.directory)
+        self._load_deleted()
+        self._load_packs()
+
+    ## LOADING ##
+
+    def _load_deleted(self):
+        self.deleted = set()
+        filename = os.path.join(self.directory, DELETED_FILENAME)
+        if os.path.exists(filename):
+            data = open(filename, "rb").read()
+            usable = len(data) - len(data) % _DELETED_RECORD_SIZE
+            for start in xrange(0, usable, _DELETED_RECORD_SIZE):
+                key = data[start + 1:start + _DELETED_RECORD_SIZE]
+                if data[start] == _DELETED:
+                    self.deleted.add(key)
+                else:
+                    self.deleted.discard(key)
+        self._deleted_file = open(filename, "ab")
+
+    def _load_packs(self):
+        self.packs = []  # sealed packs, newest first
+        self.active = None
+        filenames = sorted(glob.glob(os.path.join(self.directory, "*" + PACK_SUFFIX)))
+        active_filename = None
+        for filename in filenames:
+            if os.path.exists(_index_filename(filename)):
+                self.packs.insert(0, _Pack(filename))
+            elif filename == filenames[-1]:
+                active_filename = filename
+            else:  # a crash happened while sealing this pack
+                self.packs.insert(0, _ActivePack(filename).seal())
+        if active_filename is None:
+            active_filename = _pack_filename(self.directory, self._next_number())
+        self.active = _ActivePack(active_filename)
+
+    def _next_number(self):
+        numbers = [pack.number for pack in self.packs]
+        if self.active is not None:
+            numbers.append(self.active.number)
+        return max(numbers or [0]) + 1
+
+    def _chunk_db(self):
+        """
+        Return the database of the chunks of chunked content, which is
+        created on first use.  It has packs of its own, so find(),
+        __delitem__() and repack() do not reach the chunks.
+        """
+        with self._lock:
+            if self.chunk_db is None:
+                self.chunk_db = _GentleContentDB(
+                    os.path.join(self.directory, _chunking.CHUNKS_DIRNAME),
+                    mkdir=True, max_pack_size=self.max_pack_size,
+                    compression=self.compression)
+                self.chunk_db.compression_stats = self.compression_stats
+            return self.chunk_db
+
+    ## LOOKUP ##
+
+    def _locate(self, key):
+        """
+        Return the pack containing the content for key, and its (offset,
+        length) in the pack.  Return (None, None) if the content is not found.
+        """
+        entry = self.active.locate(key)
+        if entry is not None:
+            return self.active, entry
+        for pack in self.packs:
+            entry = pack.locate(key)
+            if entry is not None:
+                return pack, entry
+        return None, None
+
+    def __getitem__(self, identifier):
+        validate_identifier_format(identifier)
+        key = identifier.decode("hex")
+        with self._lock:
+            pack, entry = self._locate(key)
+            if pack is None or key in self.deleted:
+                raise KeyError(identifier)
+            stored = pack.read(entry)
+        return self._decode(stored)
+
+    def _decode(self, stored):
+        if _chunking.is_manifest(stored):
+            return _chunking.decode(stored, self._chunk_db().__getitem__)
+        return _compression.decode(stored, self.compression_stats)
+
+    def read_range(self, identifier, offset, length):
+        validate_identifier_format(identifier)
+        if offset < 0 or length < 0:
+            raise ValueError("offset and length must not be negative")
+        key = identifier.decode("hex")
+        with self._lock:
+            pack, entry = self._locate(key)
+            if pack is None or key in self.deleted:
+                raise KeyError(identifier)
+            prefix = pack.read_range(entry, 0, min(entry[1], _compression.HEADER_SIZE))
+            if _compression.is_encoded(prefix):
+                stored = pack.read(entry)
+                if _chunking.is_manifest(stored):
+                    return buffer(_chunking.read_range(
+                        stored, self._chunk_db().__getitem__, offset, length))
+            else:
+                # Stay within the content:
+                offset = min(offset, entry[1])
+                length = min(length, entry[1] - offset)
+                return pack.read_range(entry, offset, length)
+        return buffer(_compression.decode(stored, self.compression_stats),
+                      offset, length)
+
+    def find(self, partial_identifier=""):
+        validate_identifier_format(partial_identifier, partial=True)
+        with self._lock:
+            keys = set(self.active.iterkeys(partial_identifier))
+            for pack in self.packs:
+                keys.update(pack.iterkeys(partial_identifier))
+            keys.difference_update(self.deleted)
+        return [key.encode("hex") for key in keys]
+
+    def iterfind(self, partial_identifier="", limit=None, after=None):
+        validate_identifier_format(partial_identifier, partial=True)
+        with self._lock:
+            sources = [sorted(self.active.iterkeys(partial_identifier))]
+            sources.extend(pack.iterkeys(partial_identifier) for pack in self.packs)
+            deleted = set(self.deleted)
+        return page_identifiers(self._merge_keys(sources, deleted), limit, after)
+
+    @staticmethod
+    def _merge_keys(sources, deleted):
+        previous = None
+        for key in heapq.merge(*sources):
+            if key != previous and key not in deleted:
+                yield key.encode("hex")
+            previous = key
+
+    def __contains__(self, identifier):
+        validate_identifier_format(identifier)
+        key = identifier.decode("hex")
+        with self._lock:
+            if key in self.deleted: return False
+            return self._locate(key)[0] is not None
+
+    ## MODIFICATION ##
+
+    def _exists(self, key):
+        """
+        Return whether content for key is stored, and undelete it if it has
+        been deleted.  Call with self._lock held.
+        """
+        if self._locate(key)[0] is None: return False
+        if key in self.deleted:
+            self._log_deleted(_UNDELETED, key)
+        return True
+
+    def _append(self, key, stored):
+        # Call with self._lock held.
+        self.active.append(key, stored)
+        if self.active.size >= self.max_pack_size:
+            self._seal()
+
+    def _encode(self, byte_string, compress=True):
+        # Call without self._lock held, as compressing may take a while.
+        if not compress:
+            return _compression.escape(byte_string)
+        if self.chunker is not None and self.chunker.wants(len(byte_string)):
+            return _chunking.encode(self.chunker, byte_string,
+                                    self._chunk_db().__add__)
+        if self.compression is not None:
+            return self.compression.encode(byte_string, self.compression_stats)
+        return _compression.escape(byte_string)
+
+    def _add_many(self, items, compress=True):
+        """
+        Enter the (key, byte string) pairs items, encoding the missing ones
+        without self._lock held.
+        """
+        with self._lock:
+            missing = dict((key, byte_string) for key, byte_string in items
+                           if not self._exists(key))
+        encoded = [(key, self._encode(byte_string, compress))
+                   for key, byte_string in missing.iteritems()]
+        with self._lock:
+            for key, stored in encoded:
+                # Another thread may have entered it meanwhile:
+                if not self._exists(key):
+                    self._append(key, stored)
+
+    def __add__(self, byte_string):
+        content_identifier = sha256(byte_string).hexdigest()
+        self._add_many([(content_identifier.decode("hex"), byte_string)])
+        return content_identifier
+
+    def add_many(self, byte_strings):
+        byte_strings = list(byte_strings)
+        content_identifiers = bulk.sha256_many(byte_strings)
+        self._add_many([(content_identifier.decode("hex"), byte_string)
+                        for content_identifier, byte_string
+                        in zip(content_identifiers, byte_strings)])
+        return content_identifiers
+
+    def add_stream(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        if self.chunker is not None:
+            content_identifier, data = _chunking.encode_stream(
+                self.chunker, read_chunks(fileobj, chunk_size),
+                self._chunk_db().__add__)
+            if content_identifier is None:  # small enough to do it in memory
+                return self + data
+            with self._lock:
+                key = content_identifier.decode("hex")
+                if not self._exists(key):
+                    self._append(key, data)
+            return content_identifier
+        chunks = read_chunks(fileobj, max(chunk_size, _compression.HEADER_SIZE))
+        first = next(chunks, "")
+        if _compression.is_encoded(first):  # rare, so read it all
+            byte_string = "".join([first] + list(chunks))
+            key = sha256(byte_string).digest()
+            self._add_many([(key, byte_string)], compress=False)
+            return key.encode("hex")
+        with self._lock:
+            key = self.active.append_stream(
+                itertools.chain([first], chunks),
+                skip=lambda key: self._locate(key)[0] is not None)
+            if key in self.deleted:
+                self._log_deleted(_UNDELETED, key)
+            if self.active.size >= self.max_pack_size:
+                self._seal()
+        return key.encode("hex")
+
+    def __delitem__(self, identifier):
+        validate_identifier_format(identifier)
+        key = identifier.decode("hex")
+        with self._lock:
+            if key in self.deleted or self._locate(key)[0] is None:
+                raise KeyError(identifier)
+            self._log_deleted(_DELETED, key)
+
+    def _log_deleted(self, op, key):
+        self._deleted_file.write(op + key)
+        self._deleted_file.flush()
+        if op == _DELETED:
+            self.deleted.add(key)
+        else:
+            self.deleted.discard(key)
+
+    def _seal(self):
+        self.packs.insert(0, self.active.seal())
+        self.active = _ActivePack(_pack_filename(self.directory, self._next_number()))
+
+    def repack(self, min_garbage_ratio=0.0):
+        """
+        Copy the content that has not been deleted from sealed packs into new
+        packs, and remove the old packs.
+
+        Only packs of which at least min_garbage_ratio (0.0 .. 1.0) of the
+        content has been deleted are repacked.  The active pack is sealed first
+        if it contains deleted content.
+        """
+        with self._lock:
+            if any(key in self.deleted for key in self.active.entries):
+                self._seal()
+            old_packs = []
+            for pack in self.packs:
+                garbage = sum(1 for key in pack.keys if key in self.deleted)
+                if garbage and garbage >= min_garbage_ratio * len(pack):
+                    old_packs.append(pack)
+            if not old_packs: return
+
+            # Copy the live content into a fresh pack, oldest pack first:
+            new_pack = _ActivePack(_pack_filename(self.directory, self._next_number()))
+            dropped = set()
+            for pack in reversed(old_packs):
+                for key in pack.keys:
+                    if key in self.deleted:
+                        dropped.add(key)
+                    elif key not in new_pack.entries:
+                        if new_pack.size >= self.max_pack_size:
+                            self.packs.insert(0, new_pack.seal())
+                            new_pack = _ActivePack(_pack_filename(
+                                self.directory, self._next_number()))
+                        new_pack.append(key, pack.read(pack.locate(key)))
+            if len(new_pack):
+                self.packs.insert(0, new_pack.seal())
+            else:
+                new_pack.file.close()
+                os.remove(new_pack.filename)
+
+            # Only then remove the old packs, and forget about deleted content
+            # that is not stored anywhere anymore:
+            for pack in old_packs:
+                self.packs.remove(pack)
+                os.remove(_index_filename(pack.filename))
+                os.remove(pack.filename)
+            for key in dropped:
+                if self._locate(key)[0] is None:
+                    self.deleted.discard(key)
+            self._rewrite_deleted()
+
+    def close(self):
+        """
+        Close all files, and let other processes use the data store.
+        """
+        with self._lock:
+            if self.chunk_db is not None:
+                self.chunk_db.close()
+            self.active.file.close()
+            self._deleted_file.close()
+            self._lock_file.close()
+
+    def _rewrite_deleted(self):
+        filename = os.path.join(self.directory, DELETED_FILENAME)
+        fd, tmp_filename = tempfile.mkstemp(dir=self.directory, prefix=".deleted")
+        with os.fdopen(fd, "wb") as f:
+            f.write("".join(_DELETED + key for key in self.deleted))
+        os.rename(tmp_filename, filename)
+        self._deleted_file.close()
+        self._deleted_file = open(filename, "ab")
+
+
+class GentleDataStore(data_store_interfaces.GentleDataStore):
+
+    def __init__(self, directory, mkdir=False,
+                 max_pack_size=DEFAULT_MAX_PACK_SIZE, compression=None,
+                 chunking=None):
+        super(GentleDataStore, self).__init__()
+        self.directory = os.path.abspath(directory)
+        if mkdir and not os.path.exists(self.directory):
+            os.mkdir(self.directory, 0700)
+
+        self.content_db = _GentleContentDB(
+            os.path.join(self.directory, PACKS_DIRNAME), mkdir=mkdir,
+            max_pack_size=max_pack_size, compression=compression,
+            chunking=chunking)
+
+        self.pointer_db = fs_based._GentlePointerDB(
+            os.path.join(self.directory, "pointer_db"), mkdir=mkdir)
+
+    def compression_stats(self):
+        """
+        Return the counters of gentle_tp_da92.compression.CompressionStats.
+        """
+        return self.content_db.compression_stats.as_dict()
+
+    def close(self):
+        self.content_db.close()
@@ -0,0 +1,455 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Prefix Index Module.
+
+Provides a persistent, sorted index of identifiers, which makes searching for
+partial identifiers O(log n) regardless of the number of identifiers.
+
+The index is kept in its own directory:
+
+    .../<index directory>/
+        keys      (header, followed by the sorted 32-byte binary identifiers)
+        journal   (changes made since 'keys' was written, 33 bytes each)
+        lock      (locked while the files are read, written or merged)
+
+The 'keys' file is memory-mapped and binary-searched.  Changes are appended to
+the journal, which several processes may share, and merged into a new 'keys'
+file in a background thread once the journal grows large.  Everyone reading or
+changing the files locks the 'lock' file; merging keeps it locked from reading
+the journal until emptying it, so no change journaled meanwhile is lost.  If the indexed
+directories change behind the back of the index, it is rebuilt from scratch in
+the background; until then, PrefixIndex.find() returns None and the caller has
+to search the directories itself.
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+import bisect
+from   contextlib import contextmanager
+import fcntl
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from   .utilities import *
+
+
+KEY_SIZE = IDENTIFIER_LENGTH / 2
+
+KEYS_FILENAME = "keys"
+JOURNAL_FILENAME = "journal"
+LOCK_FILENAME = "lock"
+
+_MAGIC = "GTPIDX1\n"
+_HEADER = struct.Struct("<8sQ")  # magic, number of keys
+
+_ADDED, _REMOVED = "+", "-"
+_RECORD_SIZE = 1 + KEY_SIZE
+
+
+def identifier_range(partial_identifier):
+    """
+    Return the smallest and the largest binary key of all identifiers starting
+    with partial_identifier.
+    """
+    padding = IDENTIFIER_LENGTH - len(partial_identifier)
+    lo = (partial_identifier + "0" * padding).decode("hex")
+    hi = (partial_identifier + "f" * padding).decode("hex")
+    return lo, hi
+
+
+class SortedKeys(object):
+    """
+    Read-only sequence of sorted binary keys stored back to back in a buffer,
+    e.g. a memory-mapped file.
+    """
+
+    def __init__(self, buf="", offset=0, count=None):
+        super(SortedKeys, self).__init__()
+        if count is None:
+            count = (len(buf) - offset) // KEY_SIZE
+        self.buf = buf
+        self.offset = offset
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        start = self.offset + i * KEY_SIZE
+        return self.buf[start:start + KEY_SIZE]
+
+    def __iter__(self):
+        for i in xrange(self.count):
+            yield self[i]
+
+    def __contains__(self, key):
+        i = bisect.bisect_left(self, key)
+        return i < self.count and self[i] == key
+
+    def range(self, partial_identifier):
+        """
+        Return the (start, stop) indices of the keys of the identifiers
+        starting with partial_identifier.
+        """
+        lo, hi = identifier_range(partial_identifier)
+        start = bisect.bisect_left(self, lo)
+        stop = bisect.bisect_right(self, hi, start)
+        return start, stop
+
+
+def write_keys_file(filename, keys, count):
+    """
+    Atomically (re-)write a keys file from an iterable of count sorted keys.
+    """
+    fd, tmp_filename = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                        prefix="." + KEYS_FILENAME)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, count))
+            chunk = []
+            for key in keys:
+                chunk.append(key)
+                if len(chunk) >= 4096:
+                    f.write("".join(chunk))
+                    chunk = []
+            f.write("".join(chunk))
+        os.rename(tmp_filename, filename)
+    except:
+        os.remove(tmp_filename)
+        raise
+
+
+def load_keys_file(filename):
+    """
+    Memory-map a keys file and return a SortedKeys object for it.
+    """
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < _HEADER.size:
+            raise GentleException("truncated index file: %r" % filename)
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, count = _HEADER.unpack(buf[:_HEADER.size])
+    if magic != _MAGIC or size != _HEADER.size + count * KEY_SIZE:
+        raise GentleException("invalid index file: %r" % filename)
+    return SortedKeys(buf, _HEADER.size, count)
+
+
+class PrefixIndex(object):
+    """
+    Persistent index of the identifiers in one or more directories.
+
+    scan() must return an iterable of all identifiers currently stored.  stamp()
+    must return the latest modification time of the indexed directories; when
+    it is newer than the index files, somebody changed the directories without
+    telling the index, and it is rebuilt using scan().
+    """
+
+    def __init__(self, directory, scan, stamp, check_interval=1.0,
+                 merge_threshold=4096):
+        super(PrefixIndex, self).__init__()
+        self.directory = directory
+        self.keys_filename = os.path.join(directory, KEYS_FILENAME)
+        self.journal_filename = os.path.join(directory, JOURNAL_FILENAME)
+        self.check_interval = check_interval
+        self.merge_threshold = merge_threshold
+        self._scan = scan
+        self._stamp = stamp
+        self._lock = threading.RLock()
+        self._keys = SortedKeys()
+        self._keys_ino = None
+        self._delta = {}  # binary key -> True if added, False if removed
+        self._journal = None
+        self._journal_ino = None
+        self._journal_offset = 0
+        self._ready = False
+        self._thread = None
+        self._last_check = 0
+        if not os.path.exists(directory):
+            os.mkdir(directory, 0700)
+        self._lock_file = create_file_with_mode(
+            os.path.join(directory, LOCK_FILENAME), 0600)
+        with self._lock:
+            with self._file_lock():
+                self._load()
+            self._check()
+
+    ## LOCKING ##
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        Lock the index files against other processes.  Call with self._lock
+        held, as all threads share the lock.
+        """
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    ## LOADING, CALL WITH THE FILES LOCKED ##
+
+    def _load(self):
+        try:
+            keys = load_keys_file(self.keys_filename)
+            self._keys_ino = os.stat(self.keys_filename).st_ino
+        except (IOError, OSError, GentleException):
+            keys = SortedKeys()
+            self._keys_ino = None
+        # Forget changes that the new keys file already includes:
+        for key, added in self._delta.items():
+            if (key in keys) == added:
+                del self._delta[key]
+        self._keys = keys
+        self._open_journal()
+
+    def _open_journal(self):
+        if self._journal is not None:
+            os.close(self._journal)
+        self._journal = os.open(self.journal_filename,
+                                os.O_RDWR | os.O_APPEND | os.O_CREAT, 0600)
+        self._journal_ino = os.fstat(self._journal).st_ino
+        self._journal_offset = 0
+        # Changes made by this process that the keys file does not include yet
+        # are written to the new journal, for the benefit of other processes:
+        own_records = "".join((_ADDED if added else _REMOVED) + key
+                              for key, added in self._delta.iteritems())
+        self._replay_journal()
+        if own_records:
+            self._append(own_records)
+
+    def _refresh(self):
+        """
+        Catch up with the changes other processes have journaled or merged.
+        """
+        try:
+            keys_ino = os.stat(self.keys_filename).st_ino
+            journal_ino = os.stat(self.journal_filename).st_ino
+        except OSError:
+            keys_ino = journal_ino = None
+        if keys_ino != self._keys_ino or journal_ino != self._journal_ino:
+            self._load()
+        else:
+            self._replay_journal()
+
+    def _replay_journal(self):
+        size = os.fstat(self._journal).st_size
+        if size <= self._journal_offset: return
+        os.lseek(self._journal, self._journal_offset, os.SEEK_SET)
+        data = os.read(self._journal, size - self._journal_offset)
+        usable = len(data) - len(data) % _RECORD_SIZE
+        for start in xrange(0, usable, _RECORD_SIZE):
+            op, key = data[start], data[start + 1:start + _RECORD_SIZE]
+            self._apply(key, op == _ADDED)
+        self._journal_offset += usable
+
+    def _apply(self, key, added):
+        if (key in self._keys) == added:
+            self._delta.pop(key, None)
+        else:
+            self._delta[key] = added
+
+    def _append(self, records):
+        os.write(self._journal, records)
+        self._journal_offset += len(records)
+
+    ## FRESHNESS CHECKS AND REBUILDING ##
+
+    def _mtime(self, filename):
+        try:
+            return os.stat(filename).st_mtime
+        except OSError:
+            return None
+
+    def _check(self):
+        self._last_check = time.time()
+        if self._thread is not None: return
+        with self._file_lock():
+            self._refresh()
+            # Find out whether the directories have changed behind our back:
+            keys_mtime = self._mtime(self.keys_filename)
+            if keys_mtime is None:
+                fresh = False
+            else:
+                indexed_mtime = max(keys_mtime, self._mtime(self.journal_filename))
+                fresh = self._stamp() <= indexed_mtime
+        if not fresh:
+            self._ready = False
+            self._start(scan=True)
+        elif len(self._delta) > self.merge_threshold:
+            self._start(scan=False)
+        else:
+            self._ready = True
+
+    def _start(self, scan):
+        self._thread = threading.Thread(target=self._rebuild, args=(scan,))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _rebuild(self, scan):
+        try:
+            while not self._merge(scan):
+                pass
+        finally:
+            self._thread = None
+
+    def _merge(self, scan):
+        """
+        Write a new keys file including all changes journaled so far, and empty
+        the journal.  If scan is True, the keys are scanned instead of taken
+        from the current keys file.  Return False if another process merged
+        the journal during the scan, which then has to be repeated.
+        """
+        if scan:
+            # Changes journaled from here on may be missed by the scan:
+            with self._lock:
+                with self._file_lock():
+                    self._refresh()
+                    keys_ino, scan_offset = self._keys_ino, self._journal_offset
+            keys = set(i.decode("hex") for i in self._scan()
+                       if is_identifier_format_valid(i))
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+                if scan:
+                    if self._keys_ino != keys_ino: return False
+                    self._apply_records(keys, scan_offset)
+                else:
+                    keys = set(self._keys)
+                    keys.update(k for k, added in self._delta.iteritems() if added)
+                    keys.difference_update(
+                        k for k, added in self._delta.iteritems() if not added)
+                keys = sorted(keys)
+                write_keys_file(self.keys_filename, keys, len(keys))
+                # Nobody can append to the journal before it is emptied:
+                os.ftruncate(self._journal, 0)
+                self._delta.clear()
+                self._load()
+            self._ready = True
+        return True
+
+    def _apply_records(self, keys, offset):
+        """
+        Apply the changes journaled from offset on to the set keys.
+        """
+        size = os.fstat(self._journal).st_size
+        os.lseek(self._journal, offset, os.SEEK_SET)
+        data = os.read(self._journal, max(size - offset, 0))
+        for start in xrange(0, len(data) - len(data) % _RECORD_SIZE, _RECORD_SIZE):
+            op, key = data[start], data[start + 1:start + _RECORD_SIZE]
+            if op == _ADDED:
+                keys.add(key)
+            else:
+                keys.discard(key)
+
+    def rebuild(self):
+        """
+        Rebuild the index from scratch in the background.
+        """
+        with self._lock:
+            if self._thread is None:
+                self._ready = False
+                self._start(scan=True)
+
+    def wait(self):
+        """
+        Wait for a running background rebuild to finish.
+        """
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    ## INDEX OPERATIONS ##
+
+    def add(self, identifier):
+        """
+        Record that identifier has been stored.
+        """
+        key = identifier.decode("hex")
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+                if self._delta.get(key, key in self._keys):
+                    # Replacing the file of an identifier still changes the
+                    # directory, which must not look like a change made
+                    # behind our back:
+                    os.utime(self.journal_filename, None)
+                    return
+                self._apply(key, True)
+                self._append(_ADDED + key)
+
+    def remove(self, identifier):
+        """
+        Record that identifier has been removed.
+        """
+        key = identifier.decode("hex")
+        with self._lock:
+            with self._file_lock():
+                self._refresh()
+                if not self._delta.get(key, key in self._keys): return
+                self._apply(key, False)
+                self._append(_REMOVED + key)
+
+    def find(self, partial_identifier=""):
+        """
+        Return an unsorted list of the identifiers starting with
+        partial_identifier, or None if the index is being rebuilt.
+        """
+        with self._lock:
+            if time.time() - self._last_check >= self.check_interval:
+                self._check()
+            if not self._ready: return None
+            keys, delta = self._keys, self._delta
+            start, stop = keys.range(partial_identifier)
+            found = [keys[i] for i in xrange(start, stop)]
+            if delta:
+                lo, hi = identifier_range(partial_identifier)
+                found = set(k for k in found if delta.get(k, True))
+                found.update(k for k, added in delta.iteritems()
+                             if added and lo <= k <= hi)
+        return [k.encode("hex") for k in found]
+
+    def iterfind(self, partial_identifier="", after=None):
+        """
+        Like find(), but return an iterator over the identifiers in sorted
+        order, starting near the identifier after (the caller skips those up
+        to after), or None if the index is being rebuilt.
+        """
+        with self._lock:
+            if time.time() - self._last_check >= self.check_interval:
+                self._check()
+            if not self._ready: return None
+            keys, delta = self._keys, dict(self._delta)
+        lo, hi = identifier_range(partial_identifier)
+        start, stop = keys.range(partial_identifier)
+        if after is not None:
+            start = max(start, bisect.bisect_left(keys, identifier_range(after)[0],
+                                                  start, stop))
+        added = sorted(k for k, a in delta.iteritems() if a and lo <= k <= hi)
+        indexed = (keys[i] for i in xrange(start, stop))
+        # Keys added since the keys file was written are never in the file:
+        return (k.encode("hex") for k in heapq.merge(indexed, added)
+                if delta.get(k, True))
@@ -0,0 +1,448 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Shared-Memory-Based Data Store Module.
+
+A memory-based data store that several processes on one machine can use at
+the same time.  The whole data store lives in one memory-mapped file,
+preferably on a RAM file system like /dev/shm:
+
+  - A header, including a sequence counter and the fill levels.
+  - The content table: an open-addressing hash table of 32-byte binary content
+    keys, with the offset and length of the content in the arena.
+  - The pointer table: an open-addressing hash table of 32-byte binary pointer
+    keys, with the binary content key they point to.
+  - The arena, to which content is appended.
+
+Writers serialize through flock() on the file (and a lock within the process).
+Readers do not lock: a writer makes the sequence counter odd while it changes
+the tables, and even again afterwards, and readers retry if the counter was
+odd or changed while they looked something up (a seqlock).  A reader finding
+the counter odd while no writer holds the lock makes it even again, as the
+writer has been killed.
+
+The capacity is fixed when the file is created; GentleException is raised
+when the tables or the arena are full.  Content cannot be deleted.
+
+Usage example:
+>>> from gentle_tp_da92 import shared_memory_based
+>>> data_store = shared_memory_based.GentleDataStore("/dev/shm/gentle")
+>>> # in another process:
+>>> data_store = shared_memory_based.GentleDataStore("/dev/shm/gentle")
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from   binascii import hexlify
+from   contextlib import contextmanager
+import errno
+import fcntl
+from   hashlib import sha256
+import mmap
+import os
+import struct
+import threading
+import time
+
+from   . import bulk
+from   . import data_store_interfaces
+from   .utilities import *
+
+
+KEY_SIZE = IDENTIFIER_LENGTH / 2
+
+DEFAULT_CONTENT_SLOTS = 2 ** 20
+DEFAULT_POINTER_SLOTS = 2 ** 18
+DEFAULT_ARENA_SIZE = 1024 * 1024 * 1024
+
+MAGIC = "GTPSHM1\n"
+
+# magic, sequence counter, content slots, pointer slots, arena size, arena
+# bytes used, content count, pointer slots used (incl. deleted), pointer count:
+_HEADER = struct.Struct("<8sQQQQQQQQ")
+_SEQUENCE_OFFSET = 8
+_Q = struct.Struct("<Q")
+
+# Content slot: key, offset in the arena, length:
+_CONTENT_SLOT = struct.Struct("<%usQQ" % KEY_SIZE)
+# Pointer slot: key, content key, state:
+_POINTER_SLOT = struct.Struct("<%us%usQ" % (KEY_SIZE, KEY_SIZE))
+
+_EMPTY_KEY = "\0" * KEY_SIZE
+_USED, _DELETED = 1, 2
+
+# The tables are never filled beyond this fraction, to keep probing short:
+_MAX_LOAD = 0.75
+
+
+class _Store(object):
+    """
+    The memory-mapped file shared by the content and pointer databases.
+    """
+
+    def __init__(self, filename, content_slots, pointer_slots, arena_size):
+        super(_Store, self).__init__()
+        self.filename = filename
+        self._thread_lock = threading.Lock()
+        self._fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0600)
+        with self._file_lock():
+            if os.fstat(self._fd).st_size == 0:
+                for slots in (content_slots, pointer_slots):
+                    if slots & (slots - 1):
+                        raise ValueError("number of slots not a power of two: %r" % slots)
+                size = (_HEADER.size + content_slots * _CONTENT_SLOT.size +
+                        pointer_slots * _POINTER_SLOT.size + arena_size)
+                os.ftruncate(self._fd, size)
+                self.buf = mmap.mmap(self._fd, size)
+                _HEADER.pack_into(self.buf, 0, MAGIC, 0, content_slots,
+                                  pointer_slots, arena_size, 0, 0, 0, 0)
+            else:
+                self.buf = mmap.mmap(self._fd, 0)
+        header = _HEADER.unpack_from(self.buf)
+        if header[0] != MAGIC:
+            raise GentleException("not a shared memory data store: %r" % filename)
+        self.content_slots, self.pointer_slots, self.arena_size = header[2:5]
+        self.content_table = _HEADER.size
+        self.pointer_table = self.content_table + self.content_slots * _CONTENT_SLOT.size
+        self.arena = self.pointer_table + self.pointer_slots * _POINTER_SLOT.size
+
+    def close(self):
+        self.buf.close()
+        os.close(self._fd)
+
+    ## HEADER FIELDS ##
+
+    def _field(self, i):
+        return _Q.unpack_from(self.buf, 8 * i)[0]
+
+    def _set_field(self, i, value):
+        _Q.pack_into(self.buf, 8 * i, value)
+
+    arena_used = property(lambda self: self._field(5),
+                          lambda self, value: self._set_field(5, value))
+    content_count = property(lambda self: self._field(6),
+                             lambda self, value: self._set_field(6, value))
+    pointer_used = property(lambda self: self._field(7),
+                            lambda self, value: self._set_field(7, value))
+    pointer_count = property(lambda self: self._field(8),
+                             lambda self, value: self._set_field(8, value))
+
+    ## LOCKING ##
+
+    @contextmanager
+    def _file_lock(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def write(self):
+        """
+        Context manager for changing the store, excluding other writers and
+        making readers retry.
+        """
+        with self._thread_lock:
+            with self._file_lock():
+                sequence = _Q.unpack_from(self.buf, _SEQUENCE_OFFSET)[0]
+                # A writer killed while changing things left it odd:
+                sequence += sequence & 1
+                _Q.pack_into(self.buf, _SEQUENCE_OFFSET, sequence + 1)
+                try:
+                    yield
+                finally:
+                    _Q.pack_into(self.buf, _SEQUENCE_OFFSET, sequence + 2)
+
+    def _writer_killed(self):
+        """
+        Return whether the counter is odd although no writer holds the locks,
+        i.e. a writer has been killed while writing.
+        """
+        # A writer thread of this process holds the file lock through the same
+        # file descriptor, and locking it again would convert its lock:
+        if not self._thread_lock.acquire(False): return False
+        try:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_SH | fcntl.LOCK_NB)
+            except IOError as e:
+                if e.errno != errno.EWOULDBLOCK: raise
+                return False  # a writer of another process is busy
+            try:
+                return bool(_Q.unpack_from(self.buf, _SEQUENCE_OFFSET)[0] & 1)
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            self._thread_lock.release()
+
+    def read(self, function, *args):
+        """
+        Return function(*args), retrying until no writer interfered.
+        """
+        buf = self.buf
+        while True:
+            before = _Q.unpack_from(buf, _SEQUENCE_OFFSET)[0]
+            if before & 1:
+                if self._writer_killed():
+                    with self.write():
+                        pass  # makes the counter even again
+                else:
+                    time.sleep(0)  # a writer is busy
+                continue
+            try:
+                result = function(*args)
+            except Exception:
+                # Possibly caused by reading while a writer changed things:
+                if _Q.unpack_from(buf, _SEQUENCE_OFFSET)[0] == before: raise
+                continue
+            if _Q.unpack_from(buf, _SEQUENCE_OFFSET)[0] == before:
+                return result
+
+
+class _GentleDB(data_store_interfaces._GentleDB):
+    """
+    Base class for Gentle TP-DA92 shared-memory-based databases.  Subclasses
+    set the table layout.
+    """
+
+    _SLOT = None
+
+    def __init__(self, store, table, slots):
+        super(_GentleDB, self).__init__()
+        self.store = store
+        self._table = table
+        self._slots = slots
+
+    def _probe(self, key):
+        """
+        Return the slot number of key, or -1 and the slot number where key
+        would be inserted.  Deleted slots are not reused, so that readers never
+        see a key moving.
+        """
+        buf = self.store.buf
+        mask = self._slots - 1
+        i = _Q.unpack_from(key)[0] & mask
+        while True:
+            start = self._table + i * self._SLOT.size
+            slot_key = buf[start:start + KEY_SIZE]
+            if slot_key == key:
+                return i, i
+            if slot_key == _EMPTY_KEY:
+                return -1, i
+            i = (i + 1) & mask
+
+    def _slot(self, i):
+        return self._SLOT.unpack_from(self.store.buf, self._table + i * self._SLOT.size)
+
+    def _lookup(self, identifier):
+        """
+        Return the slot values of identifier, or raise KeyError.  Call through
+        self.store.read().
+        """
+        i, _ = self._probe(identifier.decode("hex"))
+        if i < 0:
+            raise KeyError(identifier)
+        slot = self._slot(i)
+        if not self._is_live(slot):
+            raise KeyError(identifier)
+        return slot
+
+    def _is_live(self, slot):
+        return True
+
+    def _value(self, slot):
+        raise NotImplementedError()
+
+    def _get(self, identifier):
+        return self._value(self._lookup(identifier))
+
+    def __getitem__(self, identifier):
+        validate_identifier_format(identifier)
+        return self.store.read(self._get, identifier)
+
+    def get_many(self, identifiers):
+        identifiers = list(identifiers)
+        for identifier in identifiers:
+            validate_identifier_format(identifier)
+        return [self.store.read(self._get, identifier) for identifier in identifiers]
+
+    def _find(self, partial_identifier):
+        buf = self.store.buf
+        size = self._SLOT.size
+        found = []
+        for i in xrange(self._slots):
+            start = self._table + i * size
+            key = buf[start:start + KEY_SIZE]
+            if key == _EMPTY_KEY: continue
+            identifier = hexlify(key)
+            if identifier.startswith(partial_identifier) and self._is_live(self._slot(i)):
+                found.append(identifier)
+        return found
+
+    def find(self, partial_identifier=""):
+        validate_identifier_format(partial_identifier, partial=True)
+        return self.store.read(self._find, partial_identifier)
+
+    def _contains(self, identifier):
+        try:
+            self._lookup(identifier)
+        except KeyError:
+            return False
+        return True
+
+    def __contains__(self, identifier):
+        validate_identifier_format(identifier)
+        return self.store.read(self._contains, identifier)
+
+    def contains_many(self, identifiers):
+        identifiers = list(identifiers)
+        for identifier in identifiers:
+            validate_identifier_format(identifier)
+        return [self.store.read(self._contains, identifier) for identifier in identifiers]
+
+
+class _GentleContentDB(data_store_interfaces._GentleContentDB, _GentleDB):
+
+    _SLOT = _CONTENT_SLOT
+
+    def __init__(self, store):
+        super(_GentleContentDB, self).__init__(store, store.content_table,
+                                               store.content_slots)
+
+    def _value(self, slot, offset=0, length=None):
+        _, start, size = slot
+        offset = min(offset, size)
+        if length is None or offset + length > size:
+            length = size - offset
+        start = self.store.arena + start + offset
+        return self.store.buf[start:start + length]
+
+    def _add(self, key, byte_string):
+        # Call within self.store.write().
+        store = self.store
+        found, i = self._probe(key)
+        if found >= 0: return
+        if store.content_count + 1 > self._slots * _MAX_LOAD:
+            raise GentleException("content table full: %r" % store.filename)
+        offset = store.arena_used
+        if offset + len(byte_string) > store.arena_size:
+            raise GentleException("arena full: %r" % store.filename)
+        # Claimed first, so that the content of a slot written by a writer
+        # killed meanwhile is never overwritten:
+        store.arena_used = offset + len(byte_string)
+        store.buf[store.arena + offset:store.arena + offset + len(byte_string)] = byte_string
+        _CONTENT_SLOT.pack_into(store.buf, self._table + i * _CONTENT_SLOT.size,
+                                key, offset, len(byte_string))
+        store.content_count += 1
+
+    def __add__(self, byte_string):
+        key = sha256(byte_string).digest()
+        with self.store.write():
+            self._add(key, byte_string)
+        return hexlify(key)
+
+    def add_many(self, byte_strings):
+        byte_strings = list(byte_strings)
+        content_identifiers = bulk.sha256_many(byte_strings)
+        with self.store.write():
+            for content_identifier, byte_string in zip(content_identifiers, byte_strings):
+                self._add(content_identifier.decode("hex"), byte_string)
+        return content_identifiers
+
+    def read_range(self, identifier, offset, length):
+        validate_identifier_format(identifier)
+        return buffer(self.store.read(
+            lambda: self._value(self._lookup(identifier), offset, length)))
+
+
+class _GentlePointerDB(data_store_interfaces._GentlePointerDB, _GentleDB):
+
+    _SLOT = _POINTER_SLOT
+
+    def __init__(self, store):
+        super(_GentlePointerDB, self).__init__(store, store.pointer_table,
+                                               store.pointer_slots)
+
+    def _is_live(self, slot):
+        return slot[2] == _USED
+
+    def _value(self, slot):
+        return hexlify(slot[1])
+
+    def _set(self, pointer_identifier, content_identifier):
+        # Call within self.store.write().
+        store = self.store
+        key = pointer_identifier.decode("hex")
+        if key == _EMPTY_KEY:
+            raise GentleException("pointer identifier reserved: %r" % pointer_identifier)
+        found, i = self._probe(key)
+        if found < 0:
+            if store.pointer_used + 1 > self._slots * _MAX_LOAD:
+                raise GentleException("pointer table full: %r" % store.filename)
+            store.pointer_used += 1
+        if found < 0 or not self._is_live(self._slot(i)):
+            store.pointer_count += 1
+        _POINTER_SLOT.pack_into(store.buf, self._table + i * _POINTER_SLOT.size,
+                                key, content_identifier.decode("hex"), _USED)
+
+    def __setitem__(self, pointer_identifier, content_identifier):
+        validate_identifier_format(pointer_identifier)
+        validate_identifier_format(content_identifier)
+        with self.store.write():
+            self._set(pointer_identifier, content_identifier)
+        return pointer_identifier
+
+    def set_many(self, items):
+        items = list(items)
+        for pointer_identifier, content_identifier in items:
+            validate_identifier_format(pointer_identifier)
+            validate_identifier_format(content_identifier)
+        with self.store.write():
+            for pointer_identifier, content_identifier in items:
+                self._set(pointer_identifier, content_identifier)
+        return [pointer_identifier for pointer_identifier, _ in items]
+
+    def __delitem__(self, identifier):
+        validate_identifier_format(identifier)
+        with self.store.write():
+            key, value, state = self._lookup(identifier)
+            i, _ = self._probe(key)
+            _POINTER_SLOT.pack_into(self.store.buf, self._table + i * _POINTER_SLOT.size,
+                                    key, value, _DELETED)
+            self.store.pointer_count -= 1
+
+
+class GentleDataStore(data_store_interfaces.GentleDataStore):
+
+    def __init__(self, filename, content_slots=DEFAULT_CONTENT_SLOTS,
+                 pointer_slots=DEFAULT_POINTER_SLOTS,
+                 arena_size=DEFAULT_ARENA_SIZE):
+        """
+        Open the shared data store in filename, creating it with the given
+        capacity if it does not exist.  The numbers of slots must be powers of
+        two; at most 75% of them can be used.  The file is sparse, so unused
+        capacity takes no memory.
+        """
+        super(GentleDataStore, self).__init__()
+        self.filename = filename
+        self.store = _Store(filename, content_slots, pointer_slots, arena_size)
+        self.content_db = _GentleContentDB(self.store)
+        self.pointer_db = _GentlePointerDB(self.store)
+
+    def close(self):
+        self.store.close()
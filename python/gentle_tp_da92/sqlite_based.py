@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - SQLite-Based Data Store Implementation Module.
+
+Provides a data store that keeps both databases in a single SQLite file in
+write-ahead logging (WAL) mode:
+
+    .../<data store top directory>/
+        gentle.sqlite   (tables 'content' and 'pointer')
+        gentle.sqlite-wal, gentle.sqlite-shm   (maintained by SQLite)
+
+Identifiers are stored as 32-byte binary primary keys, so find() is a range
+scan of the primary key index.  Any number of processes may read the data
+store while one of them writes to it.  Group many changes into one transaction
+using GentleDataStore.batch():
+
+    >>> with data_store.batch():
+    ...     for byte_string in byte_strings:
+    ...         data_store.content_db + byte_string
+
+It is recommended to use the gentle_tp_da92.easy module in applications, instead
+of directly using the data store implementation modules.
+
+For documentation on the interfaces of the classes provided by this module, see
+the gentle_tp_da92.data_store_interfaces module.
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from   contextlib import contextmanager
+from   hashlib import sha256
+import os
+import sqlite3
+import threading
+
+from   . import data_store_interfaces
+from   . import prefix_index
+from   .utilities import *
+
+
+DATABASE_FILENAME = "gentle.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS content (
+    id BLOB PRIMARY KEY,
+    data BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pointer (
+    id BLOB PRIMARY KEY,
+    content BLOB NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+class _GentleDB(data_store_interfaces._GentleDB):
+    """
+    Base class for Gentle TP-DA92 SQLite-based databases.
+    """
+
+    # Name of the database table, and of the column holding the values:
+    TABLE = None
+    COLUMN = None
+
+    def __init__(self, data_store):
+        super(_GentleDB, self).__init__()
+        self.data_store = data_store
+        self._get_sql = "SELECT %s FROM %s WHERE id = ?" % (self.COLUMN, self.TABLE)
+        self._find_sql = "SELECT id FROM %s WHERE id BETWEEN ? AND ?" % self.TABLE
+        self._iterfind_sql = ("SELECT id FROM %s WHERE id BETWEEN ? AND ? "
+                              "ORDER BY id LIMIT ?" % self.TABLE)
+        self._contains_sql = "SELECT 1 FROM %s WHERE id = ?" % self.TABLE
+        self._del_sql = "DELETE FROM %s WHERE id = ?" % self.TABLE
+
+    def _execute(self, sql, parameters=()):
+        return self.data_store._execute(sql, parameters)
+
+    def __getitem__(self, identifier):
+        validate_identifier_format(identifier)
+        row = self._execute(self._get_sql, (buffer(identifier.decode("hex")),)).fetchone()
+        if row is None:
+            raise KeyError(identifier)
+        return str(row[0])
+
+    def find(self, partial_identifier=""):
+        validate_identifier_format(partial_identifier, partial=True)
+        lo, hi = prefix_index.identifier_range(partial_identifier)
+        rows = self._execute(self._find_sql, (buffer(lo), buffer(hi)))
+        identifiers = [str(row[0]).encode("hex") for row in rows]
+        return identifiers
+
+    def iterfind(self, partial_identifier="", limit=None, after=None):
+        validate_identifier_format(partial_identifier, partial=True)
+        lo, hi = prefix_index.identifier_range(partial_identifier)
+        if after is not None:
+            lo = max(lo, prefix_index.identifier_range(after)[0])
+        # A limit of -1 means no limit to SQLite; the extra row makes up for
+        # an identifier equal to after:
+        sql_limit = -1 if limit is None else limit + 1
+        rows = self._execute(self._iterfind_sql, (buffer(lo), buffer(hi), sql_limit))
+        identifiers = (str(row[0]).encode("hex") for row in rows)
+        return page_identifiers(identifiers, limit, after)
+
+    def __contains__(self, identifier):
+        validate_identifier_format(identifier)
+        row = self._execute(self._contains_sql, (buffer(identifier.decode("hex")),)).fetchone()
+        return row is not None
+
+    def __delitem__(self, identifier):
+        validate_identifier_format(identifier)
+        cursor = self._execute(self._del_sql, (buffer(identifier.decode("hex")),))
+        if cursor.rowcount == 0:
+            raise KeyError(identifier)
+
+
+class _GentleContentDB(data_store_interfaces._GentleContentDB, _GentleDB):
+
+    TABLE = "content"
+    COLUMN = "data"
+
+    def __add__(self, byte_string):
+        content_identifier = sha256(byte_string).hexdigest()
+        self._execute("INSERT OR IGNORE INTO content (id, data) VALUES (?, ?)",
+                      (buffer(content_identifier.decode("hex")), buffer(byte_string)))
+        return content_identifier
+
+    def add_many(self, byte_strings):
+        with self.data_store.batch():
+            return super(_GentleContentDB, self).add_many(byte_strings)
+
+
+class _GentlePointerDB(data_store_interfaces._GentlePointerDB, _GentleDB):
+
+    TABLE = "pointer"
+    COLUMN = "content"
+
+    def __getitem__(self, identifier):
+        content_identifier = super(_GentlePointerDB, self).__getitem__(identifier)
+        return content_identifier.encode("hex")
+
+    def __setitem__(self, pointer_identifier, content_identifier):
+        validate_identifier_format(pointer_identifier)
+        validate_identifier_format(content_identifier)
+        self._execute("INSERT OR REPLACE INTO pointer (id, content) VALUES (?, ?)",
+                      (buffer(pointer_identifier.decode("hex")),
+                       buffer(content_identifier.decode("hex"))))
+        return pointer_identifier
+
+    def set_many(self, items):
+        with self.data_store.batch():
+            return super(_GentlePointerDB, self).set_many(items)
+
+    # data_store_interfaces._GentlePointerDB.__delitem__ comes first otherwise:
+    __delitem__ = _GentleDB.__delitem__
+
+
+class GentleDataStore(data_store_interfaces.GentleDataStore):
+
+    def __init__(self, directory, mkdir=False, filename=DATABASE_FILENAME,
+                 timeout=30.0):
+        super(GentleDataStore, self).__init__()
+        self.directory = os.path.abspath(directory)
+        if mkdir and not os.path.exists(self.directory):
+            os.mkdir(self.directory, 0700)
+        self.filename = os.path.join(self.directory, filename)
+        self.timeout = timeout
+        self._local = threading.local()  # one connection per thread
+        self._connection().executescript(_SCHEMA)
+
+        self.content_db = _GentleContentDB(self)
+        self.pointer_db = _GentlePointerDB(self)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # isolation_level=None: transactions are managed by batch()
+            connection = sqlite3.connect(self.filename, timeout=self.timeout,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.batch_depth = 0
+        return connection
+
+    def _execute(self, sql, parameters=()):
+        return self._connection().execute(sql, parameters)
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager that makes all changes done in its block (by the
+        current thread) one transaction, which is much faster than committing
+        every single change.  Batches may be nested.
+        """
+        connection = self._connection()
+        self._local.batch_depth += 1
+        if self._local.batch_depth == 1:
+            connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self
+        except:
+            self._local.batch_depth -= 1
+            if self._local.batch_depth == 0:
+                connection.execute("ROLLBACK")
+            raise
+        else:
+            self._local.batch_depth -= 1
+            if self._local.batch_depth == 0:
+                connection.execute("COMMIT")
@@ -23,7 +23,11 @@ from __future__ import print_function
 
 import cProfile
 from   hashlib import sha256
+import os
 import pdb
+import random
+from   StringIO import StringIO
+import threading
 import traceback
 
 from   gentle_tp_da92 import utilities
@@ -129,6 +133,982 @@ def test(data_store):
         else:
             assert False
 
+    # Streaming
+    string = os.urandom(10000)
+    count = len(c_db.find())
+    c = c_db.add_stream(StringIO(string), chunk_size=999)
+    assert c == sha256(string).hexdigest()
+    assert c_db[c] == string
+    assert c_db.add_stream(StringIO(string)) == c
+    assert c_db.add_stream(StringIO(random_data[0])) == sha256(random_data[0]).hexdigest()
+    assert len(c_db.find()) == count + 1
+
+    # Ranged reads
+    with c_db.open(c) as f:
+        assert f.read(999) == string[:999]
+        assert f.read() == string[999:]
+    assert str(c_db.read_range(c, 0, 10)) == string[:10]
+    assert str(c_db.read_range(c, 9995, 10)) == string[9995:]
+    assert str(c_db.read_range(c, 20000, 10)) == ""
+    empty = c_db + ""
+    assert str(c_db.read_range(empty, 0, 10)) == ""
+
+    # Batch operations
+    strings = random_data[:50] + ["Batch content", "Batch content"]
+    cs = c_db.add_many(strings)
+    assert cs == [sha256(string).hexdigest() for string in strings]
+    assert c_db.get_many(cs) == strings
+    ps = [utilities.random() for string in strings]
+    assert p_db.set_many(zip(ps, cs)) == ps
+    assert p_db.set_many([(ps[0], cs[1]), (ps[0], cs[2])]) == [ps[0]] * 2
+    assert p_db.get_many(ps) == [cs[2]] + cs[1:]
+    assert p_db.contains_many([ps[0], cs[0]]) == [True, False]
+    assert c_db.contains_many([ps[0], cs[0]]) == [False, True]
+
+    # Sorted iteration and paging
+    for db in (c_db, p_db):
+        identifiers = sorted(db.find())
+        assert list(db.iterfind()) == identifiers
+        prefix = identifiers[0][:1]
+        assert list(db.iterfind(prefix)) == sorted(db.find(prefix))
+        pages = []
+        after = None
+        while True:
+            page = list(db.iterfind("", limit=7, after=after))
+            if not page: break
+            assert len(page) <= 7
+            pages.extend(page)
+            after = page[-1]
+        assert pages == identifiers
+        assert list(db.iterfind(identifiers[3][:2], limit=1, after=identifiers[3])) == \
+            [i for i in identifiers[4:5] if i.startswith(identifiers[3][:2])]
+
+    return "PASS"
+
+
+def test_migrate_layout(directory):
+    """
+    Test fs_based layout migration on an empty directory.
+    """
+    from gentle_tp_da92 import fs_based
+
+    data_store = fs_based.GentleDataStore(directory, mkdir=True)
+    c_db = data_store.content_db
+    p_db = data_store.pointer_db
+    contents = [c_db + str(i) for i in range(50)]
+    pointers = [p_db.__setitem__(utilities.random(), c) for c in contents]
+
+    for layout in ("2/2", "1", "flat"):
+        # A second instance keeps using the layout it has seen first:
+        stale_data_store = fs_based.GentleDataStore(directory)
+        data_store.migrate_layout(layout)
+        assert c_db.layout == fs_based.parse_layout(layout)
+        for ds in (data_store, stale_data_store):
+            assert sorted(ds.content_db.find()) == sorted(contents)
+            assert sorted(ds.pointer_db.find()) == sorted(pointers)
+            for i, (c, p) in enumerate(zip(contents, pointers)):
+                assert ds.content_db[c] == str(i)
+                assert ds.pointer_db[p] == c
+        assert stale_data_store.content_db.layout == c_db.layout
+
+    return "PASS"
+
+
+def test_fs_based_durability(directory):
+    """
+    Test that fs_based group commit batches concurrent writes and leaves no
+    temporary files behind.
+    """
+    from gentle_tp_da92 import fs_based
+
+    data_store = fs_based.GentleDataStore(directory, layout="2",
+                                          durability="batched",
+                                          group_commit_interval=0.05)
+    c_db = data_store.content_db
+    p_db = data_store.pointer_db
+    cs = c_db.add_many(str(i) for i in range(100))
+    ps = [utilities.random() for c in cs]
+    p_db.set_many(zip(ps, cs))
+    p_db.set_many(zip(ps, reversed(cs)))  # replace existing files
+    committer = data_store.committer
+    assert committer.files == 300 and committer.batches < 100
+    assert [p_db[p] for p in ps] == cs[::-1]
+    assert sorted(c_db.find()) == sorted(cs)
+    for dirpath, dirnames, filenames in os.walk(directory):
+        assert not [n for n in filenames if n.startswith(".write-")]
+    try:
+        fs_based.GentleDataStore(directory, durability="sometimes")
+    except utilities.GentleException:
+        pass
+    else:
+        assert False, "invalid durability accepted"
+
+    return "PASS"
+
+
+def test_bloom_filter(directory):
+    """
+    Test the Bloom filter of fs_based: its error rate, and how it is saved,
+    reused and rebuilt.
+    """
+    from gentle_tp_da92 import bloom_filter, easy, fs_based
+
+    bloom = bloom_filter.BloomFilter(1000, 0.01)
+    cs = [sha256(str(i)).hexdigest() for i in range(2000)]
+    for c in cs[:1000]:
+        bloom.add(c)
+    assert all(c in bloom for c in cs[:1000])
+    assert sum(c in bloom for c in cs[1000:]) < 30
+
+    data_store = fs_based.GentleDataStore(directory, mkdir=True, layout="2",
+                                          bloom=True)
+    filter_filename = data_store.content_db.bloom.filename
+    cs = data_store.content_db.add_many(str(i) for i in range(100))
+    g = easy._GentleEasyDataStoreWrapper(data_store)
+    assert cs[0] in g and cs[0][:20] in g and utilities.random() not in g
+    data_store.close()
+    assert os.path.exists(filter_filename)
+    # The saved filter is used, and removed until the next close():
+    data_store = fs_based.GentleDataStore(directory, bloom=True)
+    assert not os.path.exists(filter_filename)
+    assert data_store.content_db.bloom.filter.count == 100
+    assert all(c in data_store.content_db for c in cs)
+    data_store.close()
+    # Content added without the filter makes the saved filter stale, even
+    # in an existing fan-out directory:
+    fan_out = set(c[:2] for c in cs)
+    content = next(content for content in ("behind its back %u" % i
+                                           for i in xrange(10000))
+                   if sha256(content).hexdigest()[:2] in fan_out)
+    c = fs_based.GentleDataStore(directory).content_db + content
+    data_store = fs_based.GentleDataStore(directory, bloom=True)
+    assert c in data_store.content_db
+    assert data_store.content_db.bloom.filter.count == 101
+
+    return "PASS"
+
+
+def test_compression(directory):
+    """
+    Test the compression codecs and policy, and the compression of fs_based and
+    pack_based content.
+    """
+    from gentle_tp_da92 import compression, fs_based, pack_based
+
+    text = "".join('{"id": %u, "title": "Item %u"}\n' % (i, i) for i in range(1000))
+    noise = "".join(chr(random.randrange(256)) for i in range(5000))
+    tricky = compression.MAGIC + "\x01" + "x" * 100  # looks like a header
+    for codec in compression.CODECS:
+        stored = compression.CompressionPolicy(codec).encode(text)
+        assert compression.is_encoded(stored) and len(stored) < len(text) / 2
+        assert compression.decode(stored) == text
+    policy = compression.CompressionPolicy()
+    assert policy.encode(noise) == noise  # incompressible
+    assert policy.encode(text[:100]) == text[:100]  # too small
+    assert compression.decode(compression.escape(tricky)) == tricky
+    for corrupt in (tricky, stored[:-10] + "\0" * 10,
+                    compression.pack_header(14, 10) + "x" * 10):
+        try:
+            compression.decode(corrupt)
+        except utilities.GentleException:
+            pass
+        else:
+            assert False, "corrupt content decoded"
+
+    contents = [text, noise, tricky, "", tricky + " streamed"]
+    for data_store in (
+            fs_based.GentleDataStore(os.path.join(directory, "fs_based"),
+                                     mkdir=True, compression="zlib"),
+            pack_based.GentleDataStore(os.path.join(directory, "pack_based"),
+                                       mkdir=True, compression="zlib")):
+        c_db = data_store.content_db
+        cs = c_db.add_many(contents[:-1])
+        cs.append(c_db.add_stream(StringIO(contents[-1]), 10))
+        assert cs == [sha256(x).hexdigest() for x in contents]
+        for c, x in zip(cs, contents):
+            assert c_db[c] == x
+            assert c_db.open(c).read() == x
+            assert str(c_db.read_range(c, 10, 20)) == x[10:30]
+        stats = data_store.compression_stats()
+        assert stats["objects"] == 4 and stats["compressed_objects"] == 1
+        assert stats["saved_bytes"] > len(text) / 2
+        assert stats["decoded_objects"] == 3
+    data_store.close()
+
+    # Compressed content is read back without asking for compression:
+    data_store = fs_based.GentleDataStore(os.path.join(directory, "fs_based"))
+    assert os.path.getsize(data_store.content_db._path(cs[0])) < len(text) / 2
+    assert data_store.content_db[cs[0]] == text
+    # Corrupt compressed content is not returned as it is stored:
+    filename = data_store.content_db._path(cs[0])
+    os.chmod(filename, 0600)
+    with open(filename, "r+b") as f:
+        f.seek(compression.HEADER_SIZE + 20)
+        f.write("\0" * 10)
+    try:
+        data_store.content_db[cs[0]]
+    except utilities.GentleException:
+        pass
+    else:
+        assert False, "corrupt content returned"
+
+    return "PASS"
+
+
+def test_chunking(directory):
+    """
+    Test content-defined chunking, and the chunked storage of large content
+    in fs_based and pack_based.
+    """
+    from gentle_tp_da92 import chunking, fs_based, pack_based
+
+    chunker = chunking.Chunker(min_size=1024, avg_size=4096, max_size=16384)
+    v1 = os.urandom(300000)
+    chunks = chunker.split(v1)
+    assert "".join(chunks) == v1 and 30 < len(chunks) < 150
+    assert all(1024 < len(c) <= 16384 for c in chunks[:-1])
+    pieces = [v1[i:i + 1000] for i in range(0, len(v1), 1000)]
+    assert list(chunker.iter_chunks(pieces)) == chunks
+    # Inserted and changed bytes only change the chunks around them:
+    v2 = v1[:1000] + "inserted" + v1[1000:200000] + "X" + v1[200001:]
+    assert len(set(chunks) - set(chunker.split(v2))) <= 4
+
+    for data_store in (
+            fs_based.GentleDataStore(os.path.join(directory, "fs_based"),
+                                     mkdir=True, chunking=chunker,
+                                     compression="zlib"),
+            pack_based.GentleDataStore(os.path.join(directory, "pack_based"),
+                                       mkdir=True, chunking=chunker)):
+        c_db = data_store.content_db
+        c1, small = c_db.add_many([v1, "small"])
+        c2 = c_db.add_stream(StringIO(v2), 1000)
+        assert [c1, small, c2] == [sha256(x).hexdigest() for x in (v1, "small", v2)]
+        assert sorted(c_db.find()) == sorted([c1, small, c2])
+        assert len(c_db.chunk_db.find()) < 2 * len(chunks)  # shared chunks
+        for c, x in ((c1, v1), (c2, v2), (small, "small")):
+            assert c_db[c] == x
+            assert c_db.open(c).read() == x
+            assert str(c_db.read_range(c, 4000, 30000)) == x[4000:34000]
+        chunk = c_db.chunk_db.find()[0]
+        assert chunk not in c_db
+        if isinstance(c_db, fs_based._GentleContentDB):
+            stored = sum(os.path.getsize(os.path.join(d, f))
+                         for d, _, fs in os.walk(c_db.directory) for f in fs)
+            assert open(c_db._path(small), "rb").read() == "small"
+        else:
+            # Chunks cannot be deleted behind the back of the content using
+            # them, and repacking keeps them:
+            try:
+                del c_db[chunk]
+            except KeyError:
+                pass
+            else:
+                assert False
+            del c_db[small]
+            c_db.repack()
+            stored = c_db.active.size + c_db.chunk_db.active.size
+        assert c_db[c1] == v1 and c_db[c2] == v2
+        assert stored < 1.2 * len(v1)
+    data_store.close()
+
+    return "PASS"
+
+
+def test_prefix_index(directory):
+    """
+    Test an fs_based data store with a prefix index on an empty directory.
+    """
+    from gentle_tp_da92 import fs_based
+
+    data_store = fs_based.GentleDataStore(directory, mkdir=True, index=True)
+    for db in (data_store.content_db, data_store.pointer_db):
+        db.index.wait()
+    test(data_store)
+
+    # The index must agree with the directory:
+    for db in (data_store.content_db, data_store.pointer_db):
+        for partial in ("", "0", "ab", "f00"):
+            found = db.index.find(partial)
+            assert found is not None
+            assert sorted(found) == sorted(db._glob_find(partial))
+            assert list(db.index.iterfind(partial)) == sorted(found)
+
+    # Entering existing content leaves the directory, and the index, alone:
+    data_store.content_db.add_stream(StringIO("Streamed"))
+    mtime = data_store.content_db._stamp()
+    data_store.content_db.add_stream(StringIO("Streamed"))
+    assert data_store.content_db._stamp() == mtime
+
+    # Overwriting a pointer changes the directory, but needs no rebuild:
+    p_db = data_store.pointer_db
+    p = utilities.random()
+    p_db[p] = data_store.content_db + "Version 1"
+    p_db.index._last_check = 0
+    assert p_db.index.find(p) == [p]
+    p_db[p] = data_store.content_db + "Version 2"
+    p_db.index._last_check = 0
+    assert p_db.index.find(p) == [p] and p_db.index._thread is None
+
+    # Reopening loads the index and notices changes made behind its back:
+    c = data_store.content_db + "Indexed"
+    other = fs_based.GentleDataStore(directory, index=True)
+    assert other.content_db.index.find(c) == [c]
+    open(os.path.join(directory, "content_db", "0" * 64), "wb").close()
+    other.content_db.index.rebuild()
+    other.content_db.index.wait()
+    assert other.content_db.find("0" * 64) == ["0" * 64]
+
+    # Merging the journal keeps the changes other processes journaled since
+    # the merging process last read it (here, other index objects):
+    from gentle_tp_da92 import prefix_index
+    def open_index():
+        index = prefix_index.PrefixIndex(os.path.join(directory, "index"),
+                                         scan=lambda: [], stamp=lambda: 0)
+        index.wait()
+        return index
+    a, b = open_index(), open_index()
+    a.add("1" * 64)
+    b.add("2" * 64)
+    a._start(scan=False)
+    a.wait()
+    b.add("3" * 64)
+    expected = ["1" * 64, "2" * 64, "3" * 64]
+    assert sorted(b.find()) == expected
+    assert sorted(open_index().find()) == expected
+
+    return "PASS"
+
+
+def test_pack_based(directory):
+    """
+    Test sealing, deleting and repacking in a pack_based data store on an empty
+    directory.
+    """
+    from gentle_tp_da92 import pack_based
+
+    data_store = pack_based.GentleDataStore(directory, mkdir=True,
+                                            max_pack_size=4096)
+    c_db = data_store.content_db
+    contents = dict((c_db + os.urandom(i * 10), i) for i in range(100))
+    assert len(c_db.packs) > 1
+    deleted = [c for c in contents if contents[c] % 3 == 0]
+    for c in deleted:
+        del c_db[c]
+        assert c not in c_db
+    c_db + os.urandom(5)  # the active pack must be usable after repacking
+    data_store.close()
+
+    data_store = pack_based.GentleDataStore(directory, max_pack_size=4096)
+    c_db = data_store.content_db
+    for c in deleted:
+        assert c not in c_db
+    c_db.repack()
+    assert not c_db.deleted
+    data_store.close()
+
+    data_store = pack_based.GentleDataStore(directory, max_pack_size=4096)
+    c_db = data_store.content_db
+    live = [c for c in contents if c not in deleted]
+    assert sorted(c for c in c_db.find() if c in contents) == sorted(live)
+    for c in live:
+        assert sha256(c_db[c]).hexdigest() == c
+    data_store.close()
+
+    return "PASS"
+
+
+def test_log_based(directory):
+    """
+    Test sealing, compacting and reloading of a log_based pointer database on
+    an empty directory.
+    """
+    from gentle_tp_da92 import log_based
+
+    def open_db():
+        return log_based._GentlePointerDB(directory, mkdir=True,
+                                          max_segment_size=2000,
+                                          compact_threshold=3)
+
+    p_db = open_db()
+    pointers = {}
+    for i in range(300):
+        p = utilities.random()
+        p_db[p] = pointers[p] = utilities.random()
+        if i % 4 == 0:
+            del p_db[p], pointers[p]
+        if i % 7 == 3:
+            p = random.choice(pointers.keys())
+            p_db[p] = pointers[p] = utilities.random()
+    p_db.wait()
+    p_db.compact()
+    assert len(p_db.sealed) == 1
+    p_db.close()
+
+    p_db = open_db()
+    assert p_db.keydir == pointers
+    p_db.close()
+
+    return "PASS"
+
+
+def test_sqlite_based(directory):
+    """
+    Test batches and concurrent access of an sqlite_based data store on an
+    empty directory.
+    """
+    from gentle_tp_da92 import sqlite_based
+
+    data_store = sqlite_based.GentleDataStore(directory, mkdir=True)
+    reader = sqlite_based.GentleDataStore(directory)
+    with data_store.batch():
+        contents = [data_store.content_db + str(i) for i in range(100)]
+        with data_store.batch():  # nested batches belong to the outer one
+            data_store.pointer_db[utilities.random()] = contents[0]
+        assert reader.content_db.find() == []
+    assert sorted(reader.content_db.find()) == sorted(contents)
+    assert len(reader.pointer_db.find()) == 1
+
+    try:
+        with data_store.batch():
+            data_store.content_db + "Rolled back"
+            raise ValueError
+    except ValueError:
+        pass
+    assert len(reader.content_db.find()) == 100
+
+    return "PASS"
+
+
+def test_caching_wrapper(directory):
+    """
+    Test the hit and miss counting of caching_wrapper over an fs_based data
+    store on an empty directory.
+    """
+    from gentle_tp_da92 import caching_wrapper, fs_based
+
+    data_store = caching_wrapper.GentleDataStore(
+        fs_based.GentleDataStore(directory, mkdir=True), max_content_bytes=10)
+    c_db = data_store.content_db
+    p_db = data_store.pointer_db
+    c = c_db + "Cached"
+    assert c_db[c] == "Cached"
+    big = c_db + "Too big to be cached"
+    assert c_db[big] == "Too big to be cached"
+    p = utilities.random()
+    assert p not in p_db
+    assert p not in p_db
+    p_db[p] = c
+    assert p in p_db
+    assert p_db[p] == c
+    stats = data_store.stats()
+    assert stats["content"]["hits"] == 1 and stats["content"]["misses"] == 1
+    assert stats["content"]["cached"] == 1 and stats["content"]["cached_size"] == 6
+    assert stats["pointer"]["negative_hits"] == 1
+    assert stats["pointer"]["hits"] == 2 and stats["pointer"]["misses"] == 1
+
+    # Changes behind the back of the wrapper are noticed once entries expire:
+    other = fs_based.GentleDataStore(directory)
+    data_store.pointer_db.pointer_ttl = 0
+    p_db[p] = c
+    assert p_db[p] == c
+    other.pointer_db[p] = big
+    assert p_db[p] == big
+
+    return "PASS"
+
+
+def test_metrics_wrapper(directory):
+    """
+    Test the metrics recorded by metrics_wrapper over an fs_based data store
+    on an empty directory.
+    """
+    from gentle_tp_da92 import fs_based, metrics_wrapper
+
+    data_store = metrics_wrapper.GentleDataStore(
+        fs_based.GentleDataStore(directory, mkdir=True))
+    c_db = data_store.content_db
+    p_db = data_store.pointer_db
+    cs = [c_db + str(i) * 10 for i in range(100)]
+    p = utilities.random()
+    p_db[p] = cs[0]
+    try:
+        c_db[p]
+    except (IOError, OSError, KeyError):
+        pass
+    snapshot = data_store.snapshot()
+    add = snapshot["content"]["add"]
+    assert add["count"] == 100 and add["errors"] == 0
+    assert add["bytes_in"] == sum(len(str(i) * 10) for i in range(100))
+    assert add["bytes_out"] == 100 * 64
+    assert 0 < add["p50"] <= add["p95"] <= add["p99"] <= add["latency_max"]
+    assert snapshot["content"]["get"]["errors"] == 1
+    assert snapshot["pointer"]["set"]["bytes_in"] == 128
+    text = data_store.prometheus_text()
+    assert 'gentle_operations_total{db="content",operation="add"} 100\n' in text
+    assert 'gentle_operation_duration_seconds_count{db="pointer",operation="set"} 1\n' in text
+    data_store.reset()
+    assert data_store.snapshot() == {"content": {}, "pointer": {}}
+
+    return "PASS"
+
+
+def test_tiered(directory):
+    """
+    Test promotion, demotion and write-back spilling of tiered.
+    """
+    from gentle_tp_da92 import fs_based, memory_based, pack_based, tiered
+
+    cold = fs_based.GentleDataStore(directory)
+    data_store = tiered.GentleDataStore(cold, max_hot_bytes=1000, write_back=True)
+    c_db = data_store.content_db
+    p_db = data_store.pointer_db
+    cs = [c_db + ("%03u" % i) * 100 for i in range(5)]
+    # Only the last three fit, the first two were spilled when demoted:
+    assert [c in cold.content_db for c in cs] == [True, True, False, False, False]
+    assert data_store.stats()["dirty"] == 3
+    assert sorted(c_db.find()) == sorted(cs)
+    p = utilities.random()
+    p_db[p] = cs[2]
+    assert cs[2] in cold.content_db and cold.pointer_db[p] == cs[2]
+    assert c_db[cs[0]] == "000" * 100  # promoted, demoting cs[2]
+    stats = data_store.stats()
+    assert stats["promotions"] == 1 and stats["demotions"] == 3
+    assert stats["spills"] == 3 and stats["hot_bytes"] == 900
+    assert c_db[cs[4]] and data_store.stats()["hits"] == 1
+    del c_db[cs[3]]  # never reached the cold tier
+    assert cs[3] not in c_db and cs[3] not in cold.content_db
+    data_store.flush()
+    assert [c in cold.content_db for c in cs] == [True, True, True, False, True]
+    # Content larger than the hot tier goes straight to the cold tier:
+    c = c_db + "x" * 2000
+    assert c in cold.content_db and data_store.stats()["hot_bytes"] == 600
+
+    # Content whose spilling fails stays in the hot tier, and dirty:
+    cold = memory_based.GentleDataStore()
+    data_store = tiered.GentleDataStore(cold, max_hot_bytes=1000, write_back=True)
+    c_db = data_store.content_db
+    add_many = cold.content_db.add_many
+    def failing_add_many(byte_strings):
+        raise IOError("injected failure")
+    cold.content_db.add_many = failing_add_many
+    cs = [c_db + ("%03u" % i) * 100 for i in range(3)]
+    for byte_strings in (["x" * 500], ["y" * 2000]):
+        try:
+            c_db.add_many(byte_strings)
+        except IOError:
+            pass
+        else:
+            assert False, "spilling did not fail"
+    assert c_db[cs[0]] == "000" * 100 and data_store.stats()["dirty"] == 4
+    try:
+        data_store.flush()
+    except IOError:
+        pass
+    else:
+        assert False, "flushing did not fail"
+    cold.content_db.add_many = add_many
+    data_store.flush()
+    assert all(c in cold.content_db for c in cs)
+    assert data_store.stats()["dirty"] == 0
+
+    # Deleting content added again after it reached the cold tier:
+    cold = pack_based.GentleDataStore(os.path.join(directory, "pack_based"),
+                                      mkdir=True)
+    c = cold.content_db + "again"
+    data_store = tiered.GentleDataStore(cold, write_back=True)
+    assert data_store.content_db + "again" == c
+    del data_store.content_db[c]
+    assert c not in data_store.content_db and c not in cold.content_db
+    cold.close()
+
+    return "PASS"
+
+
+def test_tracing_wrapper(directory):
+    """
+    Test recording a trace of test() and replaying it, in an empty directory.
+    """
+    from gentle_tp_da92 import (fs_based, memory_based, tracing_wrapper)
+
+    tracefile = os.path.join(directory, "test.trace")
+    data_store = tracing_wrapper.GentleDataStore(memory_based.GentleDataStore(),
+                                                 tracefile)
+    test(data_store)
+    data_store.close()
+    records = list(tracing_wrapper.read_trace(tracefile))
+    assert records[0].operation == "find" and records[0].kind == "c"
+    assert any(r.operation == "get_many" and r.offset > 1 for r in records)
+
+    for target in (memory_based.GentleDataStore(),
+                   fs_based.GentleDataStore(os.path.join(directory, "replay"),
+                                            mkdir=True)):
+        report = tracing_wrapper.replay(tracefile, target)
+        assert report["errors"] > 0  # test() provokes some on purpose
+        assert report["unexpected_errors"] == 0
+        assert report["metrics"]["content"]["add"]["count"] == \
+            sum(1 for r in records if r.operation == "add")
+        assert sorted(target.pointer_db.find()) == \
+            sorted(data_store.data_store.pointer_db.find())
+
+    # The records of batch operations traced by several threads at once stay
+    # together:
+    tracefile = os.path.join(directory, "threads.trace")
+    data_store = tracing_wrapper.GentleDataStore(memory_based.GentleDataStore(),
+                                                 tracefile)
+    batches = [data_store.content_db.add_many(str((t, i)) for i in range(50))
+               for t in range(4)]
+    def get_batches(batch):
+        for i in range(25):
+            data_store.content_db.get_many(batch)
+    threads = [threading.Thread(target=get_batches, args=(batch,))
+               for batch in batches]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    data_store.close()
+    records = [r for r in tracing_wrapper.read_trace(tracefile)
+               if r.operation == "get_many"]
+    for start in range(0, len(records), 50):
+        assert records[start].offset == 50
+        assert [r.identifier for r in records[start:start + 50]] in batches
+    report = tracing_wrapper.replay(tracefile, memory_based.GentleDataStore())
+    assert report["operations"] == 4 + 4 * 25 and report["errors"] == 0
+
+    return "PASS"
+
+
+def test_memory_based_index(directory):
+    """
+    Test the sorted identifier index of memory_based against brute force.
+    """
+    from gentle_tp_da92 import memory_based
+
+    data_store = memory_based.GentleDataStore()
+    p_db = data_store.pointer_db
+    c = data_store.content_db + "content"
+    ps = [utilities.random() for i in range(2000)]
+    for i, p in enumerate(ps):
+        p_db[p] = c
+        if i % 3 == 0:
+            del p_db[ps[i // 2]]
+            p_db.find("0")  # merges the identifiers added so far
+    p_db.set_many((p, c) for p in ps[:100])
+    assert sorted(p_db.db) == p_db.find() == list(p_db.iterfind())
+    for prefix in ("", "a", "5c", "f00", ps[1500][:5], ps[1500]):
+        assert p_db.find(prefix) == sorted(p for p in p_db.db if p.startswith(prefix))
+    found = p_db.find("7")
+    assert list(p_db.iterfind("7", 10, found[4])) == found[5:15]
+
+    # Interleaved changes and searches, merged every MERGE_THRESHOLD changes:
+    previous = memory_based.MERGE_THRESHOLD
+    memory_based.MERGE_THRESHOLD = 50
+    try:
+        for i, p in enumerate(ps):
+            if i % 2 and p in p_db:
+                del p_db[p]
+            else:
+                p_db[ps[i // 2]] = c
+            if i % 7 == 0:
+                prefix = p[0]
+                expected = sorted(q for q in p_db.db if q.startswith(prefix))
+                assert p_db.find(prefix) == expected
+                assert list(p_db.iterfind(prefix, 3, prefix)) == expected[:3]
+                assert len(p_db._recent) + len(p_db._removed) <= 50
+        assert p_db.find() == sorted(p_db.db)
+    finally:
+        memory_based.MERGE_THRESHOLD = previous
+
+    return "PASS"
+
+
+def test_memory_based_snapshot(directory):
+    """
+    Test saving memory_based data stores to snapshot files in an empty
+    directory, and loading them.
+    """
+    from gentle_tp_da92 import memory_based
+
+    filename = os.path.join(directory, "snapshot")
+    data_store = memory_based.GentleDataStore()
+    test(data_store)
+    cs = data_store.content_db.add_many(str(i) * i for i in range(300))
+    ps = data_store.pointer_db.set_many((utilities.random(), c) for c in cs)
+    data_store.save(filename)
+    assert os.stat(filename).st_mode & 0777 == 0600  # owner only, like mkstemp()
+    loaded = memory_based.GentleDataStore.load(filename)
+    assert not loaded.content_db.db and not loaded.pointer_db.db
+    for db in ("content_db", "pointer_db"):
+        original, db = getattr(data_store, db), getattr(loaded, db)
+        identifiers = original.find()
+        assert db.find() == identifiers and db.find("3") == original.find("3")
+        assert db.get_many(identifiers) == original.get_many(identifiers)
+        assert list(db.iterfind("", 10, identifiers[5])) == identifiers[6:16]
+    assert str(loaded.content_db.read_range(cs[20], 2, 4)) == "2020"
+    try:
+        loaded.pointer_db[cs[0]]
+    except KeyError:
+        pass
+    else:
+        assert False, "content identifier found in the pointer database"
+
+    # Changes are layered over the snapshot, and saved with it:
+    c = loaded.content_db + "new content"
+    loaded.pointer_db[ps[0]] = c
+    del loaded.pointer_db[ps[1]]
+    assert loaded.pointer_db.find(ps[0]) == [ps[0]] and ps[1] not in loaded.pointer_db
+    filename2 = os.path.join(directory, "snapshot2")
+    loaded.save(filename2)
+    loaded.save(filename)  # replaces the file memory-mapped by loaded
+    for filename in (filename, filename2):
+        reloaded = memory_based.GentleDataStore.load(filename)
+        assert reloaded.content_db[reloaded.pointer_db[ps[0]]] == "new content"
+        assert ps[1] not in reloaded.pointer_db and ps[2] in reloaded.pointer_db
+        assert reloaded.pointer_db.find() == loaded.pointer_db.find()
+    with open(filename, "r+b") as f:
+        f.truncate(100)
+    try:
+        memory_based.GentleDataStore.load(filename)
+    except utilities.GentleException:
+        pass
+    else:
+        assert False, "truncated snapshot loaded"
+
+    return "PASS"
+
+
+def test_compact_memory_based(directory):
+    """
+    Test the arenas and the key table of compact_memory_based.
+    """
+    from gentle_tp_da92 import compact_memory_based
+
+    data_store = compact_memory_based.GentleDataStore()
+    c_db = data_store.content_db
+    p_db = data_store.pointer_db
+    large = "x" * compact_memory_based.LARGE_VALUE_SIZE
+    cs = [c_db + str(i) for i in range(5000)] + [c_db + large]
+    assert len(c_db._arenas) == 1 and len(c_db._large) == 1
+    assert c_db[cs[-1]] == large and str(c_db.read_range(cs[-1], 10, 5)) == "xxxxx"
+    assert str(c_db.read_range(cs[1234], 1, 100)) == "234"
+    ps = [utilities.random() for c in cs]
+    p_db.set_many(zip(ps, cs))
+    for c in cs[:2500] + cs[-1:]:
+        del c_db[c]
+    for p in ps[::2]:
+        del p_db[p]
+    assert sorted(c_db.find()) == sorted(cs[2500:-1])
+    assert sorted(p_db.find()) == sorted(ps[1::2])
+    assert not c_db._large and len(c_db._table._free) == 2501
+    # Deleted entries are reused:
+    cs2 = [c_db + ("new %u" % i) for i in range(3000)]
+    assert len(c_db._table.keys) == 5500 * compact_memory_based.KEY_SIZE
+    assert c_db.get_many(cs2[:2]) == ["new 0", "new 1"]
+    assert [c in c_db for c in cs[2499:2501]] == [False, True]
+    assert p_db[ps[1]] == cs[1]
+
+    return "PASS"
+
+
+def _shared_memory_writer(filename, count):
+    from gentle_tp_da92 import shared_memory_based
+
+    data_store = shared_memory_based.GentleDataStore(filename)
+    for i in range(count):
+        p = sha256("pointer %u" % i).hexdigest()
+        data_store.pointer_db[p] = data_store.content_db + ("content %u" % i)
+    data_store.close()
+
+def _shared_memory_killed_writer(filename):
+    from gentle_tp_da92 import shared_memory_based
+
+    data_store = shared_memory_based.GentleDataStore(filename)
+    with data_store.store.write():
+        os._exit(1)  # as if killed while writing
+
+def test_shared_memory_based(directory):
+    """
+    Test sharing a shared_memory_based data store between processes, and
+    its capacity limits.
+    """
+    import multiprocessing
+    from gentle_tp_da92 import shared_memory_based
+
+    filename = os.path.join(directory, "store")
+    data_store = shared_memory_based.GentleDataStore(
+        filename, content_slots=4096, pointer_slots=4096, arena_size=65536)
+    c_db = data_store.content_db
+    p_db = data_store.pointer_db
+    writers = [multiprocessing.Process(target=_shared_memory_writer,
+                                       args=(filename, 1000))
+               for i in range(2)]
+    for writer in writers:
+        writer.start()
+    # Read while the writers write:
+    seen = 0
+    while seen < 1000:
+        p = sha256("pointer %u" % seen).hexdigest()
+        if p in p_db:
+            assert c_db[p_db[p]] == "content %u" % seen
+            seen += 1
+    for writer in writers:
+        writer.join()
+        assert writer.exitcode == 0
+    assert len(c_db.find()) == len(p_db.find()) == 1000
+    assert data_store.store.content_count == data_store.store.pointer_count == 1000
+    assert str(c_db.read_range(c_db + "content 999", 8, 10)) == "999"
+    del p_db[p]
+    p_db[p] = c_db + "again"
+    assert data_store.store.pointer_used == 1000 and len(p_db.find()) == 1000
+
+    # Reopening uses the stored capacity:
+    data_store.close()
+    data_store = shared_memory_based.GentleDataStore(filename)
+    assert data_store.store.content_slots == 4096
+    assert data_store.pointer_db[p] == sha256("again").hexdigest()
+    try:
+        data_store.content_db + "x" * 65536
+    except utilities.GentleException:
+        pass
+    else:
+        assert False, "arena overflow not detected"
+
+    # Readers and the next writer recover from a writer killed while writing:
+    for recover in ("reader", "writer"):
+        writer = multiprocessing.Process(target=_shared_memory_killed_writer,
+                                         args=(filename,))
+        writer.start()
+        writer.join()
+        assert writer.exitcode == 1
+        assert data_store.store._field(1) & 1
+        if recover == "reader":
+            assert data_store.content_db[sha256("again").hexdigest()] == "again"
+        else:
+            data_store.content_db + "recovered"
+        assert not data_store.store._field(1) & 1
+    assert data_store.content_db[sha256("recovered").hexdigest()] == "recovered"
+    data_store.close()
+
+    return "PASS"
+
+
+def test_bulk(directory):
+    """
+    Test parallel hashing and windowed bulk entry of content.
+    """
+    from gentle_tp_da92 import bulk, memory_based
+
+    contents = ["small %u" % i for i in range(10)] + \
+               [("large %u" % i) * 10000 for i in range(40)]
+    random.shuffle(contents)
+    expected = [sha256(c).hexdigest() for c in contents]
+    previous = bulk.get_hash_threads()
+    try:
+        for threads in (1, 4):
+            bulk.set_hash_threads(threads)
+            assert bulk.sha256_many(contents) == expected
+    finally:
+        bulk.set_hash_threads(previous)
+
+    data_store = memory_based.GentleDataStore()
+    c_db = data_store.content_db
+    windows = []
+    add_many = c_db.add_many
+    c_db.add_many = lambda byte_strings: windows.append(
+        sum(len(b) for b in byte_strings)) or add_many(byte_strings)
+    identifiers = list(bulk.add_iter(c_db, iter(contents), window_bytes=100000))
+    # A window is closed by the byte string that fills it:
+    assert identifiers == expected and len(windows) > 10
+    assert max(windows) < 100000 + max(len(c) for c in contents)
+    del c_db.add_many
+
+    filenames = []
+    for i, content in enumerate(contents[:20]):
+        filenames.append(os.path.join(directory, str(i)))
+        with open(filenames[-1], "wb") as f:
+            f.write(content)
+    added = list(bulk.add_files(c_db, filenames, window_bytes=80000, threads=3))
+    assert added == zip(filenames, expected[:20])
+
+    return "PASS"
+
+
+def test_benchmarks(directory):
+    """
+    Test small runs of the speed and memory benchmarks, and comparing their
+    results.
+    """
+    from gentle_tp_da92 import benchmarks, json
+    from gentle_tp_da92.benchmarks import memory
+
+    results = benchmarks.run(["memory_based", "fs_based"], size=20, repeat=1)
+    results = json.loads(json.dumps(results))  # as if saved and loaded
+    assert sorted(results["results"]["fs_based"]) == sorted(benchmarks.BENCHMARKS)
+    get = results["results"]["memory_based"]["get"]
+    assert get["operations"] == 20 and get["operations_per_second"] > 0
+    changes, regressions = benchmarks.compare(results, results)
+    assert len(changes) == 2 * len(benchmarks.BENCHMARKS) and not regressions
+    slower = json.loads(json.dumps(results))
+    get = slower["results"]["memory_based"]["get"]
+    get["operations_per_second"] /= 2
+    changes, regressions = benchmarks.compare(results, slower)
+    assert [r[:2] for r in regressions] == [("memory_based", "get")]
+
+    results = memory.run(count=100)
+    footprint = results["results"]["memory_based"]["memory"]
+    assert [g["objects"] for g in footprint["growth"]] == [12, 25, 50, 100]
+    assert footprint["bytes_per_object"] > footprint["content_bytes_per_object"]
+    bigger = json.loads(json.dumps(results))
+    bigger["results"]["prefix_index"]["memory"]["bytes_per_object"] *= 2
+    changes, regressions = benchmarks.compare(results, bigger)
+    assert [r[:2] for r in regressions] == [("prefix_index", "memory")]
+    # Values missing from either result are not compared:
+    del bigger["results"]["prefix_index"]["memory"]["bytes_per_object"]
+    assert not benchmarks.compare(results, bigger)[1]
+    assert not benchmarks.compare(bigger, results)[1]
+
+    return "PASS"
+
+
+def test_dataset(directory):
+    """
+    Test generating a synthetic dataset into fs_based and memory_based data
+    stores, in an empty directory.
+    """
+    from gentle_tp_da92 import fs_based, json, memory_based
+    from gentle_tp_da92.benchmarks import dataset
+
+    data_store = fs_based.GentleDataStore(directory, mkdir=True)
+    report = dataset.generate(data_store, contents=500, pointers=40,
+                              documents=30, versions=3, size=200,
+                              batch_size=100)
+    assert report["pointers"] == 40 and report["objects"] > 570
+    assert len(data_store.pointer_db.find()) == 40
+    for p in data_store.pointer_db.find():
+        versions = list(dataset.iter_versions(data_store, p))
+        assert 1 <= len(versions) <= 5
+        assert versions == sorted(versions, key=lambda v: v["timestamp"],
+                                  reverse=True)
+    contents = data_store.content_db.get_many(data_store.content_db.find())
+    documents = [json.loads(c) for c in contents
+                 if c.startswith("{") and '"title":' in c]
+    assert len(documents) == 30
+    for document in documents:
+        for key, value in document.iteritems():
+            if key.endswith(":content"):
+                assert value in data_store.content_db
+            if key.endswith(":pointer"):
+                assert value in data_store.pointer_db
+
+    # The same parameters always produce the same data store:
+    memory_stores = [memory_based.GentleDataStore() for i in range(2)]
+    for threads, memory_store in zip((1, 4), memory_stores):
+        dataset.generate(memory_store, contents=500, pointers=40,
+                         documents=30, versions=3, size=200, batch_size=100,
+                         threads=threads)
+    assert memory_stores[0].content_db.db == memory_stores[1].content_db.db
+    assert memory_stores[0].pointer_db.db == memory_stores[1].pointer_db.db
+    assert sorted(memory_stores[0].content_db.db) == \
+        sorted(data_store.content_db.find())
+
     return "PASS"
 
 
@@ -136,35 +1116,95 @@ def test_all():
     import shutil
     import tempfile
     from gentle_tp_da92 import (Gentle,
+                                compact_memory_based,
                                 fs_based,
                                 memory_based,
-                                debugging_wrapper)
+                                pack_based,
+                                shared_memory_based,
+                                sqlite_based,
+                                caching_wrapper,
+                                debugging_wrapper,
+                                metrics_wrapper,
+                                tiered)
 
     nullwriter = type("", (), {})()
     nullwriter.write = lambda *a, **k: None
 
+    temp_dirs = []
+    def mkdtemp():
+        temp_dirs.append(tempfile.mkdtemp())
+        return temp_dirs[-1]
+
     data_stores = [
         (None, Gentle(memory_based)),
+        (None, Gentle(compact_memory_based)),
         ("Wrapped memory_based", Gentle(debugging_wrapper, Gentle(memory_based), nullwriter)),
-        (None, Gentle(fs_based, tempfile.mkdtemp())),
-        ("Wrapped fs_based", Gentle(debugging_wrapper, Gentle(fs_based, tempfile.mkdtemp()), nullwriter)),
+        (None, Gentle(fs_based, mkdtemp())),
+        ("Wrapped fs_based", Gentle(debugging_wrapper, Gentle(fs_based, mkdtemp()), nullwriter)),
+        ("Cached fs_based", Gentle(caching_wrapper, Gentle(fs_based, mkdtemp()),
+                                   max_content_bytes=100000, pointer_ttl=None)),
+        ("Tiered fs_based", Gentle(tiered, Gentle(fs_based, mkdtemp()), max_hot_bytes=1000)),
+        ("Tiered fs_based with write-back", Gentle(tiered, Gentle(fs_based, mkdtemp()),
+                                                   max_hot_bytes=1000, write_back=True)),
+        ("Metered memory_based", Gentle(metrics_wrapper, Gentle(memory_based))),
+        ("fs_based with layout 2/2", Gentle(fs_based, mkdtemp(), layout="2/2")),
+        ("fs_based with pointer_log", Gentle(fs_based, mkdtemp(), pointer_log=True)),
+        ("fs_based with batched durability", Gentle(fs_based, mkdtemp(), layout="2",
+                                                    durability="batched")),
+        ("fs_based with Bloom filter", Gentle(fs_based, mkdtemp(), layout="2", bloom=True)),
+        ("fs_based with per-op durability", Gentle(fs_based, mkdtemp(), durability="per-op")),
+        ("fs_based with compression", Gentle(fs_based, mkdtemp(), compression="zlib")),
+        (None, Gentle(pack_based, mkdtemp())),
+        ("pack_based with small packs", Gentle(pack_based, mkdtemp(), max_pack_size=8192)),
+        ("pack_based with compression", Gentle(pack_based, mkdtemp(), compression="bz2")),
+        (None, Gentle(sqlite_based, mkdtemp())),
+        (None, Gentle(shared_memory_based, os.path.join(mkdtemp(), "store"),
+                      content_slots=1024, pointer_slots=1024, arena_size=1024 * 1024)),
         ]
 
-    for name, data_store in data_stores:
-        if name is None: name = data_store.ds
-        print("Testing %s:" % name)
-        try:
-            print(test(data_store))
-        except:
-            traceback.print_exc()
-            pdb.post_mortem()
-        finally:
-            if isinstance(data_store.ds, fs_based.GentleDataStore):
-                shutil.rmtree(data_store.ds.directory)
-            elif isinstance(data_store.ds, debugging_wrapper.GentleDataStore):
-                if isinstance(data_store.ds.data_store.ds, fs_based.GentleDataStore):
-                    shutil.rmtree(data_store.ds.data_store.ds.directory)
-        print()
+    try:
+        for name, data_store in data_stores:
+            if name is None: name = data_store.ds
+            print("Testing %s:" % name)
+            try:
+                print(test(data_store))
+            except:
+                traceback.print_exc()
+                pdb.post_mortem()
+            print()
+
+        for name, test_function in (
+                ("fs_based layout migration", test_migrate_layout),
+                ("fs_based durability", test_fs_based_durability),
+                ("fs_based Bloom filter", test_bloom_filter),
+                ("fs_based and pack_based compression", test_compression),
+                ("fs_based and pack_based chunking", test_chunking),
+                ("fs_based with prefix index", test_prefix_index),
+                ("pack_based sealing and repacking", test_pack_based),
+                ("log_based sealing and compaction", test_log_based),
+                ("sqlite_based batches", test_sqlite_based),
+                ("caching_wrapper statistics", test_caching_wrapper),
+                ("metrics_wrapper metrics", test_metrics_wrapper),
+                ("tiered spilling and promotion", test_tiered),
+                ("tracing_wrapper recording and replay", test_tracing_wrapper),
+                ("memory_based index", test_memory_based_index),
+                ("memory_based snapshots", test_memory_based_snapshot),
+                ("compact_memory_based arenas and key table", test_compact_memory_based),
+                ("shared_memory_based between processes", test_shared_memory_based),
+                ("bulk content entry", test_bulk),
+                ("benchmarks", test_benchmarks),
+                ("benchmarks dataset generator", test_dataset),
+                ):
+            print("Testing %s:" % name)
+            try:
+                print(test_function(mkdtemp()))
+            except:
+                traceback.print_exc()
+                pdb.post_mortem()
+            print()
+    finally:
+        for directory in temp_dirs:
+            shutil.rmtree(directory)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Tiered Data Store Module.
+
+Composes a bounded in-memory hot tier with a durable cold tier (fs_based,
+pack_based or any other data store):
+
+  - Content read from the cold tier is promoted into the hot tier.  When the
+    content in the hot tier exceeds max_hot_bytes, the least recently used
+    content is demoted (dropped from the hot tier).
+  - New content is written to both tiers.  With write_back=True, it is only
+    written to the hot tier, and spilled to the cold tier when it is demoted,
+    when a pointer is set to it, or on flush().  Content whose spilling fails
+    stays in the hot tier until the next attempt.
+  - Pointers are mutable and small, so they always go to the cold tier.
+
+Usage example:
+>>> from gentle_tp_da92 import tiered, fs_based
+>>> data_store = tiered.GentleDataStore(fs_based.GentleDataStore(d))
+>>> data_store.stats()["hot_bytes"]
+0
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from   collections import OrderedDict
+from   hashlib import sha256
+from   io import BytesIO
+import threading
+
+from   . import data_store_interfaces
+from   .utilities import *
+
+
+DEFAULT_MAX_HOT_BYTES = 64 * 1024 * 1024
+
+
+class _GentleContentDB(data_store_interfaces._GentleContentDB):
+
+    def __init__(self, cold_db, max_hot_bytes, write_back):
+        super(_GentleContentDB, self).__init__()
+        self.cold_db = cold_db
+        self.max_hot_bytes = max_hot_bytes
+        self.write_back = write_back
+        self._lock = threading.Lock()
+        self._hot_items = OrderedDict()  # identifier -> content, LRU first
+        self._dirty = set()  # hot identifiers not yet in the cold tier
+        # Dirty content demoted, and being written to the cold tier:
+        self._spilling = {}  # identifier -> content
+        self.hot_bytes = 0
+        self.stats = dict(hits=0, misses=0, promotions=0, demotions=0, spills=0)
+
+    ## HOT TIER, CALL WITH self._lock HELD ##
+
+    def _touch(self, identifier):
+        self._hot_items[identifier] = self._hot_items.pop(identifier)
+
+    def _insert(self, identifier, byte_string, dirty):
+        """
+        Insert content into the hot tier, and return the list of
+        (identifier, content) pairs to pass to self._spill().
+        """
+        if identifier in self._hot_items:
+            self._touch(identifier)
+            return []
+        if identifier in self._spilling:
+            return []
+        if len(byte_string) > self.max_hot_bytes:
+            if not dirty:
+                return []
+            # Straight to the cold tier:
+            self._dirty.add(identifier)
+            self._spilling[identifier] = byte_string
+            return [(identifier, byte_string)]
+        self._hot_items[identifier] = byte_string
+        self.hot_bytes += len(byte_string)
+        if dirty:
+            self._dirty.add(identifier)
+        return self._demote()
+
+    def _demote(self):
+        spills = []
+        while self.hot_bytes > self.max_hot_bytes:
+            identifier, content = self._hot_items.popitem(last=False)
+            self.hot_bytes -= len(content)
+            self.stats["demotions"] += 1
+            if identifier in self._dirty:
+                # Still readable until it has reached the cold tier:
+                self._spilling[identifier] = content
+                spills.append((identifier, content))
+        return spills
+
+    def _hot(self, identifier):
+        """
+        Return the content of identifier from the hot tier, or None.
+        """
+        content = self._hot_items.get(identifier)
+        if content is None:
+            content = self._spilling.get(identifier)
+            if content is None:
+                self.stats["misses"] += 1
+                return None
+        else:
+            self._touch(identifier)
+        self.stats["hits"] += 1
+        return content
+
+    ## COLD TIER, CALL WITHOUT self._lock HELD ##
+
+    def _spill(self, spills):
+        """
+        Write the (identifier, content) pairs returned by self._insert() to
+        the cold tier.  If that fails, the content goes back into the hot
+        tier, still dirty (except content too large for it, whose adding
+        fails).
+        """
+        if not spills: return
+        try:
+            self.cold_db.add_many([content for _, content in spills])
+        except:
+            with self._lock:
+                for identifier, content in spills:
+                    if self._spilling.pop(identifier, None) is None: continue
+                    if len(content) > self.max_hot_bytes:
+                        self._dirty.discard(identifier)
+                    else:
+                        self._hot_items[identifier] = content
+                        self.hot_bytes += len(content)
+            raise
+        deleted = []
+        with self._lock:
+            for identifier, content in spills:
+                if self._spilling.pop(identifier, None) is None:
+                    deleted.append(identifier)
+                    continue
+                self._dirty.discard(identifier)
+                if len(content) <= self.max_hot_bytes:
+                    self.stats["spills"] += 1
+        # Deleted while being written:
+        for identifier in deleted:
+            del self.cold_db[identifier]
+
+    ## CONTENT DB ##
+
+    def __getitem__(self, identifier):
+        validate_identifier_format(identifier)
+        with self._lock:
+            content = self._hot(identifier)
+        if content is None:
+            content = self.cold_db[identifier]
+            with self._lock:
+                spills = self._insert(identifier, content, False)
+                self.stats["promotions"] += 1
+            self._spill(spills)
+        return content
+
+    def get_many(self, identifiers):
+        return [self[identifier] for identifier in identifiers]
+
+    def find(self, partial_identifier=""):
+        with self._lock:
+            dirty = [i for i in self._dirty if i.startswith(partial_identifier)]
+        return list(set(self.cold_db.find(partial_identifier)).union(dirty))
+
+    def __contains__(self, identifier):
+        validate_identifier_format(identifier)
+        with self._lock:
+            if identifier in self._hot_items or identifier in self._spilling:
+                return True
+        return identifier in self.cold_db
+
+    def contains_many(self, identifiers):
+        return [identifier in self for identifier in identifiers]
+
+    def __add__(self, byte_string):
+        return self.add_many([byte_string])[0]
+
+    def add_many(self, byte_strings):
+        byte_strings = list(byte_strings)
+        if not self.write_back:
+            self.cold_db.add_many(byte_strings)
+        content_identifiers = []
+        spills = []
+        with self._lock:
+            for byte_string in byte_strings:
+                identifier = sha256(byte_string).hexdigest()
+                spills += self._insert(identifier, byte_string, self.write_back)
+                content_identifiers.append(identifier)
+        self._spill(spills)
+        return content_identifiers
+
+    def add_stream(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        # The content is not kept in the hot tier, as it may be large:
+        return self.cold_db.add_stream(fileobj, chunk_size)
+
+    def open(self, identifier):
+        validate_identifier_format(identifier)
+        with self._lock:
+            content = self._hot(identifier)
+        if content is None:
+            return self.cold_db.open(identifier)
+        return BytesIO(content)
+
+    def read_range(self, identifier, offset, length):
+        validate_identifier_format(identifier)
+        with self._lock:
+            content = self._hot(identifier)
+        if content is None:
+            return self.cold_db.read_range(identifier, offset, length)
+        return buffer(content, offset, length)
+
+    def __delitem__(self, identifier):
+        validate_identifier_format(identifier)
+        with self._lock:
+            content = self._hot_items.pop(identifier, None)
+            dirty = identifier in self._dirty
+            if content is not None:
+                self.hot_bytes -= len(content)
+            # If being spilled, _spill() deletes it from the cold tier:
+            if self._spilling.pop(identifier, None) is not None:
+                self._dirty.discard(identifier)
+                return
+            self._dirty.discard(identifier)
+        # Dirty content may also be in the cold tier, if it was added again:
+        if dirty and identifier not in self.cold_db:
+            return
+        del self.cold_db[identifier]
+
+    def flush(self, identifiers=None):
+        """
+        Write dirty content (or only the given identifiers) to the cold tier.
+        """
+        with self._lock:
+            if identifiers is None:
+                identifiers = self._dirty
+            # Including content another thread is spilling right now, which
+            # must have reached the cold tier when this returns:
+            spills = [(i, self._hot_items[i] if i in self._hot_items
+                              else self._spilling[i])
+                      for i in identifiers if i in self._dirty]
+        if not spills: return
+        # The content stays in the hot tier, so it can be read meanwhile:
+        self.cold_db.add_many([content for _, content in spills])
+        with self._lock:
+            self._dirty.difference_update(i for i, _ in spills)
+            self.stats["spills"] += len(spills)
+
+
+class _GentlePointerDB(data_store_interfaces._GentlePointerDB):
+
+    def __init__(self, cold_db, content_db):
+        super(_GentlePointerDB, self).__init__()
+        self.cold_db = cold_db
+        self.content_db = content_db
+
+    def __getitem__(self, identifier):
+        return self.cold_db[identifier]
+
+    def get_many(self, identifiers):
+        return self.cold_db.get_many(identifiers)
+
+    def find(self, partial_identifier=""):
+        return self.cold_db.find(partial_identifier)
+
+    def iterfind(self, partial_identifier="", limit=None, after=None):
+        return self.cold_db.iterfind(partial_identifier, limit, after)
+
+    def __contains__(self, identifier):
+        return identifier in self.cold_db
+
+    def contains_many(self, identifiers):
+        return self.cold_db.contains_many(identifiers)
+
+    def __setitem__(self, pointer_identifier, content_identifier):
+        # A durable pointer must not point to content only in the hot tier:
+        self.content_db.flush([content_identifier])
+        self.cold_db[pointer_identifier] = content_identifier
+        return pointer_identifier
+
+    def set_many(self, items):
+        items = list(items)
+        self.content_db.flush([c for _, c in items])
+        return self.cold_db.set_many(items)
+
+    def __delitem__(self, identifier):
+        del self.cold_db[identifier]
+
+
+class GentleDataStore(data_store_interfaces.GentleDataStore):
+
+    def __init__(self, data_store, max_hot_bytes=DEFAULT_MAX_HOT_BYTES,
+                 write_back=False):
+        """
+        data_store is the cold tier.  The hot tier holds up to max_hot_bytes of
+        content.
+        """
+        super(GentleDataStore, self).__init__()
+        self.data_store = data_store
+        self.content_db = _GentleContentDB(data_store.content_db,
+                                           max_hot_bytes, write_back)
+        self.pointer_db = _GentlePointerDB(data_store.pointer_db, self.content_db)
+
+    def flush(self):
+        """
+        Write all content only in the hot tier to the cold tier.
+        """
+        self.content_db.flush()
+
+    def close(self):
+        self.flush()
+        if hasattr(self.data_store, "close"):
+            self.data_store.close()
+
+    def stats(self):
+        """
+        Return the hit, miss, promotion, demotion and spill counters and the
+        number and size of the items in the hot tier.
+        """
+        db = self.content_db
+        with db._lock:
+            return dict(db.stats, hot_items=len(db._hot_items), hot_bytes=db.hot_bytes,
+                        dirty=len(db._dirty))
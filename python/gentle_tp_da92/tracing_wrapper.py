@@ -0,0 +1,472 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - Tracing Wrapper Data Store Module.
+
+Wraps another data store and records every operation on either database in a
+compact binary trace file: the operation, the identifiers involved, the sizes
+of the content, and when the operation started and how long it took.  The
+content itself is not recorded.
+
+replay() re-executes a trace against another data store, with synthetic
+content of the recorded sizes, and reports the throughput and latencies.  Use
+it to compare data store implementations on a real access pattern:
+
+    $ python -m gentle_tp_da92 --implementation gentle_tp_da92.memory_based \\
+          replay production.trace
+
+Usage example:
+>>> from gentle_tp_da92 import tracing_wrapper, fs_based, memory_based
+>>> data_store = tracing_wrapper.GentleDataStore(fs_based.GentleDataStore(d),
+...                                              "production.trace")
+>>> ...
+>>> data_store.close()
+>>> report = tracing_wrapper.replay("production.trace", memory_based.GentleDataStore())
+>>> report["operations_per_second"]
+12345.6
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import absolute_import
+
+from   collections import namedtuple
+from   hashlib import sha256
+from   io import BytesIO
+import struct
+import threading
+import time
+
+from   . import data_store_interfaces
+from   . import metrics_wrapper
+from   .utilities import *
+
+
+_MAGIC = "GTPTRC1\n"
+_HEADER = struct.Struct("<8sd")  # magic, time the trace was started
+
+# operation, database kind ('c' or 'p'), flags, number of hex digits in the
+# identifier, identifier, value (a content identifier), size, offset (or the
+# number of items of a batch operation), start time relative to the header
+# time, duration:
+_RECORD = struct.Struct("<BcBB32s32sQQdd")
+
+_ERROR, _HAS_VALUE = 1, 2
+
+OPERATIONS = ("get", "contains", "find", "iterfind", "add", "add_stream",
+              "open", "read_range", "del", "set",
+              "get_many", "contains_many", "add_many", "set_many")
+_OPERATION_CODES = dict((operation, code) for code, operation in enumerate(OPERATIONS))
+_BATCH_OPERATIONS = ("get_many", "contains_many", "add_many", "set_many")
+_ADD_OPERATIONS = ("add", "add_stream", "add_many")
+
+
+TraceRecord = namedtuple("TraceRecord", "operation kind error identifier value "
+                                        "size offset start duration")
+
+
+def _pack_identifier(identifier):
+    """
+    Return the number of hex digits and the padded binary form of a (partial)
+    identifier.
+    """
+    if not identifier or not is_identifier_format_valid(identifier, partial=True):
+        return 0, "\0" * (IDENTIFIER_LENGTH / 2)
+    digits = len(identifier)
+    padded = identifier + "0" * (IDENTIFIER_LENGTH - digits)
+    return digits, padded.decode("hex")
+
+
+class _Tracer(object):
+    """
+    Writes trace records to a file, from any number of threads.
+    """
+
+    def __init__(self, tracefile):
+        super(_Tracer, self).__init__()
+        if isinstance(tracefile, basestring):
+            tracefile = open(tracefile, "wb")
+        self.file = tracefile
+        self.time = time.time()
+        self._lock = threading.Lock()
+        self.file.write(_HEADER.pack(_MAGIC, self.time))
+
+    def pack(self, operation, kind, start, duration, error, identifier="",
+             value="", size=0, offset=0):
+        """
+        Return a trace record, for write().
+        """
+        flags = (_ERROR if error else 0) | (_HAS_VALUE if value else 0)
+        digits, identifier = _pack_identifier(identifier)
+        value = _pack_identifier(value)[1]
+        return _RECORD.pack(_OPERATION_CODES[operation], kind, flags, digits,
+                            identifier, value, size, offset,
+                            start - self.time, duration)
+
+    def write(self, records):
+        """
+        Write packed records in one piece, so that the records of a batch
+        operation stay together.
+        """
+        with self._lock:
+            self.file.write("".join(records))
+
+    def record(self, *args, **kwargs):
+        self.write([self.pack(*args, **kwargs)])
+
+    def close(self):
+        with self._lock:
+            self.file.close()
+
+
+def read_trace(tracefile):
+    """
+    Generate the TraceRecord tuples of a trace file (a filename or a file
+    object).  Times are in seconds since the start of the trace.
+    """
+    if isinstance(tracefile, basestring):
+        tracefile = open(tracefile, "rb")
+    magic, _ = _HEADER.unpack(tracefile.read(_HEADER.size))
+    if magic != _MAGIC:
+        raise GentleException("not a trace file: %r" % tracefile)
+    while True:
+        data = tracefile.read(_RECORD.size)
+        if len(data) < _RECORD.size: return
+        (code, kind, flags, digits, identifier, value, size, offset, start,
+         duration) = _RECORD.unpack(data)
+        yield TraceRecord(OPERATIONS[code], kind, bool(flags & _ERROR),
+                          identifier.encode("hex")[:digits],
+                          value.encode("hex") if flags & _HAS_VALUE else "",
+                          size, offset, start, duration)
+
+
+class _GentleDB(data_store_interfaces._GentleDB):
+
+    def __init__(self, db, tracer, kind):
+        super(_GentleDB, self).__init__()
+        self.db = db
+        self.tracer = tracer
+        self.kind = kind
+
+    def _call(self, operation, function, args, identifier="", value="",
+              size=0, offset=0):
+        """
+        Call function(*args) and trace the call.  identifier, value and size
+        may be functions computing them from the result.
+        """
+        start = time.time()
+        error = False
+        result = None
+        try:
+            result = function(*args)
+            return result
+        except:
+            error = True
+            raise
+        finally:
+            if callable(identifier):
+                identifier = "" if error else identifier(result)
+            if callable(value):
+                value = "" if error else value(result)
+            if callable(size):
+                size = 0 if error else size(result)
+            self.tracer.record(operation, self.kind, start, time.time() - start,
+                               error, identifier, value, size, offset)
+
+    def _call_many(self, operation, function, items, identifiers, values=None,
+                   sizes=None):
+        """
+        Call function(items) and trace one record per item.  The first record
+        holds the duration and the number of items of the batch.  identifiers,
+        values and sizes are functions computing lists from the result.
+        """
+        pack = self.tracer.pack
+        start = time.time()
+        try:
+            result = function(items)
+        except:
+            duration = time.time() - start
+            self.tracer.write([pack(operation, self.kind, start,
+                                    0 if i else duration, True, identifier,
+                                    offset=0 if i else len(items))
+                               for i, identifier in enumerate(identifiers(None))])
+            raise
+        duration = time.time() - start
+        values = values(result) if values else [""] * len(items)
+        sizes = sizes(result) if sizes else [0] * len(items)
+        self.tracer.write([pack(operation, self.kind, start, 0 if i else duration,
+                                False, identifier, value, size,
+                                0 if i else len(items))
+                           for i, (identifier, value, size)
+                           in enumerate(zip(identifiers(result), values, sizes))])
+        return result
+
+    def __getitem__(self, identifier):
+        value = ""
+        if self.kind == "p":  # record the content identifier pointed to
+            value = lambda content_identifier: content_identifier
+        return self._call("get", self.db.__getitem__, (identifier,), identifier,
+                          value, len)
+
+    def get_many(self, identifiers):
+        identifiers = list(identifiers)
+        values = None
+        if self.kind == "p":
+            values = lambda result: result
+        return self._call_many("get_many", self.db.get_many, identifiers,
+                               lambda result: identifiers, values,
+                               lambda result: map(len, result))
+
+    def find(self, partial_identifier=""):
+        return self._call("find", self.db.find, (partial_identifier,),
+                          partial_identifier, size=len)
+
+    def iterfind(self, partial_identifier="", limit=None, after=None):
+        return self._call("iterfind", self.db.iterfind,
+                          (partial_identifier, limit, after),
+                          partial_identifier, after or "", limit or 0)
+
+    def __contains__(self, identifier):
+        # The size records whether the identifier has been found:
+        return self._call("contains", self.db.__contains__, (identifier,),
+                          identifier, size=int)
+
+    def contains_many(self, identifiers):
+        identifiers = list(identifiers)
+        return self._call_many("contains_many", self.db.contains_many,
+                               identifiers, lambda result: identifiers,
+                               sizes=lambda result: map(int, result))
+
+class _GentleContentDB(data_store_interfaces._GentleContentDB, _GentleDB):
+
+    def __init__(self, db, tracer):
+        super(_GentleContentDB, self).__init__(db, tracer, "c")
+
+    def __add__(self, byte_string):
+        return self._call("add", self.db.__add__, (byte_string,),
+                          lambda content_identifier: content_identifier,
+                          size=len(byte_string))
+
+    def add_many(self, byte_strings):
+        byte_strings = list(byte_strings)
+        return self._call_many("add_many", self.db.add_many, byte_strings,
+                               lambda result: result or [""] * len(byte_strings),
+                               sizes=lambda result: map(len, byte_strings))
+
+    def add_stream(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        reader = metrics_wrapper._CountingReader(fileobj)
+        return self._call("add_stream", self.db.add_stream, (reader, chunk_size),
+                          lambda content_identifier: content_identifier,
+                          size=lambda content_identifier: reader.count)
+
+    def open(self, identifier):
+        return self._call("open", self.db.open, (identifier,), identifier)
+
+    def __delitem__(self, identifier):
+        return self._call("del", self.db.__delitem__, (identifier,), identifier)
+
+    def read_range(self, identifier, offset, length):
+        return self._call("read_range", self.db.read_range,
+                          (identifier, offset, length), identifier,
+                          size=length, offset=offset)
+
+
+class _GentlePointerDB(data_store_interfaces._GentlePointerDB, _GentleDB):
+
+    def __init__(self, db, tracer):
+        super(_GentlePointerDB, self).__init__(db, tracer, "p")
+
+    def __setitem__(self, pointer_identifier, content_identifier):
+        self._call("set", self.db.__setitem__,
+                   (pointer_identifier, content_identifier),
+                   pointer_identifier, content_identifier)
+        return pointer_identifier
+
+    def set_many(self, items):
+        items = list(items)
+        return self._call_many("set_many", self.db.set_many, items,
+                               lambda result: [p for p, c in items],
+                               lambda result: [c for p, c in items])
+
+    def __delitem__(self, identifier):
+        return self._call("del", self.db.__delitem__, (identifier,), identifier)
+
+
+class GentleDataStore(data_store_interfaces.GentleDataStore):
+
+    def __init__(self, data_store, tracefile):
+        """
+        tracefile is the name of the trace file to (over)write, or a file
+        object opened for writing.
+        """
+        super(GentleDataStore, self).__init__()
+        self.data_store = data_store
+        self.tracer = _Tracer(tracefile)
+        self.content_db = _GentleContentDB(data_store.content_db, self.tracer)
+        self.pointer_db = _GentlePointerDB(data_store.pointer_db, self.tracer)
+
+    def close(self):
+        """
+        Close the trace file.
+        """
+        self.tracer.close()
+
+
+## REPLAY ##
+
+def _synthetic_content(identifier, size):
+    """
+    Return deterministic content of the given size to stand in for the
+    recorded content with the given identifier.
+    """
+    block = sha256(identifier).digest()
+    return (block * (size // len(block) + 1))[:size]
+
+
+def _prepare(records, data_store, content_map):
+    """
+    Create the items that the traced process found in its data store without
+    having created them itself during the trace.
+    """
+    content_sizes = {}
+    pointers = {}
+    created = set()
+    for r in records:
+        key = (r.kind, r.identifier)
+        if r.error or len(r.identifier) != IDENTIFIER_LENGTH or key in created:
+            continue
+        if r.operation in _ADD_OPERATIONS or r.operation in ("set", "set_many"):
+            created.add(key)
+        elif r.operation in ("contains", "contains_many") and not r.size:
+            continue  # found missing
+        elif r.kind == "c":
+            size = r.size if r.operation in ("get", "get_many") else 0
+            if r.operation == "read_range":
+                size = r.offset + r.size
+            content_sizes[r.identifier] = max(size, content_sizes.get(r.identifier, 0))
+        elif r.kind == "p" and r.operation in ("get", "get_many"):
+            pointers[r.identifier] = r.value
+        elif r.kind == "p":
+            pointers.setdefault(r.identifier, "")
+    for identifier, size in content_sizes.iteritems():
+        content_map[identifier] = data_store.content_db + _synthetic_content(identifier, size)
+    for pointer_identifier, value in pointers.iteritems():
+        if value not in content_map:
+            content_map[value] = data_store.content_db + _synthetic_content(value, 0)
+        data_store.pointer_db[pointer_identifier] = content_map[value]
+
+
+def _replay_operation(data_store, group, content_map):
+    r = group[0]
+    operation = r.operation
+    m = lambda identifier: content_map.get(identifier, identifier)
+    if r.kind == "c":
+        db = data_store.content_db
+        if operation == "get":
+            db[m(r.identifier)]
+        elif operation == "get_many":
+            db.get_many([m(g.identifier) for g in group])
+        elif operation == "contains":
+            m(r.identifier) in db
+        elif operation == "contains_many":
+            db.contains_many([m(g.identifier) for g in group])
+        elif operation == "add":
+            content = _synthetic_content(r.identifier, r.size)
+            content_map[r.identifier] = db + content
+        elif operation == "add_stream":
+            content = _synthetic_content(r.identifier, r.size)
+            content_map[r.identifier] = db.add_stream(BytesIO(content))
+        elif operation == "add_many":
+            contents = [_synthetic_content(g.identifier, g.size) for g in group]
+            for g, identifier in zip(group, db.add_many(contents)):
+                content_map[g.identifier] = identifier
+        elif operation == "open":
+            db.open(m(r.identifier)).read()
+        elif operation == "read_range":
+            db.read_range(m(r.identifier), r.offset, r.size)
+        elif operation == "del":
+            del db[m(r.identifier)]
+        elif operation == "find":
+            db.find(r.identifier)
+        elif operation == "iterfind":
+            list(db.iterfind(r.identifier, r.size or None, r.value or None))
+    else:
+        db = data_store.pointer_db
+        if operation == "get":
+            db[r.identifier]
+        elif operation == "get_many":
+            db.get_many([g.identifier for g in group])
+        elif operation == "contains":
+            r.identifier in db
+        elif operation == "contains_many":
+            db.contains_many([g.identifier for g in group])
+        elif operation == "set":
+            db[r.identifier] = m(r.value)
+        elif operation == "set_many":
+            db.set_many([(g.identifier, m(g.value)) for g in group])
+        elif operation == "del":
+            del db[r.identifier]
+        elif operation == "find":
+            db.find(r.identifier)
+        elif operation == "iterfind":
+            list(db.iterfind(r.identifier, r.size or None, r.value or None))
+
+
+def replay(tracefile, data_store, realtime=False):
+    """
+    Re-execute the operations of a trace against a data store, and return a
+    report as a dictionary.
+
+    Content identifiers are mapped to those of the synthetic content created in
+    their place.  Pointer identifiers are used as recorded.  Items that existed
+    before the trace started are created first, untimed.  With realtime=True,
+    operations are started at their recorded times, otherwise as fast as
+    possible.
+    """
+    records = list(read_trace(tracefile))
+    content_map = {}
+    _prepare(records, data_store, content_map)
+    metered = metrics_wrapper.GentleDataStore(data_store)
+
+    operations = errors = expected_errors = 0
+    start = time.time()
+    i = 0
+    while i < len(records):
+        r = records[i]
+        count = max(r.offset, 1) if r.operation in _BATCH_OPERATIONS else 1
+        group = records[i:i + count]
+        i += count
+        if realtime:
+            delay = start + r.start - time.time()
+            if delay > 0:
+                time.sleep(delay)
+        operations += 1
+        try:
+            _replay_operation(metered, group, content_map)
+        except Exception:
+            errors += 1
+            expected_errors += r.error
+    seconds = time.time() - start
+
+    return dict(
+        operations=operations,
+        errors=errors,
+        unexpected_errors=errors - expected_errors,
+        seconds=seconds,
+        operations_per_second=operations / seconds if seconds else 0.0,
+        recorded_seconds=records[-1].start + records[-1].duration if records else 0.0,
+        metrics=metered.snapshot(),
+        )
@@ -21,6 +21,7 @@ This module provides some utility functions to the Gentle Core Module.
 # You should have received a copy of the GNU Lesser General Public
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import itertools
 import os
 
 
@@ -29,6 +30,9 @@ import os
 IDENTIFIER_LENGTH = 256 / 4
 IDENTIFIER_DIGITS = "0123456789abcdef"
 
+# Default number of bytes read at once when entering content from a file:
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
 
 ## EXCEPTIONS
 
@@ -49,6 +53,16 @@ class InvalidIdentifierException(GentleException, LookupError):
 def create_file_with_mode(filename, mode):
     return os.fdopen(os.open(filename, os.O_CREAT | os.O_WRONLY, mode), "wb")
 
+def page_identifiers(sorted_identifiers, limit=None, after=None):
+    """
+    Return an iterator over at most limit of the sorted identifiers, skipping
+    those up to and including after.
+    """
+    if after is not None:
+        sorted_identifiers = itertools.dropwhile(lambda i: i <= after,
+                                                 sorted_identifiers)
+    return itertools.islice(sorted_identifiers, limit)
+
 def random():
     """
     Return a random-generated 256-bit number in hexadecimal representation.
@@ -57,6 +71,16 @@ def random():
     """
     return os.urandom(256 / 8).encode("hex")
 
+def read_chunks(fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Read a file-like object to its end, yielding chunks of at most chunk_size
+    bytes.
+    """
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk: return
+        yield chunk
+
 def is_identifier_format_valid(identifier, partial=False):
     if not isinstance(identifier, basestring): return False
     if not (len(identifier) <= IDENTIFIER_LENGTH and
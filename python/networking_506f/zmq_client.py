@@ -19,15 +19,27 @@ Gentle TP-DA92 - ZeroMQ-based Client.
 # You should have received a copy of the GNU Lesser General Public
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.#!/usr/bin/env python
 
+from   hashlib import sha256
+from   io import BytesIO
+
 import zmq
 
+from   gentle_tp_da92 import chunking as _chunking
 from   gentle_tp_da92 import data_store_interfaces
 from   gentle_tp_da92.utilities import *
+from   networking_506f.zmq_protocol import *
 
 
 class NetworkException(Exception): pass
 
 
+# Number of identifiers iterfind() fetches per request:
+FIND_PAGE_SIZE = 10000
+
+# Number of chunks add_stream() asks the server about per request:
+CHUNK_QUERY_SIZE = 64
+
+
 def send_command(db, command, payload):
     socket, kind = db.socket, db.kind
     socket.send("%s %s %s\0" % (kind, command, payload))
@@ -57,17 +69,106 @@ class _GentleDB(data_store_interfaces._GentleDB):
         identifiers = reply.split()
         return identifiers
 
+    def iterfind(self, partial_identifier="", limit=None, after=None):
+        validate_identifier_format(partial_identifier, partial=True)
+        # Fetch pages, using the last identifier received as the cursor:
+        while limit is None or limit > 0:
+            page_size = FIND_PAGE_SIZE if limit is None else min(limit, FIND_PAGE_SIZE)
+            reply = self._send_command("findpage", "%s %s %u" % (
+                partial_identifier, after or "", page_size))
+            identifiers = reply.split()
+            for identifier in identifiers:
+                yield identifier
+            if len(identifiers) < page_size: return
+            after = identifiers[-1]
+            if limit is not None:
+                limit -= len(identifiers)
+
     def __contains__(self, identifier):
         reply = self._send_command("contains", identifier)
         return reply == "yes"
 
+    def get_many(self, identifiers):
+        identifiers = list(identifiers)
+        for identifier in identifiers:
+            validate_identifier_format(identifier)
+        reply = self._send_command("getmany", " ".join(identifiers))
+        return decode_list(reply)
+
+    def contains_many(self, identifiers):
+        reply = self._send_command("containsmany", " ".join(identifiers))
+        return [r == "yes" for r in reply.split()]
+
 
 class _GentleContentDB(data_store_interfaces._GentleContentDB, _GentleDB):
+    """
+    With a chunker, large content is split into chunks (see
+    gentle_tp_da92.chunking), and only the chunks the server does not have
+    yet are sent.  This saves transfers if the server stores content chunked
+    using the same chunk sizes, e.g. of successive versions of a large file.
+    """
+
+    def __init__(self, socket, chunker=None):
+        super(_GentleContentDB, self).__init__(socket)
+        self.chunker = chunker
 
     def __add__(self, byte_string):
+        if self.chunker is not None and self.chunker.wants(len(byte_string)):
+            return self.add_stream(BytesIO(byte_string))
         content_identifier = self._send_command("add", byte_string)
         return content_identifier
 
+    def add_many(self, byte_strings):
+        reply = self._send_command("addmany", encode_list(byte_strings))
+        content_identifiers = reply.split()
+        return content_identifiers
+
+    def add_stream(self, fileobj, chunk_size=DEFAULT_CHUNK_SIZE):
+        # The server spools the chunks of a stream, identified by a token:
+        token = self._send_command("addstream", "")
+        try:
+            if self.chunker is None:
+                for chunk in read_chunks(fileobj, chunk_size):
+                    self._send_command("addchunk", token + " " + chunk)
+            else:
+                chunks = []
+                for chunk in self.chunker.iter_chunks(read_chunks(fileobj, chunk_size)):
+                    chunks.append(chunk)
+                    if len(chunks) == CHUNK_QUERY_SIZE:
+                        self._send_chunks(token, chunks)
+                        chunks = []
+                self._send_chunks(token, chunks)
+        except:
+            self._send_command("addabort", token)
+            raise
+        content_identifier = self._send_command("addend", token)
+        return content_identifier
+
+    def _send_chunks(self, token, chunks):
+        """
+        Append chunks to the stream token, sending only those the server
+        does not have.
+        """
+        if not chunks: return
+        identifiers = [sha256(chunk).hexdigest() for chunk in chunks]
+        reply = self._send_command("havechunks", " ".join(identifiers))
+        known = []  # consecutive chunks the server has, sent as one request
+        for identifier, chunk, have in zip(identifiers, chunks, reply.split()):
+            if have == "yes":
+                known.append(identifier)
+                continue
+            if known:
+                self._send_command("addknownchunks", token + " " + " ".join(known))
+                known = []
+            self._send_command("addchunk", token + " " + chunk)
+        if known:
+            self._send_command("addknownchunks", token + " " + " ".join(known))
+
+    def read_range(self, identifier, offset, length):
+        validate_identifier_format(identifier)
+        content = self._send_command("getrange", "%s %u %u" % (identifier, offset, length))
+        return buffer(content)
+
 
 class _GentlePointerDB(data_store_interfaces._GentlePointerDB, _GentleDB):
 
@@ -77,6 +178,14 @@ class _GentlePointerDB(data_store_interfaces._GentlePointerDB, _GentleDB):
         self._send_command("set", pointer_identifier + " " + content_identifier)
         return pointer_identifier
 
+    def set_many(self, items):
+        items = list(items)
+        for pointer_identifier, content_identifier in items:
+            validate_identifier_format(pointer_identifier)
+            validate_identifier_format(content_identifier)
+        self._send_command("setmany", " ".join(p + " " + c for p, c in items))
+        return [pointer_identifier for pointer_identifier, _ in items]
+
     def __delitem__(self, identifier):
         validate_identifier_format(identifier)
         self._send_command("del", identifier)
@@ -84,7 +193,12 @@ class _GentlePointerDB(data_store_interfaces._GentlePointerDB, _GentleDB):
 
 class GentleDataStore(data_store_interfaces.GentleDataStore):
 
-    def __init__(self, socket_or_address):
+    def __init__(self, socket_or_address, chunking=None):
+        """
+        chunking is None, True or a gentle_tp_da92.chunking.Chunker, for
+        sending only the chunks of large content the server does not have
+        (see _GentleContentDB).
+        """
         super(GentleDataStore, self).__init__()
         if isinstance(socket_or_address, basestring):
             context = zmq.Context()
@@ -92,5 +206,5 @@ class GentleDataStore(data_store_interfaces.GentleDataStore):
             socket.connect(socket_or_address)
         else:
             socket = socket_or_address
-        self.content_db = _GentleContentDB(socket)
+        self.content_db = _GentleContentDB(socket, _chunking.get_chunker(chunking))
         self.pointer_db = _GentlePointerDB(socket)
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Gentle TP-DA92 - ZeroMQ Protocol Helpers.
+
+Requests are "<kind> <command> <payload>\\0", where kind is "c" (content
+database) or "p" (pointer database).  Replies are "ok <payload>\\0" or
+"error <message>\\0".  The payloads of batch commands are lists of byte
+strings, encoded as "<length>:<bytes>" back to back.
+"""
+# Copyright (C) 2010, 2011  Felix Rabe
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+def encode_list(byte_strings):
+    """
+    Encode a list of byte strings into one byte string.
+    """
+    return "".join("%u:%s" % (len(b), b) for b in byte_strings)
+
+
+def decode_list(data):
+    """
+    Inverse of encode_list().
+    """
+    byte_strings = []
+    offset = 0
+    while offset < len(data):
+        colon = data.index(":", offset)
+        start = colon + 1
+        end = start + int(data[offset:colon])
+        if end > len(data):
+            raise ValueError("truncated list")
+        byte_strings.append(data[start:end])
+        offset = end
+    return byte_strings
@@ -19,12 +19,20 @@ Gentle TP-DA92 - ZeroMQ-based Server.
 # You should have received a copy of the GNU Lesser General Public
 # License along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import tempfile
+import time
 from   traceback import print_exc
 
 import zmq
 
 from   gentle_tp_da92 import data_store_interfaces
 from   gentle_tp_da92.utilities import *
+from   networking_506f.zmq_protocol import *
+
+
+# Unfinished add_stream() uploads without a chunk for this many seconds are
+# considered abandoned, and their spool files closed:
+STREAM_TIMEOUT = 600
 
 
 class GentleDataStore(data_store_interfaces.GentleDataStore):
@@ -34,10 +42,20 @@ class GentleDataStore(data_store_interfaces.GentleDataStore):
         self.data_store = data_store_to_serve
         self.content_db = self.data_store.content_db
         self.pointer_db = self.data_store.pointer_db
+        # token -> [spool file, time of the last chunk] of an unfinished
+        # add_stream():
+        self._streams = {}
 
     def _command_get(self, db, payload):
         return db[payload]
 
+    def _command_getrange(self, db, payload):
+        identifier, offset, length = payload.split()
+        return str(db.read_range(identifier, int(offset), int(length)))
+
+    def _command_getmany(self, db, payload):
+        return encode_list(db.get_many(payload.split()))
+
     def _command_del(self, db, payload):
         del db[payload]
         return ""
@@ -45,17 +63,89 @@ class GentleDataStore(data_store_interfaces.GentleDataStore):
     def _command_find(self, db, payload):
         return " ".join(db.find(payload))
 
+    def _command_findpage(self, db, payload):
+        partial_identifier, after, limit = payload.split(" ")
+        return " ".join(db.iterfind(partial_identifier, int(limit), after or None))
+
     def _command_contains(self, db, payload):
         return "yes" if payload in db else "no"
 
+    def _command_containsmany(self, db, payload):
+        return " ".join("yes" if r else "no" for r in db.contains_many(payload.split()))
+
     def _command_add(self, db, payload):
         return db + payload
 
+    def _command_addmany(self, db, payload):
+        return " ".join(db.add_many(decode_list(payload)))
+
+    def _expire_streams(self):
+        expiry = time.time() - STREAM_TIMEOUT
+        for token, (f, last_chunk) in self._streams.items():
+            if last_chunk < expiry:
+                del self._streams[token]
+                f.close()
+
+    def _command_addstream(self, db, payload):
+        self._expire_streams()
+        token = random()
+        self._streams[token] = [tempfile.TemporaryFile(), time.time()]
+        return token
+
+    def _command_addchunk(self, db, payload):
+        token, chunk = payload.split(" ", 1)
+        stream = self._streams[token]
+        stream[0].write(chunk)
+        stream[1] = time.time()
+        return ""
+
+    def _chunk_db(self, db):
+        """
+        Return the database holding the chunks of db (see
+        gentle_tp_da92.chunking), or None if it does not store content
+        chunked.
+        """
+        if db is not self.content_db or getattr(db, "chunker", None) is None:
+            return None
+        return db._chunk_db()
+
+    def _command_havechunks(self, db, payload):
+        identifiers = payload.split()
+        chunk_db = self._chunk_db(db)
+        if chunk_db is None:
+            return " ".join("no" for identifier in identifiers)
+        return " ".join("yes" if r else "no" for r in chunk_db.contains_many(identifiers))
+
+    def _command_addknownchunks(self, db, payload):
+        token, identifiers = payload.split(" ", 1)
+        chunk_db = self._chunk_db(db)
+        if chunk_db is None:
+            raise GentleException("content is not stored chunked")
+        stream = self._streams[token]
+        for identifier in identifiers.split():
+            stream[0].write(chunk_db[identifier])
+        stream[1] = time.time()
+        return ""
+
+    def _command_addend(self, db, payload):
+        with self._streams.pop(payload)[0] as f:
+            f.seek(0)
+            return db.add_stream(f)
+
+    def _command_addabort(self, db, payload):
+        self._streams.pop(payload)[0].close()
+        return ""
+
     def _command_set(self, db, payload):
         pointer_identifier, content_identifier = payload.split()
         db[pointer_identifier] = content_identifier
         return ""
 
+    def _command_setmany(self, db, payload):
+        identifiers = payload.split()
+        db.set_many(zip(identifiers[0::2], identifiers[1::2]))
+        return ""
+
     def process_msg(self, msg):
         kind, command, payload = msg[:-1].split(" ", 2)
         db = {"c": self.content_db, "p": self.pointer_db}[kind]